@@ -0,0 +1,220 @@
+import os
+import io
+import json
+import time
+import zlib
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import urllib.request
+import urllib.error
+import typing as T
+
+from zenlog import log as logging
+from accendino.extract import ExtractError, checkDestination
+from accendino.manifest import InstallManifest
+
+
+CACHE_METADATA_FILE = 'accendino-cache.json'
+
+
+def computeKey(items: T.Dict[str, T.Any]) -> str:
+    ''' computes a content-addressed key from a JSON serializable dictionary '''
+    content = json.dumps(items, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf8')).hexdigest()
+
+
+def relocateFile(fpath: str, oldPrefix: str, newPrefix: str) -> bool:
+    ''' rewrites oldPrefix by newPrefix in a text file, binary files are left untouched
+        @return if the file was modified
+    '''
+    if os.path.islink(fpath) or not os.path.isfile(fpath):
+        return False
+
+    with open(fpath, 'rb') as f:
+        content = f.read()
+
+    old = oldPrefix.encode('utf8')
+    if b'\0' in content or old not in content:
+        return False
+
+    with open(fpath, 'wb') as f:
+        f.write(content.replace(old, newPrefix.encode('utf8')))
+    return True
+
+
+def hasBinaryReference(fpath: str, prefix: str) -> bool:
+    ''' tells if a binary file (like an ELF RPATH) contains prefix, relocateFile() can't rewrite it '''
+    if os.path.islink(fpath) or not os.path.isfile(fpath):
+        return False
+
+    with open(fpath, 'rb') as f:
+        content = f.read()
+    return b'\0' in content and prefix.encode('utf8') in content
+
+
+class BinaryCache:
+    ''' a content-addressed cache of installed artifacts, stored in a local (possibly NFS shared) directory
+        or on an HTTP server (entries are retrieved with GET and pushed with PUT)
+    '''
+
+    def __init__(self, location: str) -> None:
+        '''
+            @param location: a directory or an http(s) URL
+        '''
+        self.location = location.rstrip('/')
+        self.isHttp = location.startswith('http://') or location.startswith('https://')
+
+        if not self.isHttp:
+            os.makedirs(self.location, exist_ok=True)
+
+    def _entryName(self, key: str) -> str:
+        return f'{key[0:2]}/{key}.tar.gz'
+
+    def _fetch(self, key: str, tmpDir: str) -> str:
+        ''' retrieves the archive for key, returns its local path or None '''
+        if not self.isHttp:
+            path = os.path.join(self.location, self._entryName(key))
+            return path if os.path.isfile(path) else None
+
+        localPath = os.path.join(tmpDir, f'{key}.tar.gz')
+        try:
+            with urllib.request.urlopen(f'{self.location}/{self._entryName(key)}') as response, \
+                    open(localPath, 'wb') as f:
+                shutil.copyfileobj(response, f)
+        except (urllib.error.URLError, OSError) as e:
+            logging.debug(f'binary cache miss for {key}: {e}')
+            return None
+        return localPath
+
+    @staticmethod
+    def _checkMember(m: tarfile.TarInfo) -> None:
+        ''' checks what can be checked on a member before anything is extracted
+            @raise ExtractError if the member is invalid
+        '''
+        if m.name.startswith('/') or '..' in m.name.split('/'):
+            raise ExtractError(f'invalid path {m.name}')
+
+        if m.issym() or m.islnk():
+            if os.path.isabs(m.linkname):
+                raise ExtractError(f'link {m.name} points to absolute path {m.linkname}')
+        elif not (m.isfile() or m.isdir()):
+            raise ExtractError(f'special file {m.name}')
+
+    def restore(self, key: str, prefix, previous: InstallManifest = None) -> T.List[str]:
+        '''
+            restores the files of a cache entry in the prefix, relocating text files if the entry was
+            built for another prefix (entries with binaries referencing their prefix are then a miss).
+            The entry is extracted and relocated in a staging directory next to the prefix and then merged
+            in it, so that an invalid or truncated entry leaves the prefix untouched
+            @param previous: the manifest of the files previously installed by the artifact, identical files are
+                not copied again (see InstallManifest.mergeInto())
+            @return the list of restored files or None on cache miss
+        '''
+        newPrefix = str(prefix)
+        # entries may come from a shared location, members must not escape the prefix (see checkDestination())
+        extractArgs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+
+        with tempfile.TemporaryDirectory(prefix='accendino-cache-') as tmpDir:
+            archivePath = self._fetch(key, tmpDir)
+            if archivePath is None:
+                return None
+
+            stageDir = None
+            try:
+                with tarfile.open(archivePath, 'r:gz') as tar:
+                    meta = json.load(tar.extractfile(CACHE_METADATA_FILE))
+                    oldPrefix = meta.get('prefix')
+                    if oldPrefix and oldPrefix != newPrefix and not meta.get('relocatable', False):
+                        logging.debug(f'cache entry {key} has binaries referencing {oldPrefix}, it can\'t be relocated')
+                        return None
+
+                    members = [m for m in tar.getmembers() if m.name != CACHE_METADATA_FILE]
+                    for m in members:
+                        self._checkMember(m)
+
+                    parentDir = os.path.dirname(os.path.abspath(newPrefix))
+                    os.makedirs(parentDir, exist_ok=True)
+                    stageDir = tempfile.mkdtemp(prefix='.accendino-restore-', dir=parentDir)
+
+                    # links are checked against what was already extracted, chained links can't escape
+                    for m in members:
+                        if m.issym():
+                            checkDestination(stageDir, m.name, m.linkname)
+                        elif m.islnk():
+                            checkDestination(stageDir, m.name, m.linkname, hardLink=True)
+                        else:
+                            checkDestination(stageDir, m.name)
+                        tar.extract(m, stageDir, **extractArgs)
+
+                files = [m.name for m in members if not m.isdir()]
+                if oldPrefix and oldPrefix != newPrefix:
+                    for f in files:
+                        relocateFile(os.path.join(stageDir, f), oldPrefix, newPrefix)
+
+                InstallManifest.fromFiles(stageDir, files).mergeInto(stageDir, newPrefix, previous)
+            except (tarfile.TarError, ExtractError, KeyError, ValueError, OSError, EOFError, zlib.error) as e:
+                logging.error(f'unable to restore cache entry {key}: {e}')
+                return None
+            finally:
+                if stageDir:
+                    shutil.rmtree(stageDir, ignore_errors=True)
+
+        return files
+
+    def store(self, key: str, prefix, files: T.List[str], extra: T.Dict[str, T.Any]) -> bool:
+        '''
+            stores the given files of the prefix under key
+            @param extra: some extra metadata to store with the entry
+            @return if the operation was successful
+        '''
+        meta = {
+            'key': key,
+            'prefix': str(prefix),
+            'files': files,
+            'created': time.time(),
+            # binaries referencing the prefix can only be restored in the same prefix
+            'relocatable': not any(hasBinaryReference(os.path.join(str(prefix), f), str(prefix)) for f in files),
+        }
+        meta.update(extra)
+
+        if self.isHttp:
+            tmpDir = tempfile.mkdtemp(prefix='accendino-cache-')
+            targetPath = None
+        else:
+            targetPath = os.path.join(self.location, self._entryName(key))
+            tmpDir = os.path.dirname(targetPath)
+            os.makedirs(tmpDir, exist_ok=True)
+
+        fd, tmpPath = tempfile.mkstemp(dir=tmpDir, suffix='.tmp')
+        os.close(fd)
+        try:
+            with tarfile.open(tmpPath, 'w:gz') as tar:
+                metaContent = json.dumps(meta).encode('utf8')
+                info = tarfile.TarInfo(CACHE_METADATA_FILE)
+                info.size = len(metaContent)
+                info.mtime = int(meta['created'])
+                tar.addfile(info, io.BytesIO(metaContent))
+
+                for f in files:
+                    tar.add(os.path.join(str(prefix), f), arcname=f, recursive=False)
+
+            if not self.isHttp:
+                # atomic, so that concurrent readers never see a partial entry
+                os.replace(tmpPath, targetPath)
+                return True
+
+            with open(tmpPath, 'rb') as f:
+                req = urllib.request.Request(f'{self.location}/{self._entryName(key)}', data=f.read(), method='PUT')
+            with urllib.request.urlopen(req):
+                pass
+            return True
+        except (tarfile.TarError, urllib.error.URLError, OSError) as e:
+            logging.info(f'unable to store cache entry {key}: {e}')
+            return False
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            if self.isHttp:
+                shutil.rmtree(tmpDir, ignore_errors=True)
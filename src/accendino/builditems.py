@@ -1,73 +1,177 @@
 import os
+import json
+import hashlib
 import subprocess
-import pickle
 import pathlib
+import shutil
+import threading
 import typing as T
 
+from packaging.version import Version
 from zenlog import log as logging
 from accendino.sources import Source
+from accendino.bincache import computeKey
+from accendino.confcache import autoconfFlagsKey
+from accendino.jobserver import jobsPerArtifact
+from accendino.statedb import depsFingerprints, depsConfigInterfaces, isOutdated
+from accendino.manifest import InstallManifest, BuildOverlapTracker, MANIFEST_FILE, snapshotTree, diffSnapshots, \
+    filesOwnedByOthers, filesystemTime, filesModifiedSince
 from accendino.utils import mergePkgDeps, treatPackageDeps, doMingwCrossDeps, RunInShell, as_msys2_path, \
-    getArchLibDir
+    getArchLibDir, getPathIndex, getToolVersion
 
 
-class BuildStepDump:
-    def __init__(self):
-        self.gitCommit = None
-        self.env = None
-        self.args = None
+# environment variables that change the result of a build step, in addition to the ones set by accendino (toolchain,
+# extraEnv, PKG_CONFIG_LIBDIR and PATH) and the fingerprintEnvVars of the artifact
+ENV_FINGERPRINT_VARS = (
+    'PATH', 'CC', 'CXX', 'CPP', 'LD', 'AR', 'AS', 'NM', 'RANLIB', 'STRIP', 'OBJCOPY', 'OBJDUMP', 'WINDRES', 'RC',
+    'CFLAGS', 'CXXFLAGS', 'CPPFLAGS', 'LDFLAGS', 'LIBS', 'OBJCFLAGS', 'ASFLAGS',
+    'CPATH', 'C_INCLUDE_PATH', 'CPLUS_INCLUDE_PATH', 'LIBRARY_PATH', 'LD_LIBRARY_PATH', 'ACLOCAL_PATH',
+    'INCLUDE', 'LIB', 'LIBPATH', 'PYTHONPATH', 'SOURCE_DATE_EPOCH',
+)
+ENV_FINGERPRINT_PREFIXES = ('PKG_CONFIG_', 'CMAKE_')
 
-    def __eq__(self, other) -> bool:
-        if self.gitCommit != other.gitCommit:
-            return False
 
-        # check environment
-        for k in self.env.keys():
-            if not k in other.env:
-                return False
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode('utf8')).hexdigest()[0:16]
 
-            if self.env[k] != other.env.get(k, None):
-                return False
 
-        if len(self.args) != len(other.args):
-            return False
+class ResolvedCommand(T.NamedTuple):
+    ''' a command of an artifact with its placeholders expanded and its arguments turned into strings (NativePath,
+        RunInShell), used as is to run it, to write the scripts and to compute the fingerprints
+    '''
+    args: T.Tuple[str, ...]
+    cwd: str
+    comment: str
 
-        # check commands
-        i = 0
-        for (cmds1, dir1, comment1) in self.args:
-            (cmds2, dir2, comment2) = other.args[i]
 
-            if dir1 != dir2 or comment1 != comment2:
-                return False
-
-            if isinstance(cmds1, RunInShell):
-                cmds1 = cmds1.expand()
-
-            if isinstance(cmds2, RunInShell):
-                cmds1 = cmds1.expand()
+class BuildStepDump:
+    ''' state of a build step (like the prepare step) kept in the build directory to know if it must run again.
+        Only digests of the build relevant environment variables and of the commands are stored, as JSON
+    '''
 
-            if len(cmds1) != len(cmds2):
-                return False
+    def __init__(self, env: T.Dict[str, str] = None, keys: T.Iterable[str] = (),
+                 commands: T.Tuple[ResolvedCommand, ...] = None) -> None:
+        '''
+            @param env: the environment of the step
+            @param keys: the environment variables to take in account
+            @param commands: the resolved commands of the step
+        '''
+        self.env = {k: _digest(str(env[k])) for k in keys if k in env} if env else {}
+        self.args = _digest(json.dumps(commands)) if commands is not None else None
+        # the step didn't run, the artifact was restored from the binary cache
+        self.restored = False
 
-            j = 0
-            for s1 in cmds1:
-                # check commands by stringify them for a correct NativePath comparison
-                if not isinstance(s1, str):
-                    s1 = str(s1)
+    def changedVars(self, other: 'BuildStepDump') -> T.List[str]:
+        ''' returns the environment variables that differ with another dump '''
+        return sorted(k for k in set(self.env.keys()) | set(other.env.keys()) if self.env.get(k) != other.env.get(k))
 
-                s2 = cmds2[j]
-                if not isinstance(s2, str):
-                    s2 = str(s2)
+    def __eq__(self, other) -> bool:
+        return self.args == other.args and self.env == other.env
 
-                if s1 != s2:
-                    return False
-                j += 1
+    def save(self, path) -> None:
+        with open(path, 'wt', encoding='utf8') as f:
+            json.dump({'env': self.env, 'args': self.args, 'restored': self.restored}, f, sort_keys=True)
 
-            i += 1
+    @staticmethod
+    def load(path) -> 'BuildStepDump':
+        ''' loads a dump, returns None if it doesn't exist or is invalid (like the pickled dumps of the previous
+            versions)
+        '''
+        try:
+            with open(path, 'rt', encoding='utf8') as f:
+                content = json.load(f)
+            ret = BuildStepDump()
+            ret.env = content['env']
+            ret.args = content['args']
+            ret.restored = content.get('restored', False)
+            return ret
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            logging.debug(f"unable to read the build step state {path}")
+            return None
 
-        return True
 
 PREPARE_DUMP_FILE = 'accendino.prepared'
 BUILT_FILE = 'accendino.built'
+AUTOGEN_STAMP_SUFFIX = '.accendino-autogen'
+CMAKE_SEED_FILE = 'accendino-seed.cmake'
+COMPILER_STATS_FILE = 'accendino.ccache-stats'
+CMAKE_CODEGEN_FILE = 'accendino-codegen.cmake'
+MESON_CODEGEN_FILE = 'accendino-codegen.json'
+
+# included after the project() call of cmake projects, it applies the flags of the linker and debug info settings
+# and enables parallel installs. They're passed as cache variables so that a change is seen when cmake runs again,
+# while CMAKE_<LANG>_FLAGS_INIT would only be used for the first configuration
+CMAKE_CODEGEN_CONTENT = '''include_guard(GLOBAL)
+foreach(opt IN LISTS ACCENDINO_COMPILE_OPTIONS)
+    add_compile_options($<$<COMPILE_LANGUAGE:C,CXX>:${opt}>)
+endforeach()
+if(ACCENDINO_LINK_OPTIONS)
+    add_link_options(${ACCENDINO_LINK_OPTIONS})
+endif()
+if(ACCENDINO_INSTALL_PARALLEL)
+    set_property(GLOBAL PROPERTY INSTALL_PARALLEL ON)
+endif()
+'''
+
+# the builder driven by `cmake --build` for each generator, to know if it's a client of the jobserver
+CMAKE_GENERATOR_TOOLS = {
+    'Ninja': 'ninja',
+    'Unix Makefiles': 'make',
+}
+
+# first version of cmake where `cmake --install` can run in parallel (INSTALL_PARALLEL with Ninja)
+CMAKE_PARALLEL_INSTALL_VERSION = Version('3.31')
+
+# inputs of autoreconf, .m4 files (except the generated aclocal.m4) and automake files and fragments are also taken
+AUTOTOOLS_INPUTS = ('configure.ac', 'configure.in')
+AUTOTOOLS_INPUT_SUFFIXES = ('.m4', '.am', '.mk')
+
+AUTOTOOLS_TOOLS = ('autoconf', 'automake', 'libtoolize')
+
+
+def autotoolsFingerprint(sourceDir: str, extra: T.List[str]) -> str:
+    '''
+        computes a fingerprint of the inputs of autogen/autoreconf in a source tree and of the versions of the
+        autotools
+        @param sourceDir: the source directory
+        @param extra: the autogen command and its arguments, the content of the script that is run is taken too
+        @return the fingerprint
+    '''
+    h = hashlib.sha256()
+    h.update(json.dumps({
+        'extra': extra,
+        'tools': {tool: str(getToolVersion(tool)) for tool in AUTOTOOLS_TOOLS},
+    }, sort_keys=True, default=str).encode('utf8'))
+
+    def hashContent(path: str) -> None:
+        try:
+            with open(path, 'rb') as fin:
+                h.update(hashlib.sha256(fin.read()).digest())
+        except OSError:
+            pass
+
+    # the autogen.sh or bootstrap script, autoreconf is covered by the versions of the tools
+    script = os.path.join(sourceDir, str(extra[0])) if extra else None
+    if script and os.path.isfile(script):
+        hashContent(script)
+
+    for root, dirs, files in os.walk(sourceDir):
+        dirs[:] = sorted(d for d in dirs if d not in ('.git', 'autom4te.cache'))
+        for f in sorted(files):
+            if f in AUTOTOOLS_INPUTS or (f.endswith(AUTOTOOLS_INPUT_SUFFIXES) and f != 'aclocal.m4'):
+                path = os.path.join(root, f)
+                h.update(os.path.relpath(path, sourceDir).encode('utf8'))
+                hashContent(path)
+    return h.hexdigest()
+
+
+# serializes installations in the shared tools directory when artifacts are built concurrently
+_toolsInstallLock = threading.Lock()
+
+# tracks the builds that write in the prefix, staged ones may too when DESTDIR is ignored
+_prefixBuilds = BuildOverlapTracker()
 
 
 class DepsBuildArtifact:
@@ -87,6 +191,8 @@ class DepsBuildArtifact:
         self.pkgs = treatPackageDeps(pkgs)
         self.prepareStateFile = None
         self.builtFile = None
+        self.buildTree = None
+        self.cacheKey = None
         if isinstance(toolchainArtifacts, str):
             self.toolchainArtifacts = toolchainArtifacts.split(',')
         else:
@@ -109,6 +215,25 @@ class DepsBuildArtifact:
             if f and os.path.exists(f):
                 os.remove(f)
 
+    def _depsCacheKeys(self, config) -> T.Dict[str, str]:
+        ''' returns the cache keys of our dependencies, or None if one of them is not cacheable '''
+        ret = {}
+        for dep in self.deps:
+            artifact = config.getBuildItem(dep)
+            key = artifact.getCacheKey(config) if artifact else None
+            if key is None:
+                return None
+            ret[artifact.name] = key
+        return ret
+
+    def getCacheKey(self, config) -> str:
+        ''' returns the binary cache key of this artifact, that only depends on its dependencies '''
+        depsKeys = self._depsCacheKeys(config)
+        if depsKeys is None:
+            return None
+
+        return computeKey({'name': self.name, 'deps': depsKeys})
+
     def __str__(self) -> str:
         return f"<{self.name}>"
 
@@ -118,6 +243,9 @@ WIN_BUILD_SCRIPT = 'build.ps1'
 class BuildArtifact(DepsBuildArtifact):
     ''' general build artifact '''
 
+    # if the compiler cache is passed with the CMAKE_<LANG>_COMPILER_LAUNCHER variables instead of wrapping CC/CXX
+    compilerLauncherVars = False
+
     def __init__(self, name: str, deps, srcObj: Source, extraEnv={}, provides=[], pkgs={}, prepare_cmds = [], build_cmds=[],
                  toolchainArtifacts='c', skipToolchainEnv=False) -> None:
         '''
@@ -152,6 +280,18 @@ class BuildArtifact(DepsBuildArtifact):
         self.parallelJobs = True
         self.needsMsys2 = False
         self.skipToolchainEnv = skipToolchainEnv
+        # install in a staging directory (with DESTDIR) that is then merged in the prefix
+        self.stagedInstall = True
+        self.stageDir = None
+        self.manifestFile = None
+        self.compilerStatsLog = None
+        # additional environment variables that trigger a new prepare step when they change
+        self.fingerprintEnvVars = []
+        # values of the placeholders of the commands, set by init()
+        self.expansions = None
+        # prepare_cmds and build_cmds resolved, when the prepare step starts
+        self.prepareCommands = None
+        self.buildCommands = None
 
     def _updatePATHlike(self, config, env: T.Dict[str, str], key: str, preExtra: T.List[str] = [],
                         postExtra: T.List[str] = [], sep: str = ':') -> None:
@@ -227,6 +367,8 @@ class BuildArtifact(DepsBuildArtifact):
         # start by updating the base environment with what's comes from the toolchain
         if not self.skipToolchainEnv:
             toolchainEnv = config.toolchainObj.extraEnv(self.toolchainArtifacts)
+            if config.compilerCache:
+                toolchainEnv = config.compilerCache.wrapEnv(toolchainEnv, self.toolchainArtifacts, self.compilerLauncherVars)
             if toolchainEnv:
                 self._updateEnvMap(config, r, toolchainEnv)
                 xkeys += toolchainEnv.keys()
@@ -261,48 +403,82 @@ class BuildArtifact(DepsBuildArtifact):
         xkeys += extra.keys()
         xkeys = list( set(xkeys) )
 
+        if config.compilerCache and not self.skipToolchainEnv:
+            # cache location and statistics, they don't change what is built
+            r.update(config.compilerCache.runEnv(self.compilerStatsLog))
+
         if createEnvFile:
             fileDumperFn = self._createEnvFileWin32 if config.distribId in ('Windows', ) else self._createEnvFileUnix
             fileDumperFn(r, xkeys)
 
         return (r, xkeys)
 
-    def _expandConfigInString(self, item: str, config) -> str:
-        if not isinstance(item, str):
-            item = str(item)
+    def fingerprintEnvKeys(self, env: T.Dict[str, str], xkeys: T.List[str]) -> T.List[str]:
+        '''
+            returns the environment variables whose change makes the prepare step run again
+            @param env: the environment of the artifact
+            @param xkeys: the variables set by accendino, see _computeEnv()
+        '''
+        keys = set(xkeys) | set(self.fingerprintEnvVars)
+        keys.update(k for k in env if k in ENV_FINGERPRINT_VARS or k.startswith(ENV_FINGERPRINT_PREFIXES))
+        return sorted(keys)
+
+    def _codegenFlags(self, config) -> T.Tuple[T.List[str], T.List[str]]:
+        ''' returns the compile and link flags of the linker and debug info settings of the toolchain '''
+        if self.skipToolchainEnv:
+            return ([], [])
+        return config.toolchainObj.codegenFlags(self.toolchainArtifacts)
+
+    @staticmethod
+    def _appendToEnvFlags(env: T.Dict[str, str], var: str, flags: T.List[str]) -> str:
+        ''' returns the value of the var flags variable (CFLAGS, LDFLAGS, ...) of the environment of the artifact
+            (see _computeEnv()) with some flags appended, to be passed as an argument that takes precedence over
+            the environment
+        '''
+        base = env.get(var, '')
+        return ' '.join([base] + flags if base else flags)
 
-        values = {
-            'libdir': config.libdir,
-            'prefix': config.prefix,
+    def updateExpansions(self, config) -> None:
+        ''' computes the values of the placeholders of the commands ({prefix}, {srcdir}, ...), it's done by init()
+            and must be done again if the directories of the artifact or the prefix change
+        '''
+        self.expansions = {
+            'libdir': str(config.libdir),
+            'prefix': str(config.prefix),
             'prefix_posix': config.prefix.as_posix(),
             'prefix_msys2': as_msys2_path(config.prefix),
-            'srcdir': self.sourceDir,
+            'srcdir': str(self.sourceDir),
             'srcdir_posix': self.sourceDir.as_posix(),
-            'builddir': self.buildDir,
+            'builddir': str(self.buildDir),
             'builddir_posix': self.buildDir.as_posix()
         }
-        return item.format(**values)
 
-    def _expandConfigForPath(self, item: str, _config):
-        values = {
-            'srcdir': self.sourceDir,
-            'srcdir_posix': self.sourceDir.as_posix(),
-            'builddir': self.buildDir,
-            'builddir_posix': self.buildDir.as_posix(),
-        }
-        return item.format(**values)
+    def _expandConfigInString(self, item: str, _config) -> str:
+        if not isinstance(item, str):
+            item = str(item)
+        return item.format(**self.expansions)
 
-    def _expandConfigInlist(self, l: T.List[str], config) -> T.List[str]:
+    def resolveCommands(self, runItems, config) -> T.Tuple[ResolvedCommand, ...]:
+        '''
+            resolves a command list (see __init__()): RunInShell items are expanded and the placeholders of the
+            arguments and directories are replaced
+            @param runItems: the command list
+            @return the resolved commands
+        '''
         ret = []
-        for item in l:
-            ret.append( self._expandConfigInString(item, config) )
+        for cmd, path, cmddoc in runItems:
+            if isinstance(cmd, RunInShell):
+                cmd = cmd.expand()
 
-        return ret
+            args = tuple(self._expandConfigInString(item, config) for item in cmd)
+            ret.append(ResolvedCommand(args, str(pathlib.Path(self._expandConfigInString(path, config))), cmddoc))
+        return tuple(ret)
 
     def init(self, config) -> bool:
         self.sourceDir = config.sourcesDir / self.name
 
         dirName = f"{config.targetDistrib}-{config.toolchainObj.description}-{config.targetArch}-{config.buildType}"
+        self.buildTree = dirName
         self.buildDir = config.buildsDir / dirName / self.name
 
         os.makedirs(self.buildDir, exist_ok=True)
@@ -310,13 +486,21 @@ class BuildArtifact(DepsBuildArtifact):
         self.logFile = self.buildDir / 'build.log'
         self.prepareStateFile = self.buildDir / PREPARE_DUMP_FILE
         self.builtFile = self.buildDir / BUILT_FILE
+        self.manifestFile = self.buildDir / MANIFEST_FILE
+        self.compilerStatsLog = self.buildDir / COMPILER_STATS_FILE
+        self.stageDir = self.buildDir / 'accendino-stage'
+        self.updateExpansions(config)
+
+        if self.srcObj:
+            self.srcObj.init(config)
         return True
 
     def checkout(self, config) -> bool:
-        with open(self.logFile, "at", encoding='utf8') as flog:
+        with self.srcObj.lock, open(self.logFile, "at", encoding='utf8') as flog:
             ok = self.srcObj.checkout(self.sourceDir, flog, config.refreshSources)
+            refreshed = self.srcObj.refreshed
 
-        if ok and config.refreshSources and self.srcObj.refreshed:
+        if ok and config.refreshSources and refreshed:
             logging.info(f'source of {self.name} was refreshed, forcing a rebuild')
             for f in (self.prepareStateFile, self.builtFile):
                 if f and os.path.exists(f):
@@ -335,48 +519,54 @@ class BuildArtifact(DepsBuildArtifact):
             return False
         return True
 
-    def execute(self, cmd, env, cwd=None) -> bool:
+    def _runProcess(self, config, cmd, env, cwd, flog) -> subprocess.CompletedProcess:
+        ''' runs a command, making it a client of the jobserver if any '''
+        passFds = ()
+        if config.jobServer:
+            env = config.jobServer.clientEnv(env)
+            passFds = config.jobServer.passFds()
+
+        return subprocess.run(cmd, env=env, cwd=cwd, stdout=flog, stderr=flog, pass_fds=passFds)
+
+    def execute(self, cmd, env, config, cwd=None) -> bool:
         with open(self.logFile, "at", encoding='utf8') as flog:
-            completedProc = subprocess.run(cmd, env=env, cwd=cwd, stdout=flog, stderr=flog)
+            completedProc = self._runProcess(config, cmd, env, cwd, flog)
 
         return self.showLogOnError(completedProc.returncode)
 
-    def runCommands(self, runItems, env, config) -> bool:
+    def runCommands(self, commands: T.Iterable[ResolvedCommand], env, config) -> bool:
+        ''' runs resolved commands (see resolveCommands()) '''
         with open(self.logFile, "at", encoding='utf8') as flog:
-            for cmd, path, cmddoc in runItems:
-                cmd = self._expandConfigInlist(cmd, config)
+            for cmd, path, cmddoc in commands:
                 logging.debug(f'{cmddoc}: {" ".join(cmd)}')
-                path = pathlib.Path(self._expandConfigForPath(path, config))
 
-                completedProc = subprocess.run(cmd, env=env, cwd=path, stdout=flog, stderr=flog)
+                completedProc = self._runProcess(config, list(cmd), env, path, flog)
                 if completedProc.returncode != 0:
                     self.showLogs(f"error {cmddoc} with {' '.join(cmd)}:")
                     return False
 
         return True
 
-    def _createPrepareFileUnix(self, config, env, xkeys) -> None:
+    def _createPrepareFileUnix(self, config, env, xkeys, commands: T.Tuple[ResolvedCommand, ...]) -> None:
         with open(self.buildDir / "prepare.sh", "wt", encoding='utf8') as f:
             f.write(f'# prepare commands for artifact {self.name}\n\n')
 
             self._pushShellEnv(f, env, xkeys)
 
             lastDir = None
-            for cmd, path, cmddoc in self.prepare_cmds:
+            for cmd, path, cmddoc in commands:
                 f.write(f'# {cmddoc}\n')
 
-                path = self._expandConfigInString(path, config)
                 if lastDir != path:
                     f.write(f'cd "{path}"\n')
 
-                cmd = self._expandConfigInlist(cmd, config)
                 f.write('"')
                 f.write('" "'.join(cmd))
                 f.write('"\n\n')
 
                 lastDir = path
 
-    def _createPrepareFileWin32(self, config, env, xkeys) -> None:
+    def _createPrepareFileWin32(self, config, env, xkeys, commands: T.Tuple[ResolvedCommand, ...]) -> None:
         with open(self.buildDir / WIN_PREPARE_SCRIPT, "wt", encoding='utf8') as f:
             f.write("$PSDefaultParameterValues['*:Encoding'] = 'utf8'\n")
 
@@ -390,32 +580,129 @@ class BuildArtifact(DepsBuildArtifact):
 
             f.write(f'#\n# prepare commands for artifact {self.name}\n#\n\n')
             lastDir = None
-            for cmd, path, cmddoc in self.prepare_cmds:
+            for cmd, path, cmddoc in commands:
                 f.write(f'# {cmddoc}\n')
 
-                path = self._expandConfigInString(path, config)
                 if lastDir != path:
                     f.write(f'cd "{path}"\n')
 
-                cmd = self._expandConfigInlist(cmd, config)
                 cmdStr = "' '".join(cmd)
                 f.write(f"& '{cmdStr}'\nif ($LastExitCode -ne 0) {{\n\tExit $LastExitCode\n}}\n")
 
                 lastDir = path
 
+    def getCacheKey(self, _config) -> str:
+        return self.cacheKey
+
+    def computeCacheKey(self, config, env: T.Dict[str, str], xkeys: T.List[str]) -> str:
+        ''' computes the binary cache key of this artifact from the source revision, the environment and
+            commands (with our directories normalized), the toolchain and the keys of our dependencies
+            @return the key or None if the artifact is not cacheable
+        '''
+        revision = self.srcObj.revision(self.sourceDir) if self.srcObj else None
+        if revision is None:
+            return None
+
+        depsKeys = self._depsCacheKeys(config)
+        if depsKeys is None:
+            return None
+
+        replacements = (
+            (str(self.sourceDir), '{srcdir}'),
+            (self.sourceDir.as_posix(), '{srcdir_posix}'),
+            (str(self.buildDir), '{builddir}'),
+            (self.buildDir.as_posix(), '{builddir_posix}'),
+            (str(config.prefix), '{prefix}'),
+            (config.prefix.as_posix(), '{prefix_posix}'),
+        )
+
+        def normalize(item) -> str:
+            item = str(item)
+            for value, placeholder in replacements:
+                item = item.replace(value, placeholder)
+            return item
+
+        def normalizeCommands(commands: T.Tuple[ResolvedCommand, ...]) -> T.List[T.Any]:
+            return [[[normalize(c) for c in cmd], normalize(path), cmddoc] for cmd, path, cmddoc in commands]
+
+        return computeKey({
+            'name': self.name,
+            'revision': revision,
+            'env': {k: normalize(env[k]) for k in xkeys if k in env},
+            'prepare': normalizeCommands(self.prepareCommands),
+            'build': normalizeCommands(self.buildCommands),
+            'toolchain': config.toolchainObj.description,
+            'platform': [config.distribId, config.distribVersion, config.targetDistrib, config.targetArch,
+                         config.buildType, config.libdir],
+            'deps': depsKeys,
+        })
+
+    def restoreFromCache(self, config) -> bool:
+        ''' tries to restore the installed files of this artifact from the binary cache
+            @return if the artifact was restored
+        '''
+        previous = InstallManifest.load(self.manifestFile)
+        files = config.binaryCache.restore(self.cacheKey, config.prefix, previous)
+        if files is None:
+            logging.debug(f'{self.name} not in binary cache (key={self.cacheKey})')
+            return False
+
+        logging.info(f' * {self.name} restored from binary cache ({len(files)} files)')
+        manifest = InstallManifest.fromFiles(config.prefix, files)
+        self._removeStaleFiles(config, previous, manifest)
+        return manifest.save(self.manifestFile, config.prefix) and self.createBuiltFile() and self.recordBuild(config)
+
+    def recordBuild(self, config) -> bool:
+        ''' records in the state database that this artifact was built against the current state of its deps.
+            When the interface of the artifact didn't change since its previous build, its fingerprint is kept so
+            that the artifacts depending on it are not rebuilt (early cutoff)
+        '''
+        if config.stateDb:
+            manifest = InstallManifest.load(self.manifestFile) if self.manifestFile else None
+            meta = {
+                'configInterface': manifest.configInterface() if manifest else None,
+                'interface': manifest.interface(config.prefix) if manifest else None,
+                'depsConfig': depsConfigInterfaces(config, self),
+            }
+
+            fingerprint = None
+            previous = config.stateDb.meta(self.buildTree, self.name)
+            if config.earlyCutoff and meta['interface'] and previous and previous.get('interface', None) == meta['interface']:
+                logging.debug(f'{self.name}: interface unchanged, artifacts depending on it are not rebuilt')
+                fingerprint = config.stateDb.fingerprint(self.buildTree, self.name)
+
+            config.stateDb.record(self.buildTree, self.name, depsFingerprints(config, self), fingerprint=fingerprint,
+                                  meta=meta)
+        return True
+
+    def depsConfigChanged(self, config) -> bool:
+        ''' tells if the configuration interface (pkg-config and CMake files) of some of our dependencies changed
+            since we were built, in that case we must be configured again
+        '''
+        meta = config.stateDb.meta(self.buildTree, self.name)
+        recorded = meta.get('depsConfig', None) if meta else None
+        if recorded is None:
+            return True
+
+        current = depsConfigInterfaces(config, self)
+        changed = sorted(name for name, iface in current.items() if iface is None or recorded.get(name, None) != iface)
+        if changed:
+            logging.debug(f'{self.name}: configuration interface of {", ".join(changed)} changed')
+        return len(changed) > 0
+
     def needsRebuildFromDepsUpdates(self, config):
-        if not self.builtFile or not os.path.exists(self.builtFile):
+        if not self.builtFile or not os.path.exists(self.builtFile) or not config.stateDb:
             return False
 
-        self_mtime = os.stat(self.builtFile).st_mtime
+        if config.stateDb.recordedInputs(self.buildTree, self.name) is None:
+            # built before the state database existed, take the current state as reference
+            logging.debug(f'{self.name} has no recorded build state, assuming it is up to date')
+            self.recordBuild(config)
+            return False
 
-        for dep in self.deps:
-            artifact = config.getBuildItem(dep)
-            if artifact and artifact.builtFile and os.path.exists(artifact.builtFile):
-                mtime = os.stat(artifact.builtFile).st_mtime
-                if self_mtime < mtime:
-                    logging.debug(f'rebuilding {self.name} because {artifact.name} has a more recent build')
-                    return True
+        if isOutdated(config, self):
+            logging.debug(f'rebuilding {self.name} because some of its dependencies were rebuilt')
+            return True
         return False
 
 
@@ -423,54 +710,95 @@ class BuildArtifact(DepsBuildArtifact):
         os.makedirs(self.buildDir, exist_ok=True)
 
         if self.needsRebuildFromDepsUpdates(config):
-            # some of our deps have been updated, let's rebuild
-            if os.path.exists(self.prepareStateFile):
-                os.remove(self.prepareStateFile)
+            # some of our deps have been updated, let's rebuild. The build tools see the changes of the headers
+            # and libraries in the prefix, so we only configure again if what the configure step reads changed
+            if config.depsRebuildMode == 'reconfigure' or self.depsConfigChanged(config):
+                if os.path.exists(self.prepareStateFile):
+                    os.remove(self.prepareStateFile)
+            else:
+                logging.debug(f'{self.name}: incremental rebuild, keeping the configured build directory')
 
             if os.path.exists(self.builtFile):
                 os.remove(self.builtFile)
 
         (env, xkeys) = self._computeEnv(config, self.extraEnv, config.debug)
 
-        dump = BuildStepDump()
-        dump.env = env.copy()
-        dump.args = self.prepare_cmds
+        # the command lists are final now, they're resolved once for the fingerprints, the scripts and the execution
+        self.prepareCommands = self.resolveCommands(self.prepare_cmds, config)
+        self.buildCommands = self.resolveCommands(self.build_cmds, config)
 
-        dumpOnDisk = None
-        if os.path.exists(self.prepareStateFile):
-            try:
-                with open(self.prepareStateFile, 'rb') as f:
-                    dumpOnDisk = pickle.load(f)
-            except:
-                logging.info(f"prepare state file {self.prepareStateFile} exists but we couldn't read it")
+        dump = BuildStepDump(env, self.fingerprintEnvKeys(env, xkeys), self.prepareCommands)
+        if config.binaryCache:
+            self.cacheKey = self.computeCacheKey(config, env, xkeys)
+            if self.cacheKey and not os.path.exists(self.builtFile) and self.restoreFromCache(config):
+                # recorded so that the next runs don't prepare and build it again
+                dump.restored = True
+                self._savePrepareState(dump)
+                return True
+
+        if os.path.exists(self.builtFile):
+            dumpOnDisk = BuildStepDump.load(self.prepareStateFile)
+            if dumpOnDisk and dumpOnDisk.restored and dump == dumpOnDisk:
+                logging.debug(f"{self.name} was restored from the binary cache")
+                return True
 
-        if dumpOnDisk and dump == dumpOnDisk:
+        sourceCommands = self.sourceTreeCommands(config)
+
+        dumpOnDisk = BuildStepDump.load(self.prepareStateFile)
+        if dumpOnDisk and dumpOnDisk.restored:
+            # the build directory of a restored artifact was never configured
+            dumpOnDisk = None
+
+        if sourceCommands:
+            logging.debug(f"{self.name}: preparing again, the source tree must be generated")
+        elif dumpOnDisk and dump == dumpOnDisk:
             logging.debug(f"{self.name} is already prepared")
             return True
+        elif dumpOnDisk:
+            changed = dump.changedVars(dumpOnDisk)
+            logging.debug(f"{self.name}: preparing again, " +
+                          (f"environment changed ({', '.join(changed)})" if changed else "prepare commands changed"))
 
         if os.path.exists(self.builtFile):
             os.remove(self.builtFile)
 
+        commands = sourceCommands + self.prepareCommands
         scriptBuilder = self._createPrepareFileWin32 if config.distribId in ('Windows',) else self._createPrepareFileUnix
-        scriptBuilder(config, env, xkeys)
+        scriptBuilder(config, env, xkeys, commands)
 
         ret = False
         if config.distribId in ('Windows', ) and config.buildWithPowershell:
             logging.debug(f'running powershell .\\{WIN_PREPARE_SCRIPT}')
-            ret = self.execute(['powershell', '-ExecutionPolicy', 'Unrestricted', '-File', f'.\\{WIN_PREPARE_SCRIPT}'], env, self.buildDir)
+            ret = self.execute(['powershell', '-ExecutionPolicy', 'Unrestricted', '-File', f'.\\{WIN_PREPARE_SCRIPT}'], env, config,
+                               self.buildDir)
         else:
-            ret = self.runCommands(self.prepare_cmds, env, config)
+            ret = self.runCommands(commands, env, config)
 
         if ret:
-            try:
-                with open(self.prepareStateFile, 'wb') as f:
-                    pickle.dump(dump, f)
-            except Exception as e:
-                logging.info(f"unable to save prepare state file {self.prepareStateFile}: {e}")
+            self._savePrepareState(dump)
+            if sourceCommands:
+                self.sourceTreeGenerated(config)
             return True
 
         return False
 
+    def _savePrepareState(self, dump: BuildStepDump) -> None:
+        try:
+            dump.save(self.prepareStateFile)
+        except Exception as e:
+            logging.info(f"unable to save prepare state file {self.prepareStateFile}: {e}")
+
+    def sourceTreeCommands(self, _config) -> T.Tuple[ResolvedCommand, ...]:
+        ''' returns the commands generating files in the source tree (like autogen.sh), they're run before the
+            prepare commands and only returned when their inputs changed. They're not part of the prepare state,
+            the prepare step runs again when there are some
+        '''
+        return ()
+
+    def sourceTreeGenerated(self, _config) -> None:
+        ''' called when the commands returned by sourceTreeCommands() and the prepare commands were successful '''
+        pass
+
     def createBuiltFile(self) -> bool:
         try:
             with open(self.builtFile, "wt", encoding='utf8') as f:
@@ -492,27 +820,36 @@ class BuildArtifact(DepsBuildArtifact):
                 f.write(f'# toolchain setup for {config.toolchainObj.description}\n{toolchainItem}\n')
 
             lastPath = None
-            for cmd, path, cmddoc in self.build_cmds:
+            for cmd, path, cmddoc in self.buildCommands:
                 f.write(f'# {cmddoc}\n')
 
-                path = pathlib.Path(self._expandConfigForPath(path, config))
                 if lastPath != path:
                     f.write(f'cd {path}\n')
                     lastPath = path
 
-                cmd = self._expandConfigInlist(cmd, config)
                 cmdStr = "' '".join(cmd)
                 f.write(f"& '{cmdStr}'\nif ($LastExitCode -ne 0) {{\n\tExit $LastExitCode\n}}\n")
 
             return True
 
 
-    def build(self, config) -> bool:
-        if os.path.isfile(self.builtFile):
-            logging.debug(f'artifact {self.name} already built')
-            return True
+    def usesStagedInstall(self, config) -> bool:
+        ''' tells if this artifact is installed in a staging directory before being merged in the prefix '''
+        return self.stagedInstall and config.distribId not in ('Windows',)
 
+    def stagedPrefix(self, config) -> pathlib.PurePath:
+        ''' returns where the prefix is inside the staging directory '''
+        return pathlib.PurePath(str(self.stageDir) + str(config.prefix))
+
+    def _runBuildCommands(self, config, staged: bool) -> bool:
         (env, xkeys) = self._computeEnv(config, self.extraEnv)
+        if self.buildCommands is None:
+            self.buildCommands = self.resolveCommands(self.build_cmds, config)
+
+        if staged:
+            # DESTDIR for make/ninja/meson/cmake, INSTALL_ROOT for qmake generated Makefiles
+            env['DESTDIR'] = str(self.stageDir)
+            env['INSTALL_ROOT'] = str(self.stageDir)
 
         if config.distribId in ('Windows',) and config.buildWithPowershell:
             if not self._createWin32BuildScript(config, env, xkeys):
@@ -520,10 +857,108 @@ class BuildArtifact(DepsBuildArtifact):
 
             logging.debug(f'running powershell .\\{WIN_BUILD_SCRIPT}')
             cmd = ['powershell', '-ExecutionPolicy', 'Unrestricted', '-File', f'.\\{WIN_BUILD_SCRIPT}']
-            return self.execute(cmd, env, self.buildDir) and self.createBuiltFile()
+            return self.execute(cmd, env, config, self.buildDir)
+
+        return self.runCommands(self.buildCommands, env, config)
+
+    def _removeStaleFiles(self, config, previous: InstallManifest, manifest: InstallManifest) -> None:
+        ''' removes from the prefix the files of the previous install that are not installed anymore '''
+        if not previous:
+            return
+
+        stale = [f for f in previous.entries if f not in manifest.entries]
+        if stale:
+            removed = previous.removeFromPrefix(config.prefix, stale, filesOwnedByOthers(self.buildDir, self.name))
+            logging.debug(f'{self.name}: removed {removed} files that are not installed anymore')
+
+    def build(self, config) -> bool:
+        if os.path.isfile(self.builtFile):
+            logging.debug(f'artifact {self.name} already built')
+            return True
+
+        staged = self.usesStagedInstall(config)
+        previous = InstallManifest.load(self.manifestFile)
+
+        if config.compilerCache and os.path.exists(self.compilerStatsLog):
+            os.remove(self.compilerStatsLog)
+
+        if staged:
+            shutil.rmtree(self.stageDir, ignore_errors=True)
+
+        # without staging the installed files are found by comparing the prefix before and after the build. With
+        # staging, scanning the whole prefix is avoided: if DESTDIR turns out to be ignored, the files modified in
+        # the prefix since the start of the build are taken
+        before = None if staged else snapshotTree(config.prefix)
+        startTime = filesystemTime(config.prefix) if staged else None
+        _prefixBuilds.begin(self.name)
+        ret = self._runBuildCommands(config, staged)
+
+        manifest = None
+        if ret and staged:
+            stageRoot = self.stagedPrefix(config)
+            manifest = InstallManifest.fromTree(stageRoot)
+            if manifest.entries:
+                copied = manifest.mergeInto(stageRoot, config.prefix, previous)
+                logging.debug(f'{self.name}: {copied}/{len(manifest.entries)} files copied to the prefix')
+            else:
+                logging.info(f'{self.name} installed nothing in the staging directory, perhaps DESTDIR is not supported, '
+                             'looking for its files in the prefix')
+                manifest = None
+            shutil.rmtree(self.stageDir, ignore_errors=True)
+
+        overlapped = _prefixBuilds.end(self.name)
+        if not ret:
+            return False
+
+        if manifest is None:
+            if before is None:
+                files = filesModifiedSince(config.prefix, startTime)
+            else:
+                files = diffSnapshots(before, snapshotTree(config.prefix))
+            if overlapped:
+                # some files may belong to the artifacts built concurrently, only add what we got
+                logging.debug(f'{self.name} was built concurrently with other artifacts, its install manifest may be partial')
+                if previous:
+                    files = sorted(set(files) | set(previous.entries.keys()))
+            manifest = InstallManifest.fromFiles(config.prefix, files)
+        else:
+            # the staged files are exactly the ones of this artifact
+            overlapped = False
+
+        self._removeStaleFiles(config, previous, manifest)
+        if not manifest.save(self.manifestFile, config.prefix) or not self.createBuiltFile():
+            return False
+        self.recordBuild(config)
+
+        if config.compilerCache:
+            config.compilerCache.recordBuild(self.name, self.compilerStatsLog)
+
+        if config.binaryCache and self.cacheKey and not overlapped:
+            if config.binaryCache.store(self.cacheKey, config.prefix, manifest.files(), {'name': self.name}):
+                logging.debug(f'{self.name} stored in binary cache ({len(manifest.entries)} files)')
 
-        return self.runCommands(self.build_cmds, env, config) and self.createBuiltFile()
+        return True
+
+    def uninstall(self, config) -> bool:
+        ''' removes the files installed by this artifact from the prefix (files also installed by other
+            artifacts are kept)
+            @return if the operation was successful
+        '''
+        manifest = InstallManifest.load(self.manifestFile)
+        if manifest is None:
+            logging.error(f'no install manifest for {self.name}, unable to uninstall it')
+            return False
+
+        removed = manifest.removeFromPrefix(config.prefix, manifest.files(), filesOwnedByOthers(self.buildDir, self.name))
+        logging.info(f' * {self.name}: {removed} files removed')
 
+        for f in (self.manifestFile, self.builtFile):
+            if os.path.exists(f):
+                os.remove(f)
+
+        if config.stateDb:
+            config.stateDb.forget(self.buildTree, self.name)
+        return True
 
     def setMakeNinjaCommands(self, config, cmd='ninja', build_targets='all', install_targets='install', parallelJobs=True,
                             runInstallDir='{builddir}') -> None:
@@ -540,28 +975,32 @@ class BuildArtifact(DepsBuildArtifact):
         if cmd in ('ninja', 'make', 'makeMsys2',):
             maxJobs = 0
             if parallelJobs:
-                maxJobs = config.maxJobs
+                maxJobs = jobsPerArtifact(config)
 
             if maxJobs == 0:
-                concurrentArgs = '-j'
+                concurrentArgs = ['-j']
             else:
-                concurrentArgs = f'-j{maxJobs}'
+                concurrentArgs = [f'-j{maxJobs}']
+
+            if parallelJobs and config.jobServer and config.jobServer.handles(cmd):
+                # the number of jobs is driven by the jobserver given in MAKEFLAGS
+                concurrentArgs = []
 
             if cmd == 'makeMsys2':
                 for target in build_targets:
-                    self.build_cmds.append( (RunInShell(['make', '-C', '{builddir_posix}', concurrentArgs, target]).expand(),
+                    self.build_cmds.append( (RunInShell(['make', '-C', '{builddir_posix}'] + concurrentArgs + [target]).expand(),
                             '{builddir_posix}', 'building'))
 
                 for target in install_targets:
-                    self.build_cmds.append( (RunInShell(['make', '-C', '{builddir_posix}', concurrentArgs, target]).expand(),
+                    self.build_cmds.append( (RunInShell(['make', '-C', '{builddir_posix}'] + concurrentArgs + [target]).expand(),
                                   '{builddir_posix}', 'installing'))
 
             else:
                 for target in build_targets:
-                    self.build_cmds.append( ([cmd, '-C', '{builddir}', concurrentArgs, target], '{builddir}', 'building'))
+                    self.build_cmds.append( ([cmd, '-C', '{builddir}'] + concurrentArgs + [target], '{builddir}', 'building'))
 
                 for target in install_targets:
-                    self.build_cmds.append(([cmd, '-C', runInstallDir, concurrentArgs, target], '{builddir}', 'installing'))
+                    self.build_cmds.append(([cmd, '-C', runInstallDir] + concurrentArgs + [target], '{builddir}', 'installing'))
 
         elif cmd in ('nmake',):
             for target in build_targets:
@@ -624,8 +1063,10 @@ class CustomCommandBuildArtifact(BuildArtifact):
 class CMakeBuildArtifact(BuildArtifact):
     ''' cmake based build item '''
 
+    compilerLauncherVars = True
+
     def __init__(self, name: str, deps, srcObj: Source, cmakeOpts=[], parallelJobs=True, extraEnv={}, provides=[], pkgs={},
-                 toolchainArtifacts='c') -> None:
+                 toolchainArtifacts='c', generator: str = None) -> None:
         '''
             @param name: name of the build artifact
             @param deps: list of dependencies to other build artifacts
@@ -636,9 +1077,12 @@ class CMakeBuildArtifact(BuildArtifact):
             @param cmakeOpts:
             @param parallelJobs:
             @param toolchainArtifacts: artifacts that we need from the toolchain
+            @param generator: the cmake generator, by default Ninja when it's available (except on Windows)
         '''
         extra = {
-            'Ubuntu|Debian|Redhat|Fedora|Arch|FreeBSD|Darwin': ['cmake']
+            'Ubuntu|Debian|Redhat|Fedora|Arch|FreeBSD|Darwin': ['cmake'],
+            'Ubuntu|Debian|Redhat|Fedora': ['ninja-build'],
+            'Arch|FreeBSD|Darwin': ['ninja'],
         }
         doMingwCrossDeps(['Ubuntu', 'Debian', 'Redhat', 'Fedora'], ['cmake', 'ninja-build', 'make'], extra)
         pkgs = mergePkgDeps(pkgs, extra)
@@ -646,6 +1090,63 @@ class CMakeBuildArtifact(BuildArtifact):
         BuildArtifact.__init__(self, name, deps, srcObj, extraEnv, provides, pkgs, toolchainArtifacts=toolchainArtifacts)
         self.cmakeOpts = cmakeOpts
         self.parallelJobs = parallelJobs
+        self.generator = generator
+
+    def selectGenerator(self, config) -> str:
+        '''
+            returns the generator to use
+            @return the generator name, None to let cmake use its default
+        '''
+        if self.generator:
+            return self.generator
+
+        for opt in self.cmakeOpts:
+            if opt.startswith('-G'):
+                # given by the accendino file
+                return None
+
+        if config.distribId in ('Windows',):
+            return None
+
+        if getPathIndex().find('ninja'):
+            return 'Ninja'
+        return 'Unix Makefiles'
+
+    def _configuredGenerator(self) -> str:
+        ''' returns the generator of the existing build directory, None if it's not configured '''
+        try:
+            with open(self.buildDir / 'CMakeCache.txt', 'rt', encoding='utf8', errors='replace') as f:
+                for l in f:
+                    if l.startswith('CMAKE_GENERATOR:INTERNAL='):
+                        return l.strip().split('=', 1)[1]
+        except FileNotFoundError:
+            pass
+        return None
+
+    def migrateGenerator(self, generator: str) -> None:
+        ''' cmake refuses to configure a build directory with another generator, so when the generator changes the
+            cmake cache and the files of the previous generator are removed to configure from scratch
+        '''
+        previous = self._configuredGenerator()
+        if generator is None or previous is None or previous == generator:
+            return
+
+        logging.info(f' * {self.name}: cmake generator changed from {previous} to {generator}, configuring from scratch')
+        for f in ('CMakeCache.txt', 'Makefile', 'build.ninja', '.ninja_deps', '.ninja_log', 'cmake_install.cmake'):
+            if os.path.exists(self.buildDir / f):
+                os.remove(self.buildDir / f)
+        shutil.rmtree(self.buildDir / 'CMakeFiles', ignore_errors=True)
+
+    def _jobsArgs(self, config, generator: str) -> T.List[str]:
+        ''' returns the --parallel arguments of `cmake --build` '''
+        if not self.parallelJobs:
+            return ['--parallel', '1']
+
+        tool = CMAKE_GENERATOR_TOOLS.get(generator, None)
+        if tool and config.jobServer and config.jobServer.handles(tool):
+            # the number of jobs is driven by the jobserver given in MAKEFLAGS
+            return []
+        return ['--parallel', f'{jobsPerArtifact(config)}']
 
     def prepare(self, config) -> bool:
         cmake_cmd = ['cmake']
@@ -654,7 +1155,17 @@ class CMakeBuildArtifact(BuildArtifact):
             fname = config.getCrossPlatformFile("cmake", config.distribId, config.targetDistrib, config.targetArch)
             cmake_cmd.append(f'-DCMAKE_TOOLCHAIN_FILE={fname}')
 
+        generator = self.selectGenerator(config)
+        self.migrateGenerator(generator)
+        if generator:
+            cmake_cmd += ['-G', generator]
+
         #  f'-DCMAKE_BUILD_TYPE={config.cmakeBuildType()}',
+        if config.configureCache:
+            seedFile = self.buildDir / CMAKE_SEED_FILE
+            config.configureCache.seedCMake(self.buildTree, self.name, seedFile)
+            cmake_cmd += ['-C', seedFile.as_posix()]
+
         cmake_cmd += [
                '-DCMAKE_PREFIX_PATH={prefix_posix}/lib/cmake;{prefix_posix}/lib',
                 f'-DCMAKE_CONFIGURATION_TYPES={config.cmakeBuildType()}',
@@ -663,17 +1174,45 @@ class CMakeBuildArtifact(BuildArtifact):
                '-B', '{builddir}'
         ]
 
+        (compileFlags, linkFlags) = self._codegenFlags(config)
+        cmakeVersion = getToolVersion('cmake')
+        parallelInstall = generator == 'Ninja' and self.parallelJobs and cmakeVersion is not None and \
+                cmakeVersion >= CMAKE_PARALLEL_INSTALL_VERSION
+
+        codegenFile = self.buildDir / CMAKE_CODEGEN_FILE
+        if compileFlags or linkFlags or parallelInstall or os.path.exists(codegenFile):
+            # once set, the variables are kept empty rather than removed so that the cmake cache is updated
+            with open(codegenFile, 'wt', encoding='utf8') as f:
+                f.write(CMAKE_CODEGEN_CONTENT)
+
+            cmake_cmd += [
+                f'-DCMAKE_PROJECT_INCLUDE={codegenFile.as_posix()}',
+                f'-DACCENDINO_COMPILE_OPTIONS={";".join(compileFlags)}',
+                f'-DACCENDINO_LINK_OPTIONS={";".join(linkFlags)}',
+                f'-DACCENDINO_INSTALL_PARALLEL={"ON" if parallelInstall else "OFF"}',
+            ]
+
         cmake_cmd += self.cmakeOpts
 
         self.prepare_cmds = [
             (cmake_cmd, '{builddir}', 'running cmake')
         ]
 
+        installCmd = ['cmake', '--install', '{builddir}']
+        if parallelInstall:
+            installCmd += ['--parallel', f'{jobsPerArtifact(config)}']
+
         self.build_cmds = [
-            (['cmake', '--build', '{builddir}', '--config', config.cmakeBuildType()], '{builddir}', 'building'),
-            (['cmake', '--install', '{builddir}'], '{builddir}', 'installing'),
+            (['cmake', '--build', '{builddir}', '--config', config.cmakeBuildType()] + self._jobsArgs(config, generator),
+             '{builddir}', 'building'),
+            (installCmd, '{builddir}', 'installing'),
         ]
-        return BuildArtifact.prepare(self, config)
+        if not BuildArtifact.prepare(self, config):
+            return False
+
+        if config.configureCache:
+            config.configureCache.collectCMake(self.buildTree, self.name, self.buildDir / 'CMakeCache.txt')
+        return True
 
 
 
@@ -765,6 +1304,41 @@ class AutogenBuildArtifact(BuildArtifact):
         self.configureArgs = configureArgs
         self.bootstrapScript = bootstrapScript
         self.runInstallDir = runInstallDir
+        self.autogenCmd = None
+
+    def autogenStampFile(self) -> pathlib.Path:
+        ''' returns the file keeping the fingerprint of the autotools inputs of the last autogen run, it's next to
+            the sources as they're shared by the build trees
+        '''
+        return pathlib.Path(f'{self.sourceDir}{AUTOGEN_STAMP_SUFFIX}')
+
+    def forceRebuild(self) -> None:
+        BuildArtifact.forceRebuild(self)
+        if self.sourceDir and os.path.exists(self.autogenStampFile()):
+            os.remove(self.autogenStampFile())
+
+    def sourceTreeCommands(self, config) -> T.Tuple[ResolvedCommand, ...]:
+        if self.autogenCmd is None:
+            return ()
+
+        autogenCommands = self.resolveCommands([self.autogenCmd], config)
+        try:
+            with open(self.autogenStampFile(), 'rt', encoding='utf8') as f:
+                stamp = f.read().strip()
+        except FileNotFoundError:
+            stamp = None
+
+        if stamp and os.path.exists(self.sourceDir / 'configure') and \
+                stamp == autotoolsFingerprint(self.sourceDir, list(autogenCommands[0].args)):
+            logging.debug(f'{self.name}: autotools inputs unchanged, skipping autogen')
+            return ()
+        return autogenCommands
+
+    def sourceTreeGenerated(self, config) -> None:
+        # computed after the run, as autoreconf -i copies some .m4 files in the source tree
+        fingerprintExtra = list(self.resolveCommands([self.autogenCmd], config)[0].args)
+        with open(self.autogenStampFile(), 'wt', encoding='utf8') as f:
+            f.write(autotoolsFingerprint(self.sourceDir, fingerprintExtra))
 
     def prepare(self, config) -> bool:
         if self.isAutogen:
@@ -772,23 +1346,49 @@ class AutogenBuildArtifact(BuildArtifact):
         else:
             cmd = [os.path.join(self.sourceDir, self.bootstrapScript)]
 
-        autoGenRunDir = '{srcdir}'
-        if self.noconfigure:
-            cmd += ["--prefix={prefix}"]
-            autoGenRunDir = '{builddir}'
+        # configure variables, debug info flags go in CPPFLAGS so that CFLAGS keeps its default (-g -O2)
+        (env, _) = self._computeEnv(config, self.extraEnv)
+        (compileFlags, linkFlags) = self._codegenFlags(config)
+        codegenArgs = []
+        if compileFlags:
+            codegenArgs.append(f'CPPFLAGS={self._appendToEnvFlags(env, "CPPFLAGS", compileFlags)}')
+        if linkFlags:
+            codegenArgs.append(f'LDFLAGS={self._appendToEnvFlags(env, "LDFLAGS", linkFlags)}')
 
-        self.prepare_cmds = [
-            (cmd, autoGenRunDir, 'running autogen/bootstrap')
-        ]
+        if self.noconfigure:
+            # autogen also configures the build directory, it's part of the prepare commands
+            cmd += ["--prefix={prefix}"] + codegenArgs
+            self.autogenCmd = None
+            self.prepare_cmds = [
+                (cmd, '{builddir}', 'running autogen/bootstrap')
+            ]
+        else:
+            # autogen is run only when the autotools inputs change, see sourceTreeCommands()
+            self.autogenCmd = (cmd, '{srcdir}', 'running autogen/bootstrap')
+            self.prepare_cmds = []
 
+        cacheFile = None
         if not self.noconfigure:
-            cmd = [ os.path.join(self.sourceDir, "configure"), "--prefix={prefix}"] + self.configureArgs
+            cmd = [ os.path.join(self.sourceDir, "configure"), "--prefix={prefix}"] + codegenArgs + self.configureArgs
+
+            userCache = any(arg in ('-C', '--config-cache') or arg.startswith('--cache-file') for arg in self.configureArgs)
+            if config.configureCache and not userCache:
+                cacheFile = self.buildDir / 'config.cache'
+                flagsKey = autoconfFlagsKey(env, cmd)
+                config.configureCache.seedAutoconf(self.buildTree, flagsKey, cacheFile)
+                cmd.append(f'--cache-file={cacheFile}')
+
             self.prepare_cmds.append(
                 (cmd, '{builddir}', 'running configure')
             )
 
         self.setMakeNinjaCommands(config, 'make', parallelJobs=self.parallelJobs, runInstallDir=self.runInstallDir)
-        return BuildArtifact.prepare(self, config)
+        if not BuildArtifact.prepare(self, config):
+            return False
+
+        if cacheFile:
+            config.configureCache.collectAutoconf(self.buildTree, flagsKey, cacheFile)
+        return True
 
 
 class MesonBuildArtifact(BuildArtifact):
@@ -840,20 +1440,21 @@ class MesonBuildArtifact(BuildArtifact):
         mesonRootDir = config.toolsDir / f'meson-{self.mesonVersion}'
 
         self.mesonPath = mesonRootDir / 'bin' / 'meson'
-        if os.path.exists(mesonRootDir) and os.path.exists(self.mesonPath):
-            logging.debug(f"meson {self.mesonVersion} already installed")
-            return True
-
-        mesonVersionString = 'meson'
-        if self.mesonVersion != 'latest':
-            mesonVersionString = f'meson=={self.mesonVersion}'
-
-        env = os.environ.copy()
-        cmds = [
-            (['python', '-m', 'venv', mesonRootDir], '.', f'creating venv for {mesonVersionString}'),
-            ([mesonRootDir / 'bin' / 'pip', 'install', mesonVersionString], '.', f'installing {mesonVersionString}'),
-        ]
-        return self.runCommands(cmds, env, config)
+        with _toolsInstallLock:
+            if os.path.exists(mesonRootDir) and os.path.exists(self.mesonPath):
+                logging.debug(f"meson {self.mesonVersion} already installed")
+                return True
+
+            mesonVersionString = 'meson'
+            if self.mesonVersion != 'latest':
+                mesonVersionString = f'meson=={self.mesonVersion}'
+
+            env = os.environ.copy()
+            cmds = [
+                (['python', '-m', 'venv', mesonRootDir], '.', f'creating venv for {mesonVersionString}'),
+                ([mesonRootDir / 'bin' / 'pip', 'install', mesonVersionString], '.', f'installing {mesonVersionString}'),
+            ]
+            return self.runCommands(self.resolveCommands(cmds, config), env, config)
 
     def prepare(self, config) -> bool:
         reconfigure = os.path.exists(self.buildDir / 'meson-info')
@@ -868,6 +1469,9 @@ class MesonBuildArtifact(BuildArtifact):
 
         if reconfigure:
             cmd += ["--reconfigure"]
+
+        codegenOptions = self._codegenOptions(config, reconfigure)
+        cmd += [f'-D{k}={v}' for k, v in codegenOptions.items()]
         cmd += self.mesonOpts
         cmd += [self.sourceDir]
 
@@ -877,10 +1481,10 @@ class MesonBuildArtifact(BuildArtifact):
 
         maxJobs = 0
         if self.parallelJobs:
-            maxJobs = config.maxJobs
+            maxJobs = jobsPerArtifact(config)
 
         concurrentArgs = []
-        if maxJobs != 0:
+        if maxJobs != 0 and not (config.jobServer and config.jobServer.handles('meson')):
             concurrentArgs = ['-j', f'{maxJobs}']
 
         self.build_cmds = [
@@ -888,4 +1492,49 @@ class MesonBuildArtifact(BuildArtifact):
             ([self.mesonPath, 'install'], '{builddir}', 'installing'),
         ]
 
-        return BuildArtifact.prepare(self, config)
+        if not BuildArtifact.prepare(self, config):
+            return False
+
+        if codegenOptions:
+            self._saveCodegenOptions(codegenOptions)
+        return True
+
+    def _loadCodegenOptions(self) -> T.Dict[str, str]:
+        try:
+            with open(self.buildDir / MESON_CODEGEN_FILE, 'rt', encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _saveCodegenOptions(self, options: T.Dict[str, str]) -> None:
+        content = self._loadCodegenOptions()
+        content.update(options)
+        try:
+            with open(self.buildDir / MESON_CODEGEN_FILE, 'wt', encoding='utf8') as f:
+                json.dump(content, f, sort_keys=True)
+        except OSError as e:
+            logging.debug(f'unable to save {MESON_CODEGEN_FILE} of {self.name}: {e}')
+
+    def _codegenOptions(self, config, reconfigure: bool) -> T.Dict[str, str]:
+        ''' returns the <lang>_args and <lang>_link_args options with the linker and debug info flags. When
+            reconfiguring, only the ones that changed since they were last given are returned, so that the values
+            set by the user with `meson configure` are kept
+        '''
+        (env, _) = self._computeEnv(config, self.extraEnv)
+        (compileFlags, linkFlags) = self._codegenFlags(config)
+        previous = self._loadCodegenOptions() if reconfigure else {}
+
+        ret = {}
+        for lang, artifact, flagsVar in (('c', 'c', 'CFLAGS'), ('cpp', 'c++', 'CXXFLAGS')):
+            if artifact not in self.toolchainArtifacts:
+                continue
+
+            for option, var, flags in ((f'{lang}_args', flagsVar, compileFlags), (f'{lang}_link_args', 'LDFLAGS', linkFlags)):
+                # once given, an option is given again when the flags are removed so that they're dropped
+                if not flags and option not in previous:
+                    continue
+
+                value = self._appendToEnvFlags(env, var, flags)
+                if previous.get(option, None) != value:
+                    ret[option] = value
+        return ret
@@ -0,0 +1,82 @@
+import os
+import marshal
+import hashlib
+import importlib.util
+import typing as T
+
+from zenlog import log as logging
+
+
+class SourceCodeCache:
+    ''' a cache of the compiled code of accendino files, much like __pycache__. Entries are keyed on the
+        path of the file, and validated with its mtime and size or, when they changed, with the hash of its content
+    '''
+
+    def __init__(self, cacheDir: str) -> None:
+        '''
+            @param cacheDir: directory holding the compiled files, None to disable the cache
+        '''
+        self.cacheDir = cacheDir
+
+    def _entryPath(self, fpath: str) -> str:
+        pathHash = hashlib.sha256(os.path.abspath(fpath).encode('utf8')).hexdigest()[0:24]
+        return os.path.join(self.cacheDir, f'{pathHash}.accendinoc')
+
+    def _readEntry(self, entryPath: str) -> T.Tuple[T.Any, T.Any]:
+        ''' returns the header and code of an entry or (None, None) '''
+        try:
+            with open(entryPath, 'rb') as f:
+                header = marshal.load(f)
+                if header[0] != importlib.util.MAGIC_NUMBER:
+                    return (None, None)
+                return (header, marshal.load(f))
+        except (OSError, EOFError, ValueError, TypeError, IndexError):
+            return (None, None)
+
+    def _writeEntry(self, entryPath: str, header, code) -> None:
+        tmpPath = f'{entryPath}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            with open(tmpPath, 'wb') as f:
+                marshal.dump(header, f)
+                marshal.dump(code, f)
+            os.replace(tmpPath, entryPath)
+        except OSError as e:
+            logging.debug(f'unable to write code cache entry {entryPath}: {e}')
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    def load(self, fpath: str, codeName: str):
+        '''
+            returns the code object of an accendino file
+            @param fpath: path of the file
+            @param codeName: the file name given to compile()
+        '''
+        if self.cacheDir is None:
+            return self._compile(fpath, codeName)[0]
+
+        st = os.stat(fpath)
+        entryPath = self._entryPath(fpath)
+        header, code = self._readEntry(entryPath)
+        if header and header[1:4] == (st.st_mtime_ns, st.st_size, codeName):
+            return code
+
+        if header is None or header[3] != codeName:
+            code = None
+        (code, sourceHash) = self._compile(fpath, codeName, header[4] if header else None, code)
+        self._writeEntry(entryPath, (importlib.util.MAGIC_NUMBER, st.st_mtime_ns, st.st_size, codeName, sourceHash), code)
+        return code
+
+    @staticmethod
+    def _compile(fpath: str, codeName: str, knownHash: str = None, knownCode=None):
+        ''' compiles a file, unless its content has the known hash
+            @return a tuple (code, hash of the source)
+        '''
+        with open(fpath, 'rb') as f:
+            content = f.read()
+
+        sourceHash = hashlib.sha256(content).hexdigest()
+        if knownCode is not None and sourceHash == knownHash:
+            return (knownCode, sourceHash)
+
+        return (compile(content.decode('utf8'), codeName, 'exec'), sourceHash)
@@ -0,0 +1,234 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import threading
+import typing as T
+
+from zenlog import log as logging
+from accendino.localdeps import packageDbStamp
+
+
+CONFIGURE_CACHE_DIR = 'configure-cache'
+ENTRIES_FILE = 'entries.json'
+
+# a line of an autoconf cache file, as written by configure for single line values
+AUTOCONF_LINE_RE = re.compile(r"^(?P<name>[A-Za-z0-9_]+_cv_[A-Za-z0-9_]+)=\$\{(?P=name)=(?P<value>.*)\}$")
+
+# autoconf results that only depend on the toolchain and the platform. Custom cache variables are left out as their
+# meaning depends on each project, and so are the ac_cv_env_* variables, configure checks them against the environment
+AUTOCONF_SHARED_PREFIXES = (
+    'ac_cv_header_', 'ac_cv_func_', 'ac_cv_type_', 'ac_cv_sizeof_', 'ac_cv_alignof_', 'ac_cv_member_',
+    'ac_cv_have_decl_', 'ac_cv_lib_', 'ac_cv_search_', 'ac_cv_c_', 'ac_cv_cxx_', 'ac_cv_prog_', 'ac_cv_path_',
+    'ac_cv_sys_', 'ac_cv_objext', 'ac_cv_exeext', 'ac_cv_build', 'ac_cv_host', 'ac_cv_target', 'lt_cv_', 'am_cv_',
+)
+
+# the variables changing the results of the compile and link checks (ac_cv_lib_*, ac_cv_search_*, ac_cv_func_*, ...)
+AUTOCONF_FLAGS_VARS = ('CC', 'CXX', 'CPP', 'CPPFLAGS', 'CFLAGS', 'CXXFLAGS', 'LDFLAGS', 'LIBS')
+
+# a result of check_include_file(), check_symbol_exists(), check_type_size() and friends in a CMakeCache.txt
+CMAKE_LINE_RE = re.compile(r'^(?P<name>(HAVE_|SIZEOF_)[A-Za-z0-9_]+):INTERNAL=(?P<value>.*)$')
+
+CMAKE_TRUE_VALUES = ('1', 'TRUE', 'ON', 'YES')
+
+
+def readAutoconfCache(path: str) -> T.Dict[str, str]:
+    '''
+        reads an autoconf cache file (see configure's --cache-file)
+        @param path: path of the cache file
+        @return a map of cache variable => line in the cache file
+    '''
+    ret = {}
+    try:
+        with open(path, 'rt', encoding='utf8', errors='replace') as f:
+            for l in f:
+                l = l.rstrip('\n')
+                m = AUTOCONF_LINE_RE.match(l)
+                if m:
+                    ret[m.group('name')] = l
+    except FileNotFoundError:
+        pass
+    return ret
+
+
+def autoconfShareable(name: str, line: str) -> bool:
+    ''' tells if an autoconf result can be shared between projects: only the positive results of the
+        generic checks, the negative ones may change when dependencies get installed in the prefix
+    '''
+    if not name.startswith(AUTOCONF_SHARED_PREFIXES):
+        return False
+
+    value = AUTOCONF_LINE_RE.match(line).group('value').strip("'")
+    return value not in ('', 'no')
+
+
+def autoconfFlagsKey(env: T.Dict[str, str], configureArgs: T.List[str]) -> str:
+    '''
+        computes the key of the flags the configure checks run with, autoconf results are only shared between the
+        artifacts configured with the same flags
+        @param env: environment configure runs with
+        @param configureArgs: arguments of configure, the VAR=value ones take precedence over the environment
+        @return the key
+    '''
+    flags = {k: env[k] for k in AUTOCONF_FLAGS_VARS if env.get(k, '')}
+    for arg in configureArgs:
+        name, sep, value = str(arg).partition('=')
+        if sep and name in AUTOCONF_FLAGS_VARS:
+            flags[name] = value
+    return hashlib.sha256(json.dumps(flags, sort_keys=True).encode('utf8')).hexdigest()[0:16]
+
+
+def readCMakeCache(path: str) -> T.Dict[str, str]:
+    '''
+        reads the results of the configure checks in a CMakeCache.txt that can be shared between projects,
+        that is the positive HAVE_* entries (and SIZEOF_* for the ones set by check_type_size())
+        @param path: path of the CMakeCache.txt
+        @return a map of variable => value
+    '''
+    entries = {}
+    try:
+        with open(path, 'rt', encoding='utf8', errors='replace') as f:
+            for l in f:
+                m = CMAKE_LINE_RE.match(l.rstrip('\n'))
+                if m:
+                    entries[m.group('name')] = m.group('value')
+    except FileNotFoundError:
+        return {}
+
+    ret = {}
+    for name, value in entries.items():
+        if not name.startswith('HAVE_') or value.upper() not in CMAKE_TRUE_VALUES:
+            continue
+
+        # check_type_size() skips the check when HAVE_<var> is defined, <var> must come with it
+        if name.startswith('HAVE_SIZEOF_'):
+            sizeVar = name[len('HAVE_'):]
+            if not entries.get(sizeVar, ''):
+                continue
+            ret[sizeVar] = entries[sizeVar]
+        ret[name] = value
+    return ret
+
+
+def _cmakeQuote(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class ConfigureCache:
+    ''' results of the configure checks of the artifacts of a build tree. They're kept in a directory
+        keyed by a fingerprint of the toolchain, the prefix and the installed platform packages, so that a
+        change of any of them starts with an empty cache. Autoconf results are shared between the artifacts
+        configured with the same flags (see autoconfFlagsKey()), a CMake check is only identified by its result
+        variable so CMake results are only reused by the artifact that found them
+    '''
+
+    def __init__(self, config) -> None:
+        '''
+            @param config: the accendino configuration
+        '''
+        self.config = config
+        self.lock = threading.Lock()
+        self.cacheDirs = {}
+
+    def fingerprint(self) -> str:
+        ''' returns the fingerprint of the environment the configure checks depend on '''
+        config = self.config
+        h = hashlib.sha256()
+        h.update(config.toolchainObj.fingerprint(['c', 'c++']).encode('utf8'))
+        h.update(json.dumps({
+            'prefix': str(config.prefix),
+            'target': [config.targetDistrib, config.targetArch, config.crossCompilation],
+            'packages': packageDbStamp(),
+        }, sort_keys=True).encode('utf8'))
+        return h.hexdigest()[0:16]
+
+    def cacheDir(self, buildTree: str) -> str:
+        '''
+            returns the cache directory of a build tree, the first call computes the fingerprint and removes the
+            outdated directories of the build tree
+            @param buildTree: name of the build tree
+        '''
+        with self.lock:
+            if buildTree not in self.cacheDirs:
+                baseDir = self.config.projectDir / CONFIGURE_CACHE_DIR
+                dirName = f'{buildTree}-{self.fingerprint()}'
+                if os.path.isdir(baseDir):
+                    for d in os.listdir(baseDir):
+                        if d.rsplit('-', 1)[0] == buildTree and d != dirName:
+                            logging.debug(f'removing outdated configure cache {d}')
+                            shutil.rmtree(baseDir / d, ignore_errors=True)
+
+                self.cacheDirs[buildTree] = baseDir / dirName
+            return self.cacheDirs[buildTree]
+
+    @staticmethod
+    def _load(cacheDir) -> T.Dict[str, T.Dict[str, T.Dict[str, str]]]:
+        ''' loads the entries of a cache directory, they're grouped by autoconf flags key or by CMake artifact '''
+        try:
+            with open(cacheDir / ENTRIES_FILE, 'rt', encoding='utf8') as f:
+                ret = json.load(f)
+            # entries of the previous versions were not grouped
+            return {kind: {k: v for k, v in ret.get(kind, {}).items() if isinstance(v, dict)}
+                    for kind in ('autotools', 'cmake')}
+        except (OSError, ValueError, AttributeError):
+            return {'autotools': {}, 'cmake': {}}
+
+    def _merge(self, buildTree: str, kind: str, group: str, entries: T.Dict[str, str]) -> None:
+        cacheDir = self.cacheDir(buildTree)
+        with self.lock:
+            content = self._load(cacheDir)
+            groupEntries = content[kind].setdefault(group, {})
+            if all(groupEntries.get(k) == v for k, v in entries.items()):
+                return
+
+            groupEntries.update(entries)
+            tmpPath = cacheDir / f'{ENTRIES_FILE}.{os.getpid()}.tmp'
+            try:
+                os.makedirs(cacheDir, exist_ok=True)
+                with open(tmpPath, 'wt', encoding='utf8') as f:
+                    json.dump(content, f, indent=1, sort_keys=True)
+                os.replace(tmpPath, cacheDir / ENTRIES_FILE)
+            except OSError as e:
+                logging.debug(f'unable to save the configure cache in {cacheDir}: {e}')
+
+    def seedAutoconf(self, buildTree: str, flagsKey: str, cacheFile: str) -> None:
+        '''
+            writes the cache file given to configure with the shared results and the positive results of the
+            previous run of this artifact
+            @param buildTree: name of the build tree
+            @param flagsKey: key of the flags configure runs with, see autoconfFlagsKey()
+            @param cacheFile: the cache file passed with --cache-file
+        '''
+        entries = {k: v for k, v in readAutoconfCache(cacheFile).items() if autoconfShareable(k, v)}
+        entries.update(self._load(self.cacheDir(buildTree))['autotools'].get(flagsKey, {}))
+
+        with open(cacheFile, 'wt', encoding='utf8') as f:
+            f.write('# configure cache seeded by accendino\n')
+            for name in sorted(entries):
+                f.write(f'{entries[name]}\n')
+
+    def collectAutoconf(self, buildTree: str, flagsKey: str, cacheFile: str) -> None:
+        ''' adds the shareable results of a configure run to the shared cache '''
+        entries = {k: v for k, v in readAutoconfCache(cacheFile).items() if autoconfShareable(k, v)}
+        if entries:
+            self._merge(buildTree, 'autotools', flagsKey, entries)
+
+    def seedCMake(self, buildTree: str, artifact: str, seedFile: str) -> None:
+        '''
+            writes the initial cache script given to cmake with -C
+            @param buildTree: name of the build tree
+            @param artifact: name of the artifact
+            @param seedFile: path of the script
+        '''
+        entries = self._load(self.cacheDir(buildTree))['cmake'].get(artifact, {})
+        with open(seedFile, 'wt', encoding='utf8') as f:
+            f.write('# results of configure checks seeded by accendino\n')
+            for name in sorted(entries):
+                f.write(f'set({name} {_cmakeQuote(entries[name])} CACHE INTERNAL "")\n')
+
+    def collectCMake(self, buildTree: str, artifact: str, cmakeCache: str) -> None:
+        ''' adds the results of a cmake run of an artifact to the cache '''
+        entries = readCMakeCache(cmakeCache)
+        if entries:
+            self._merge(buildTree, 'cmake', artifact, entries)
@@ -0,0 +1,225 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import concurrent.futures
+import urllib.request
+import urllib.error
+import typing as T
+
+from zenlog import log as logging
+from accendino.utils import getUserCacheDir
+
+
+# files smaller than this are always downloaded with a single request
+RANGED_MIN_SIZE = 32 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+class _TeeReader:
+    ''' a file-like object that copies what is read from src to dst '''
+
+    def __init__(self, src: T.BinaryIO, dst: T.BinaryIO) -> None:
+        self.src = src
+        self.dst = dst
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.src.read(size) if size is not None and size >= 0 else self.src.read()
+        self.dst.write(data)
+        return data
+
+
+class _HeadRedirectHandler(urllib.request.HTTPRedirectHandler):
+    ''' follows redirects of HEAD requests with HEAD requests (before python 3.12 they were turned in GET ones) '''
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        newReq = urllib.request.HTTPRedirectHandler.redirect_request(self, req, fp, code, msg, headers, newurl)
+        if newReq is not None and req.get_method() == 'HEAD':
+            newReq.method = 'HEAD'
+        return newReq
+
+
+def defaultDownloadCacheDir() -> str:
+    ''' returns the default location of the download cache (shared by all the work dirs of a user) '''
+    return getUserCacheDir('downloads')
+
+
+class DownloadCache:
+    ''' a cache of downloaded files keyed by URL, entries are written atomically and can be verified
+        with a sha256 checksum
+    '''
+
+    def __init__(self, rootDir: str, segments: int = 4, rangedMinSize: int = RANGED_MIN_SIZE) -> None:
+        '''
+            @param rootDir: directory holding the downloaded files
+            @param segments: number of parallel ranged requests used for big files
+            @param rangedMinSize: minimum size of a file for using ranged requests
+        '''
+        self.rootDir = rootDir
+        self.segments = max(1, segments)
+        self.rangedMinSize = rangedMinSize
+        self.lock = threading.Lock()
+        self.urlLocks = {}
+
+        os.makedirs(rootDir, exist_ok=True)
+
+    def entryPath(self, url: str, fileName: str) -> str:
+        ''' returns the path of the cache entry for url '''
+        urlHash = hashlib.sha256(url.encode('utf8')).hexdigest()[0:16]
+        return os.path.join(self.rootDir, urlHash, fileName)
+
+    def _urlLock(self, url: str) -> threading.Lock:
+        with self.lock:
+            if url not in self.urlLocks:
+                self.urlLocks[url] = threading.Lock()
+            return self.urlLocks[url]
+
+    @staticmethod
+    def digest(path: str) -> str:
+        ''' returns the sha256 of a file, it is stored next to the file so that it's computed only once '''
+        digestPath = f'{path}.sha256'
+        try:
+            if os.path.getmtime(digestPath) >= os.path.getmtime(path):
+                with open(digestPath, 'rt', encoding='utf8') as f:
+                    return f.read().strip()
+        except OSError:
+            pass
+
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                h.update(chunk)
+        ret = h.hexdigest()
+
+        try:
+            with open(digestPath, 'wt', encoding='utf8') as f:
+                f.write(ret)
+        except OSError:
+            pass
+        return ret
+
+    def lookup(self, url: str, fileName: str, sha256: str = None) -> str:
+        ''' returns the path of the cache entry for url if it exists and matches sha256, None otherwise '''
+        path = self.entryPath(url, fileName)
+        if not os.path.exists(path):
+            return None
+
+        if sha256 is None or self.digest(path) == sha256.lower():
+            return path
+
+        logging.info(f'checksum of cached {path} does not match, downloading it again')
+        return None
+
+    @staticmethod
+    def _consumeFile(path: str, consumer: T.Callable[[T.BinaryIO], bool]) -> bool:
+        with open(path, 'rb') as f:
+            return consumer(f)
+
+    def fetch(self, url: str, fileName: str, sha256: str = None,
+              consumer: T.Callable[[T.BinaryIO], bool] = None) -> str:
+        '''
+            returns the local path of the file at url, downloading it if it's not in the cache yet
+            @param fileName: name of the file in the cache
+            @param sha256: expected checksum of the file
+            @param consumer: an optional function that is given a stream of the content, when the file is
+                downloaded with a single request it reads the content while it arrives. When the checksum
+                doesn't match what the consumer did must be discarded.
+            @return the path of the file or None on error
+        '''
+        path = self.entryPath(url, fileName)
+
+        with self._urlLock(url):
+            cached = self.lookup(url, fileName, sha256)
+            if cached:
+                logging.debug(f'{url} found in download cache')
+                if consumer and not self._consumeFile(cached, consumer):
+                    return None
+                return cached
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+            os.close(fd)
+            try:
+                if not self._download(url, tmpPath, consumer):
+                    return None
+
+                # the digest is computed on the temporary file and stored along the final one
+                if os.path.exists(f'{path}.sha256'):
+                    os.remove(f'{path}.sha256')
+                digest = self.digest(tmpPath)
+                if sha256 and digest != sha256.lower():
+                    logging.error(f'checksum mismatch for {url}: expecting {sha256}, got {digest}')
+                    return None
+
+                # atomic, so that concurrent accendino processes never see a partial file
+                os.replace(tmpPath, path)
+                os.replace(f'{tmpPath}.sha256', f'{path}.sha256')
+                return path
+            finally:
+                for f in (tmpPath, f'{tmpPath}.sha256'):
+                    if os.path.exists(f):
+                        os.remove(f)
+
+    def _download(self, url: str, path: str, consumer: T.Callable[[T.BinaryIO], bool] = None) -> bool:
+        logging.debug(f'downloading {url}')
+        try:
+            size = self._probeSize(url) if self.segments > 1 else None
+            if size and size >= self.rangedMinSize:
+                if not self._downloadRanged(url, path, size):
+                    return False
+                return consumer is None or self._consumeFile(path, consumer)
+
+            with urllib.request.urlopen(url) as response, open(path, 'wb') as f:
+                if consumer and not consumer(_TeeReader(response, f)):
+                    return False
+
+                # what the consumer didn't read (or everything without consumer)
+                shutil.copyfileobj(response, f, CHUNK_SIZE)
+            return True
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            logging.error(f'error retrieving {url}: {e}')
+            return False
+
+    def _probeSize(self, url: str) -> int:
+        ''' returns the size of the file if the server supports ranged requests, None otherwise or if the
+            HEAD request failed (some servers reject it), in which case a single request is used
+        '''
+        opener = urllib.request.build_opener(_HeadRedirectHandler())
+        try:
+            with opener.open(urllib.request.Request(url, method='HEAD')) as response:
+                if response.headers.get('Accept-Ranges', '') == 'bytes':
+                    return int(response.headers.get('Content-Length', '0'))
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            logging.debug(f'HEAD request on {url} failed ({e}), downloading with a single request')
+        return None
+
+    def _downloadRanged(self, url: str, path: str, size: int) -> bool:
+        ''' downloads the file with parallel ranged requests, each one writing its part of the file '''
+        segmentSize = (size + self.segments - 1) // self.segments
+        ranges = [(start, min(start + segmentSize, size) - 1) for start in range(0, size, segmentSize)]
+        logging.debug(f'downloading {url} ({size} bytes) with {len(ranges)} ranged requests')
+
+        with open(path, 'wb') as f:
+            f.truncate(size)
+
+        def fetchRange(start: int, end: int) -> None:
+            req = urllib.request.Request(url, headers={'Range': f'bytes={start}-{end}'})
+            with urllib.request.urlopen(req) as response, open(path, 'r+b') as f:
+                if response.status != 206:
+                    raise ValueError(f'server ignored the range request (status {response.status})')
+
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = response.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise ValueError(f'short read for range {start}-{end}')
+                    f.write(chunk)
+                    remaining -= len(chunk)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [pool.submit(fetchRange, start, end) for start, end in ranges]
+            for future in futures:
+                future.result()
+        return True
@@ -0,0 +1,161 @@
+import os
+import re
+import stat
+import shutil
+import tarfile
+import zipfile
+import typing as T
+
+from zenlog import log as logging
+
+
+class ExtractError(Exception):
+    ''' raised when an archive contains a member that can't be extracted safely '''
+
+
+def _strippedPath(name: str, stripDepth: int) -> str:
+    '''
+        returns the path of an archive member once stripDepth leading components are removed, or None if
+        nothing is left
+    '''
+    if name.startswith('/') or name.startswith('\\') or re.match(r'^[A-Za-z]:', name):
+        raise ExtractError(f'absolute path {name} in archive')
+
+    parts = [p for p in name.replace('\\', '/').split('/') if p not in ('', '.')]
+    if '..' in parts:
+        raise ExtractError(f'path {name} goes outside of the extraction directory')
+
+    if len(parts) <= stripDepth:
+        return None
+    return '/'.join(parts[stripDepth:])
+
+
+def _checkSymlink(name: str, target: str) -> None:
+    ''' checks that a symlink created at name doesn't point outside of the extraction directory '''
+    if os.path.isabs(target) or re.match(r'^[A-Za-z]:', target):
+        raise ExtractError(f'symlink {name} points to absolute path {target}')
+
+    resolved = os.path.normpath(os.path.join(os.path.dirname(name), target))
+    if resolved == '..' or resolved.startswith('../') or resolved.startswith('..\\'):
+        raise ExtractError(f'symlink {name} points outside of the extraction directory')
+
+
+def _isWithin(path: str, root: str) -> bool:
+    return path == root or os.path.commonpath([path, root]) == root
+
+
+def checkDestination(targetDir: str, name: str, linkTarget: str = None, hardLink: bool = False) -> str:
+    '''
+        checks that an archive member can be written in the extraction directory. Unlike _checkSymlink() the check
+        follows the symlinks already extracted, so chained links can't escape, and an existing symlink at the
+        destination is removed so that nothing is written through it
+        @param targetDir: the extraction directory
+        @param name: path of the member relative to targetDir
+        @param linkTarget: target of the member if it's a link
+        @param hardLink: if the link is a hard link, its target is then relative to targetDir
+        @return the destination path
+    '''
+    root = os.path.realpath(targetDir)
+    dest = os.path.join(targetDir, name)
+    parent = os.path.realpath(os.path.dirname(dest))
+    if not _isWithin(parent, root):
+        raise ExtractError(f'{name} is outside of the extraction directory')
+
+    if os.path.islink(dest):
+        os.remove(dest)
+
+    if linkTarget is not None:
+        if os.path.isabs(linkTarget) or re.match(r'^[A-Za-z]:', linkTarget):
+            raise ExtractError(f'link {name} points to absolute path {linkTarget}')
+
+        resolved = os.path.realpath(os.path.join(root if hardLink else parent, linkTarget))
+        if not _isWithin(resolved, root):
+            raise ExtractError(f'link {name} points outside of the extraction directory')
+    return dest
+
+
+def extractTar(stream: T.BinaryIO, targetDir: str, stripDepth: int = 0) -> bool:
+    '''
+        extracts a (possibly compressed) tar archive read sequentially from stream, so that it can be
+        extracted while it is downloaded
+        @param stream: a file-like object, only read() is used
+        @param targetDir: the extraction directory
+        @param stripDepth: number of leading path components to remove from the members
+        @return if the operation was successful
+    '''
+    # python versions with extraction filters warn if none is given, the members are checked with
+    # checkDestination() in any case as the filters are missing in older versions
+    extractArgs = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+
+    try:
+        with tarfile.open(fileobj=stream, mode='r|*') as tar:
+            for member in tar:
+                name = _strippedPath(member.name, stripDepth)
+                if name is None:
+                    continue
+
+                if member.issym():
+                    _checkSymlink(name, member.linkname)
+                    checkDestination(targetDir, name, member.linkname)
+                elif member.islnk():
+                    member.linkname = _strippedPath(member.linkname, stripDepth)
+                    if member.linkname is None:
+                        raise ExtractError(f'hard link {member.name} points to a stripped directory')
+                    checkDestination(targetDir, name, member.linkname, hardLink=True)
+                elif member.isfile() or member.isdir():
+                    checkDestination(targetDir, name)
+                else:
+                    logging.debug(f'skipping special file {member.name}')
+                    continue
+
+                member.name = name
+                tar.extract(member, targetDir, **extractArgs)
+    except (tarfile.TarError, ExtractError, OSError, EOFError) as e:
+        logging.error(f'error extracting archive in {targetDir}: {e}')
+        return False
+
+    return True
+
+
+def extractZip(path: str, targetDir: str, stripDepth: int = 0) -> bool:
+    '''
+        extracts a zip archive, keeping the unix permissions and symlinks when they are recorded
+        @param path: path of the zip file
+        @param targetDir: the extraction directory
+        @param stripDepth: number of leading path components to remove from the members
+        @return if the operation was successful
+    '''
+    try:
+        with zipfile.ZipFile(path) as z:
+            for info in z.infolist():
+                name = _strippedPath(info.filename, stripDepth)
+                if name is None:
+                    continue
+
+                mode = info.external_attr >> 16
+                if info.is_dir():
+                    os.makedirs(checkDestination(targetDir, name), exist_ok=True)
+                    continue
+
+                if stat.S_ISLNK(mode):
+                    linkTarget = z.read(info).decode('utf8')
+                    _checkSymlink(name, linkTarget)
+                    dest = checkDestination(targetDir, name, linkTarget)
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    if os.path.lexists(dest):
+                        os.remove(dest)
+                    os.symlink(linkTarget, dest)
+                    continue
+
+                dest = checkDestination(targetDir, name)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+                with z.open(info) as fin, open(dest, 'wb') as fout:
+                    shutil.copyfileobj(fin, fout, 1024 * 1024)
+                if stat.S_IMODE(mode):
+                    os.chmod(dest, stat.S_IMODE(mode))
+    except (zipfile.BadZipFile, ExtractError, OSError, UnicodeDecodeError) as e:
+        logging.error(f'error extracting {path} in {targetDir}: {e}')
+        return False
+
+    return True
@@ -0,0 +1,127 @@
+import os
+import atexit
+import shutil
+import tempfile
+import contextlib
+import typing as T
+
+from packaging.version import Version
+from zenlog import log as logging
+from accendino.utils import getToolVersion
+
+
+class JobServer:
+    ''' a GNU make compatible jobserver whose tokens are shared by all the commands run by accendino
+
+        make (and ninja >= 1.13) find the jobserver in the MAKEFLAGS variable, they take a token from the
+        pool for each extra job they start. Accendino itself holds a token for each artifact that is being
+        prepared or built, that's the implicit token of the top level make/ninja process. This way the
+        total number of jobs stays under maxJobs whatever the number of artifacts built concurrently.
+    '''
+
+    def __init__(self, maxJobs: int) -> None:
+        '''
+            @param maxJobs: total number of tokens
+        '''
+        self.maxJobs = maxJobs
+        self.fifoDir = None
+        self.fifoPath = None
+        self.readFd = None
+        self.writeFd = None
+
+        # make >= 4.4 can use a named fifo, that's also the only form understood by ninja on POSIX
+        makeVersion = getToolVersion('make')
+        self.useFifo = makeVersion is not None and makeVersion >= Version('4.4')
+
+        if self.useFifo:
+            self.fifoDir = tempfile.mkdtemp(prefix='accendino-jobserver-')
+            self.fifoPath = os.path.join(self.fifoDir, 'fifo')
+            os.mkfifo(self.fifoPath, 0o600)
+            self.readFd = self.writeFd = os.open(self.fifoPath, os.O_RDWR)
+        else:
+            self.readFd, self.writeFd = os.pipe()
+
+        os.write(self.writeFd, b'+' * maxJobs)
+        atexit.register(self.close)
+
+        logging.debug(f" * jobserver with {maxJobs} tokens using {self.fifoPath if self.useFifo else 'a pipe'}")
+
+    def close(self) -> None:
+        ''' releases the jobserver resources '''
+        for fd in set((self.readFd, self.writeFd)):
+            if fd is not None:
+                os.close(fd)
+        self.readFd = self.writeFd = None
+
+        if self.fifoDir:
+            shutil.rmtree(self.fifoDir, ignore_errors=True)
+            self.fifoDir = None
+
+    def makeFlags(self) -> str:
+        ''' @return the content of MAKEFLAGS for the clients of this jobserver '''
+        if self.useFifo:
+            return f' -j{self.maxJobs} --jobserver-auth=fifo:{self.fifoPath}'
+
+        return f' -j{self.maxJobs} --jobserver-fds={self.readFd},{self.writeFd} --jobserver-auth={self.readFd},{self.writeFd}'
+
+    def passFds(self) -> T.Tuple[int]:
+        ''' @return the file descriptors that must be inherited by the clients '''
+        if self.useFifo:
+            return ()
+        return (self.readFd, self.writeFd)
+
+    def clientEnv(self, env: T.Dict[str, str]) -> T.Dict[str, str]:
+        ''' @return a copy of env with the jobserver settings '''
+        ret = env.copy()
+        ret['MAKEFLAGS'] = self.makeFlags()
+        return ret
+
+    def handles(self, tool: str) -> bool:
+        ''' tells if the given builder is a client of the jobserver, so that no -j argument must
+            be passed to it
+            @param tool: the builder (make, ninja or meson)
+        '''
+        if tool == 'make':
+            return True
+
+        if tool in ('ninja', 'meson',):
+            ninjaVersion = getToolVersion('ninja')
+            return self.useFifo and ninjaVersion is not None and ninjaVersion >= Version('1.13')
+
+        return False
+
+    def acquire(self) -> None:
+        ''' takes a token, blocking until one is available '''
+        os.read(self.readFd, 1)
+
+    def release(self) -> None:
+        ''' gives back a token '''
+        os.write(self.writeFd, b'+')
+
+    @contextlib.contextmanager
+    def token(self):
+        ''' context manager that holds a token '''
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def jobsPerArtifact(config) -> int:
+    ''' returns the number of jobs given with -j to the builders that can't use the jobserver (like ninja before
+        1.13), the jobs are split between the artifacts built at the same time so that they stay under maxJobs
+    '''
+    return max(1, config.maxJobs // config.artifactJobs)
+
+
+def createJobServer(config) -> JobServer:
+    ''' creates the jobserver for the given config, or None if not supported on this platform '''
+    if config.distribId in ('Windows',) or not hasattr(os, 'mkfifo'):
+        return None
+
+    try:
+        return JobServer(config.maxJobs)
+    except OSError as e:
+        logging.info(f"unable to create a jobserver, builds will use -j{config.maxJobs}: {e}")
+        return None
@@ -1,13 +1,137 @@
 import os
+import json
+import threading
 import subprocess
 import typing as T
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 from zenlog import log as logging
-from accendino.utils import findInPATH
+from accendino.utils import findInPATH, getPathIndex, resetPathIndex, getUserCacheDir
 from accendino.platform import accendinoPlatform
 
 
+DPKG_STATUS = '/var/lib/dpkg/status'
+PACMAN_LOCAL_DB = '/var/lib/pacman/local'
+RPM_DBS = ('/var/lib/rpm/rpmdb.sqlite', '/usr/lib/sysimage/rpm/rpmdb.sqlite', '/var/lib/rpm/Packages')
+PKG_DB = '/var/db/pkg/local.sqlite'
+
+
+def packageDbStamp() -> T.List[T.Any]:
+    ''' returns the modification time and size of the package databases found on this system, it changes
+        each time a package is installed or removed
+    '''
+    ret = []
+    for dbPath in (DPKG_STATUS, PACMAN_LOCAL_DB, PKG_DB) + RPM_DBS:
+        try:
+            st = os.stat(dbPath)
+        except OSError:
+            continue
+        ret.append([dbPath, st.st_mtime_ns, st.st_size])
+    return ret
+
+
+def readDpkgStatus(path: str) -> T.Dict[str, str]:
+    '''
+        reads the installed packages from a dpkg status file, like `dpkg -l` we only keep the packages that are
+        wanted and installed (the `ii` ones)
+        @return a dict package name -> version
+    '''
+    ret = {}
+    with open(path, 'rt', encoding='utf8', errors='replace') as f:
+        content = f.read()
+
+    for stanza in content.split('\n\n'):
+        name = version = status = None
+        for line in stanza.split('\n'):
+            if line.startswith('Package:'):
+                name = line[8:].strip()
+            elif line.startswith('Version:'):
+                version = line[8:].strip()
+            elif line.startswith('Status:'):
+                status = line[7:].split()
+
+        if name and status and status[0] == 'install' and status[-1] == 'installed':
+            ret[name] = version
+    return ret
+
+
+def readPacmanLocalDb(path: str) -> T.Dict[str, str]:
+    '''
+        reads the installed packages from the local database of pacman, it contains a `<name>-<version>-<rel>`
+        directory per installed package
+        @return a dict package name -> version (with the release like `pacman -Q`)
+    '''
+    ret = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            if not entry.is_dir():
+                continue
+
+            tokens = entry.name.rsplit('-', 2)
+            if len(tokens) == 3:
+                ret[tokens[0]] = f'{tokens[1]}-{tokens[2]}'
+    return ret
+
+
+class PackageDbCache:
+    ''' an on-disk cache of the installed packages of the package managers, an entry is invalidated when the
+        modification time or the size of the package database changes
+    '''
+
+    def __init__(self, cacheDir: str) -> None:
+        '''
+            @param cacheDir: directory storing the cached lists, None to disable the cache
+        '''
+        self.cacheDir = cacheDir
+
+    def load(self, name: str, dbPath: str, reader: T.Callable[[], T.Dict[str, str]]) -> T.Dict[str, str]:
+        '''
+            returns the installed packages of a package manager
+            @param name: name of the package manager
+            @param dbPath: path of the package database, its stamp validates the cache entry
+            @param reader: function reading the installed packages when the entry is outdated
+            @return the installed packages, None if the database doesn't exist or can't be read
+        '''
+        try:
+            st = os.stat(dbPath)
+        except OSError:
+            return None
+
+        stamp = [st.st_mtime_ns, st.st_size]
+        if self.cacheDir:
+            cachePath = os.path.join(self.cacheDir, f'{name}.json')
+            try:
+                with open(cachePath, 'rt', encoding='utf8') as f:
+                    content = json.load(f)
+                if content['db'] == dbPath and content['stamp'] == stamp:
+                    return content['packages']
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        try:
+            packages = reader()
+        except (OSError, ValueError) as e:
+            logging.debug(f'unable to read package database {dbPath}: {e}')
+            return None
+
+        if packages is not None and self.cacheDir:
+            tmpPath = f'{cachePath}.{os.getpid()}.tmp'
+            try:
+                os.makedirs(self.cacheDir, exist_ok=True)
+                with open(tmpPath, 'wt', encoding='utf8') as f:
+                    json.dump({'db': dbPath, 'stamp': stamp, 'packages': packages}, f)
+                os.replace(tmpPath, cachePath)
+            except OSError as e:
+                logging.debug(f'unable to write package cache {cachePath}: {e}')
+                if os.path.exists(tmpPath):
+                    os.remove(tmpPath)
+
+        return packages
+
+defaultPackageDbCache = PackageDbCache(getUserCacheDir('packages'))
+
+
 class PackageManagerBase:
     ''' base package manager '''
 
@@ -17,6 +141,34 @@ class PackageManagerBase:
         self.debug = True
         self.canInstall = True
 
+    def loadPackages(self, dbPath: str, reader: T.Callable[[], T.Dict[str, str]] = None,
+                     dbCache: PackageDbCache = None) -> None:
+        '''
+            fills allPackages from the package database with reader (listInstalled() by default), the result is
+            cached until the database changes. If the database is missing or unreadable, listInstalled() is used
+            @param dbPath: path of the package database
+            @param reader: a function reading the database
+            @param dbCache: the cache to use, defaultPackageDbCache by default
+        '''
+        if dbCache is None:
+            dbCache = defaultPackageDbCache
+
+        packages = None
+        if dbPath:
+            packages = dbCache.load(self.name, dbPath, reader or self.listInstalled)
+
+        if packages is None:
+            packages = self.listInstalled()
+
+        self.allPackages = packages
+        logging.debug(f" * {self.name} package manager: got {len(self.allPackages)} installed packages")
+
+    def listInstalled(self) -> T.Dict[str, str]:
+        ''' lists the installed packages with the package manager commands
+            @return a dict package name -> version
+        '''
+        return {}
+
     def checkMissing(self, packages: T.List[str]) -> T.List[str]:
         ret = []
 
@@ -39,9 +191,12 @@ class PackageManagerBase:
 class DpkgManager(PackageManagerBase):
     ''' dpkg based package manager '''
 
-    def __init__(self) -> None:
+    def __init__(self, statusPath: str = DPKG_STATUS, dbCache: PackageDbCache = None) -> None:
         PackageManagerBase.__init__(self, "dpkg")
+        self.loadPackages(statusPath, lambda: readDpkgStatus(statusPath), dbCache)
 
+    def listInstalled(self) -> T.Dict[str, str]:
+        ret = {}
         pack_re = re.compile(r'ii[^\w]+([^ ]+)[^\w]+([^ ]+)')
         for l in subprocess.Popen(['dpkg', '-l'], stdout=subprocess.PIPE, bufsize=1024).stdout.readlines():
             matches = pack_re.match(l.decode('utf8'))
@@ -54,9 +209,8 @@ class DpkgManager(PackageManagerBase):
                 pkgName = pkgName[0:pos]
 
             version = matches.group(2)
-            self.allPackages[pkgName] = version
-
-        logging.debug(f" * {self.name} package manager: got {len(self.allPackages)} installed packages")
+            ret[pkgName] = version
+        return ret
 
     def installPackages(self, packages: T.List[str]) -> bool:
         logging.debug(f" * {self.name}, installing missing packages: {' '.join(packages)}")
@@ -71,15 +225,24 @@ class DpkgManager(PackageManagerBase):
 class RpmManager(PackageManagerBase):
     ''' rpm based package manager '''
 
-    def __init__(self) -> None:
+    def __init__(self, dbCache: PackageDbCache = None) -> None:
         PackageManagerBase.__init__(self, "rpm")
 
+        # the rpm database has no simple format, it is still listed with rpm but only when it changes
+        dbPath = None
+        for p in RPM_DBS:
+            if os.path.exists(p):
+                dbPath = p
+                break
+        self.loadPackages(dbPath, dbCache=dbCache)
+
+    def listInstalled(self) -> T.Dict[str, str]:
+        ret = {}
         for l in subprocess.Popen(['rpm', '-qa', '--qf', '%{NAME} %{VERSION}\\n'], stdout=subprocess.PIPE, bufsize=1024) \
                             .stdout.readlines():
             tokens = l.decode('utf-8').strip().split(' ', 2)
-            self.allPackages[tokens[0]] = tokens[1]
-
-        logging.debug(f" * {self.name} package manager: got {len(self.allPackages)} installed packages")
+            ret[tokens[0]] = tokens[1]
+        return ret
 
     def installPackages(self, packages: T.List[str]) -> bool:
         logging.debug(f" * {self.name}, installing missing packages: {' '.join(packages)}")
@@ -119,8 +282,9 @@ class InPathSubManager(PackageManagerBase):
 
     def checkMissing(self, packages: T.List[str]) -> T.List[str]:
         ret = []
+        pathIndex = getPathIndex()
         for p in packages:
-            if findInPATH(p) is None:
+            if pathIndex.find(p) is None:
                 ret.append(p)
 
         return ret
@@ -162,13 +326,16 @@ class ChocoManager(PackageManagerBase):
 class PacmanManager(PackageManagerBase):
     ''' Pacman based package manager for Arch or msys2 '''
 
-    def __init__(self, name: str = 'pacman') -> None:
+    def __init__(self, name: str = 'pacman', localDb: str = PACMAN_LOCAL_DB, dbCache: PackageDbCache = None) -> None:
         PackageManagerBase.__init__(self, name)
+        self.loadPackages(localDb, lambda: readPacmanLocalDb(localDb), dbCache)
+
+    def listInstalled(self) -> T.Dict[str, str]:
+        ret = {}
         for l in self.executePipe(['pacman', '-Q']).stdout.readlines():
             tokens = l.decode('utf-8').strip().split(' ', 2)
-            self.allPackages[tokens[0]] = tokens[1]
-
-        logging.debug(f" * {self.name} package manager: got {len(self.allPackages)} installed packages")
+            ret[tokens[0]] = tokens[1]
+        return ret
 
     def executePipe(self, cmd: T.List[str]):
         logging.debug(f"executing {' '.join(cmd)}")
@@ -197,7 +364,7 @@ class Msys2Manager(PacmanManager):
     ''' '''
     def __init__(self, path) -> None:
         self.msysShellPath = path
-        PacmanManager.__init__(self, "msys2")
+        PacmanManager.__init__(self, "msys2", os.path.join(os.path.dirname(path), 'var', 'lib', 'pacman', 'local'))
 
     def executePipe(self, cmd: T.List[str]):
         newCmd = [self.msysShellPath, '-defterm', '-no-start', '-mingw64', '-here', '-c', " ".join(cmd)]
@@ -206,18 +373,20 @@ class Msys2Manager(PacmanManager):
 class PkgManager(PackageManagerBase):
     ''' pkg based package manager for FreeBSD '''
 
-    def __init__(self) -> None:
+    def __init__(self, dbCache: PackageDbCache = None) -> None:
         PackageManagerBase.__init__(self, "pkg")
+        self.loadPackages(PKG_DB, dbCache=dbCache)
 
+    def listInstalled(self) -> T.Dict[str, str]:
+        ret = {}
         for l in subprocess.Popen(['pkg', 'info'], stdout=subprocess.PIPE, bufsize=1024) \
                     .stdout.readlines():
             v = l.decode('utf-8').strip().split(' ', 2)[0]
             pos = v.rfind('-')
             name = v[0:pos]
             version = v[pos+1:]
-            self.allPackages[name] = version
-
-        logging.debug(f" * ${self.name} package manager: got {len(self.allPackages)} installed packages")
+            ret[name] = version
+        return ret
 
     def installPackages(self, packages: T.List[str]) -> bool:
         logging.debug(f" * {self.name}, installing missing packages: {' '.join(packages)}")
@@ -229,15 +398,68 @@ class PkgManager(PackageManagerBase):
         return os.system(cmd) == 0
 
 class PackageManager(PackageManagerBase):
-
-    def __init__(self, name, managers):
+    ''' a package manager dispatching packages to sub package managers with the `<manager>/<package>` syntax '''
+
+    def __init__(self, name: str, managers: T.Dict[str, T.Callable[[], PackageManagerBase]]) -> None:
+        '''
+            @param name: name of the package manager
+            @param managers: factories of the sub package managers by prefix ('' for the default one), a manager
+                    is only created (and so lists its installed packages) when a package is routed to it
+        '''
         PackageManagerBase.__init__(self, name)
         self.managers = managers
+        self.instances = {}
+        self.lock = threading.Lock()
+        self.managerLocks = {}
+
+    def getManager(self, name: str) -> PackageManagerBase:
+        ''' returns the sub package manager with that prefix, creating it on first use
+            @return the manager, None if there's no such manager
+        '''
+        factory = self.managers.get(name, None)
+        if factory is None:
+            return None
+
+        with self.lock:
+            lock = self.managerLocks.setdefault(name, threading.Lock())
+
+        with lock:
+            ret = self.instances.get(name, None)
+            if ret is None:
+                logging.debug(f" * {self.name}: loading {name or 'default'} package manager")
+                ret = factory()
+                self.instances[name] = ret
+            return ret
+
+    def loadManagers(self, names: T.Iterable[str]) -> None:
+        ''' creates the given sub package managers concurrently '''
+        names = [n for n in set(names) if n in self.managers and n not in self.instances]
+        if len(names) < 2:
+            for n in names:
+                self.getManager(n)
+            return
+
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            list(executor.map(self.getManager, names))
+
+    @staticmethod
+    def splitPackage(p: str) -> T.Tuple[str, str]:
+        ''' splits a `<manager>/<package>` package spec
+            @return a tuple (manager, package), manager is '' for the default manager
+        '''
+        tokens = p.strip().split('/', 2)
+        if len(tokens) == 1:
+            return ('', tokens[0])
+        return (tokens[0], tokens[1])
 
     def checkMissing(self, packages: T.List[str]) -> T.List[str]:
         packagesPerManager = {}
         ret = []
 
+        # load concurrently the managers that will be queried for sure: the ones of plain packages and the first
+        # choice of alternatives
+        self.loadManagers(self.splitPackage(p.split('|')[0])[0] for p in packages)
+
         for p in packages:
             alternatives = p.split('|')
 
@@ -250,15 +472,9 @@ class PackageManager(PackageManagerBase):
                 cand = None
 
                 for alter in alternatives:
-                    tokens = alter.strip().split('/', 2)
-                    if len(tokens) == 1:
-                        # no sub manager set, using default
-                        manager = ''
-                        package = tokens[0]
-                    else:
-                        (manager, package) = tokens
+                    (manager, package) = self.splitPackage(alter)
 
-                    managerObj = self.managers.get(manager, None)
+                    managerObj = self.getManager(manager)
                     if managerObj:
                         if len(managerObj.checkMissing([package])) == 0:
                             found = True
@@ -275,12 +491,7 @@ class PackageManager(PackageManagerBase):
                         return None
 
             else:
-                tokens = p.strip().split('/', 2)
-                if len(tokens) == 1:
-                    package = tokens[0]
-                    manager = ''
-                else:
-                    (manager, package) = tokens
+                (manager, package) = self.splitPackage(p)
 
                 if manager in packagesPerManager:
                     packagesPerManager[manager].append(package)
@@ -294,7 +505,7 @@ class PackageManager(PackageManagerBase):
         }
 
         for managerName, pkgs in packagesPerManager.items():
-            managerObj = self.managers.get(managerName, None)
+            managerObj = self.getManager(managerName)
             # no sub manager set, using default
             if managerObj is None:
                 msg = helpMsg.get(managerName, None)
@@ -318,66 +529,70 @@ class PackageManager(PackageManagerBase):
 
         return ret
 
-    def installPackages(self, packages: T.List[str]) -> bool:
-        logging.debug(f" * {self.name}, installing missing packages: {' '.join(packages)}")
-
-        packagesPerManager = {}
+    def installPlan(self, packages: T.List[str]) -> T.Dict[str, T.List[str]]:
+        ''' groups the packages to install by sub package manager, so that each one installs all its packages
+            in a single transaction
+            @return a dict manager name -> packages, None if a package uses an unknown manager
+        '''
+        ret = {}
         for p in packages:
-            tokens = p.split('/', 2)
-            if len(tokens) == 1:
-                managerName = ''
-                package = tokens[0]
-            else:
-                (managerName, package) = tokens
-
+            (managerName, package) = self.splitPackage(p)
             if managerName not in self.managers:
                 logging.error(f"{managerName} not registered")
-                return False
+                return None
 
-            if managerName in packagesPerManager:
-                packagesPerManager[managerName].append(p)
-            else:
-                packagesPerManager[managerName] = [ package ]
+            pkgs = ret.setdefault(managerName, [])
+            if package not in pkgs:
+                pkgs.append(package)
+        return ret
 
+    def installPackages(self, packages: T.List[str]) -> bool:
+        logging.debug(f" * {self.name}, installing missing packages: {' '.join(packages)}")
+
+        packagesPerManager = self.installPlan(packages)
+        if packagesPerManager is None:
+            return False
 
         for managerName, pkgs in packagesPerManager.items():
             visualName = managerName and managerName or 'default'
             logging.info(f'installing [{" ".join(pkgs)}] on {visualName} package manager')
-            manager = self.managers[managerName]
+            manager = self.getManager(managerName)
             if not manager.installPackages(pkgs):
                 return False
 
+        # installed packages may have added programs
+        resetPathIndex()
         return True
 
 
 
 def getPkgManager(distribId, packagesToCheck):
-    managers = {'path': InPathSubManager()}
+    managers = {'path': InPathSubManager}
     name = 'unknown'
     if distribId in ('Ubuntu', 'Debian', ):
         name = 'dpkg'
-        managers[''] = DpkgManager()
+        managers[''] = DpkgManager
     elif distribId in ('Fedora', 'RedHat', ):
         name = 'rpm'
-        managers[''] = RpmManager()
+        managers[''] = RpmManager
     elif distribId in ('Windows',):
         name = 'windows'
         chocoPath = findInPATH("choco.exe")
         if chocoPath:
-            managers['choco'] = ChocoManager(chocoPath)
+            managers['choco'] = lambda: ChocoManager(chocoPath)
 
         if accendinoPlatform.msys2path:
-            managers['msys2'] = Msys2Manager(accendinoPlatform.msys2path)
+            managers['msys2'] = lambda: Msys2Manager(accendinoPlatform.msys2path)
         packagesToCheck.append('path/powershell.exe')
 
     elif distribId in ('Darwin',):
         name = 'brew'
-        managers[''] = BrewManager()
+        managers[''] = BrewManager
     elif distribId in ('FreeBSD',):
         name = 'pkg'
-        managers[''] = PkgManager()
+        managers[''] = PkgManager
     elif distribId in ('Arch',):
         name = 'pacman'
-        managers[''] = PacmanManager()
+        managers[''] = PacmanManager
 
     return PackageManager(name, managers)
@@ -13,10 +13,19 @@ import accendino
 from accendino.builditems import BuildArtifact, AutogenBuildArtifact, CMakeBuildArtifact, DepsBuildArtifact, \
     MesonBuildArtifact, QMakeBuildArtifact, CustomCommandBuildArtifact
 from accendino.localdeps import getPkgManager
-from accendino.sources import LocalSource, GitSource, RemoteArchiveSource, Source
+from accendino.sources import LocalSource, GitSource, RemoteArchiveSource, Source, GitMirrorCache
 from accendino.utils import ConditionalDep, DepsAdjuster, checkVersionCondition, checkAccendinoVersion, \
-    NativePath, RunInShell, mergePkgDeps, is_exact_instance
-from accendino.toolchain import getToolchain
+    NativePath, RunInShell, mergePkgDeps, is_exact_instance, getUserCacheDir
+from accendino.toolchain import getToolchain, CompilerCache, COMPILER_CACHES, LINKERS
+from accendino.scheduler import BuildScheduler, SourcePrefetcher, BackgroundStage
+from accendino.jobserver import createJobServer
+from accendino.bincache import BinaryCache
+from accendino.confcache import ConfigureCache
+from accendino.codecache import SourceCodeCache
+from accendino.pocketindex import PocketIndex, DeferredInclude, RESERVED_NAMES
+from accendino.registry import ArtifactRegistry, DependencyCycleError, providedNames
+from accendino.download import DownloadCache, defaultDownloadCacheDir
+from accendino.statedb import BuildStateDb, STATE_DB_FILE
 
 
 
@@ -33,6 +42,24 @@ def doHelp(args, is_error) -> int:
     print("\t--options=<path>: a path to the build options file")
     print("\t--refreshSources: force updating git sources and rebuild artifacts whose sources changed")
     print("\t--refresh: force rebuild of the requested targets, even if they were already built")
+    print("\t--jobs=<n>: maximum number of compilation jobs shared by all the builds (defaults to the number of cores)")
+    print("\t--jobs-artifacts=<n>: number of artifacts that can be built at the same time (defaults to 1)")
+    print("\t--binary-cache=<dir|url>: location of the binary cache of built artifacts")
+    print("\t--compiler-cache=<ccache|sccache|none>: compiler cache used in front of the toolchain compilers (defaults to none)")
+    print("\t--compiler-cache-dir=<dir>: cache directory of the compiler cache, shared by all the artifacts")
+    print("\t--linker=<default|lld|mold|gold>: linker used by the gcc and clang toolchains (defaults to the default linker of the compiler)")
+    print("\t--split-dwarf: put the debug info in separate .dwo files in debug builds")
+    print("\t--compress-debug-sections: compress the debug sections in debug builds")
+    print("\t--no-configure-cache: don't share the results of configure checks between the autotools and cmake artifacts")
+    print("\t--deps-rebuild=<incremental|reconfigure>: what to do when dependencies of a built artifact were rebuilt (defaults to incremental)")
+    print("\t--no-early-cutoff: rebuild the artifacts depending on a rebuilt artifact even if its interface didn't change")
+    print("\t--uninstall=<artifacts>: a list of comma separated artifacts whose installed files are removed from the prefix")
+    print("\t--jobs-checkout=<n>: number of sources that can be checked out at the same time (defaults to 4)")
+    print("\t--git-mirror-dir=<dir>: directory of shared git mirrors used to clone git sources")
+    print("\t--download-cache=<dir>: directory where remote archives are downloaded (defaults to ~/.cache/accendino/downloads)")
+    print("\t--download-segments=<n>: number of parallel ranged requests used to download big archives (defaults to 4)")
+    print("\t--packages-dry-run: report the platform packages that would be installed and exit")
+    print("\t--eager-includes: evaluate all included files, even the ones that define no artifact needed by the targets")
     if is_error:
         return 1
 
@@ -112,6 +139,7 @@ def detectPlatform() -> None:
 
 
 BUILD_TYPES = ('release', 'debug',)
+DEPS_REBUILD_MODES = ('incremental', 'reconfigure')
 ARCHS = ('i686', 'x86_64')
 
 ARCHS_MAP = {
@@ -135,16 +163,42 @@ class AccendinoConfig:
         self.buildsDir = None
         self.toolsDir = None
         self.targets = None
-        self.buildDefs = []
+        self.registry = ArtifactRegistry()
+        self.indexedArtifacts = None
+        self.indexedCount = 0
+        self.definedArtifacts = {}
         self.distribId = None
         self.distribVersion = None
         self.checkPackages = True
+        self.packagesDryRun = False
         self.doBuild = True
         self.libdir = 'lib'
         self.resumeFrom = None
         self.refreshSources = False
         self.refresh = False
-        self.maxJobs = 5
+        self.maxJobs = os.cpu_count() or 5
+        self.jobServer = None
+        self.binaryCacheLocation = None
+        self.binaryCache = None
+        self.compilerCacheTool = None
+        self.compilerCacheDir = None
+        self.compilerCache = None
+        self.linker = 'default'
+        self.splitDwarf = False
+        self.compressDebugSections = False
+        self.useConfigureCache = True
+        self.depsRebuildMode = 'incremental'
+        self.earlyCutoff = True
+        self.configureCache = None
+        self.stateDb = None
+        self.gitMirrorDir = os.environ.get('ACCENDINO_GIT_MIRRORS', None)
+        self.gitMirrors = None
+        self.downloadCacheDir = os.environ.get('ACCENDINO_DOWNLOAD_CACHE', None) or defaultDownloadCacheDir()
+        self.downloadSegments = 4
+        self.downloadCache = None
+        self.uninstallTargets = None
+        self.artifactJobs = 1
+        self.checkoutJobs = 4
         self.crossCompilation = False
         self.toolchain = 'default'
         self.toolchainObj = None
@@ -165,7 +219,18 @@ class AccendinoConfig:
         #   * first paths provided in ACCENDINO_PATH,
         #   * then in the accendino pocket
         self.pocketSearchPaths = os.environ.get('ACCENDINO_PATH', '').split(':') + [ self.pocketDir ]
+        # resolved paths of the source files that were read, include_once is checked against them
         self.includedFiles = []
+        self.resolvedSourceFiles = {}
+        self.codeCache = SourceCodeCache(getUserCacheDir('code'))
+        self.lazyIncludes = True
+        self.pocketIndex = None
+        self.frameworkNames = None
+        self.frameworkValues = {}
+        self.deferredIncludes = []
+        self.deferredSeq = 0
+        self.attributedArtifacts = set()
+        self.resolvedArtifacts = set()
 
         def includeFn(fname: str, include_once: bool = True) -> bool:
             ''' '''
@@ -173,28 +238,22 @@ class AccendinoConfig:
                 fname = fname + '.accendino'
 
             logging.debug(f"including file '{fname}'")
-            ret = self.readSource(fname, include_once)
-            if ret:
-                self.includedFiles.append(fname)
-            return ret
+            return self.readSource(fname, include_once, self.lazyIncludes)
 
 
         def pickDeps(name: str) -> T.List[T.Any]:
             ''' '''
-            targets = self.context.get("ARTIFACTS", [])
-            for t in targets:
-                if t.name == name:
-                    return t.deps[:]
+            t = self.findDefinedArtifact(name)
+            if t:
+                return t.deps[:]
             return None
 
         def pickPkgDeps(name: str, extra = None, override : bool = False) -> T.Dict[str, T.List[str]]:
             ''' '''
             ret = None
-            targets = self.context.get("ARTIFACTS", [])
-            for t in targets:
-                if t.name == name:
-                    ret = t.pkgs.copy()
-                    break
+            t = self.findDefinedArtifact(name)
+            if t:
+                ret = t.pkgs.copy()
 
             if ret is None:
                 logging.error(f'error picking package dependencies of {name}')
@@ -294,15 +353,24 @@ class AccendinoConfig:
         if fname.startswith('.') or fname.startswith('/'):
             searchPaths = ['']
 
-        for p in searchPaths:
-            fpath = os.path.join(p, fname)
-            if os.path.exists(fpath) and os.path.isfile(fpath):
-                if include_once and fpath in self.includedFiles:
-                    logging.debug(f"file '{fpath}' already included")
-                    return True
-                return fpath
+        # the search path only changes with the includes stack, so resolutions are memoized
+        key = (fname, tuple(str(p) for p in searchPaths))
+        if key in self.resolvedSourceFiles:
+            fpath = self.resolvedSourceFiles[key]
+        else:
+            fpath = None
+            for p in searchPaths:
+                candidate = os.path.join(p, fname)
+                if os.path.isfile(candidate):
+                    # the same file may be reached through different search paths
+                    fpath = os.path.realpath(candidate)
+                    break
+            self.resolvedSourceFiles[key] = fpath
 
-        return None
+        if fpath and include_once and fpath in self.includedFiles:
+            logging.debug(f"file '{fpath}' already included")
+            return True
+        return fpath
 
     def cmakeBuildType(self) -> str:
         ''' '''
@@ -320,12 +388,65 @@ class AccendinoConfig:
             return self.buildType
         raise Exception(f"{self.buildType} build type not supported for meson")
 
+    def findDefinedArtifact(self, name: str) -> BuildArtifact:
+        ''' returns the first artifact with the given name in the ARTIFACTS of the context, the index is
+            updated incrementally while source files append artifacts
+        '''
+        artifacts = self.context.get('ARTIFACTS', [])
+        if self.deferredIncludes:
+            # the artifact may be defined by a file whose evaluation was deferred
+            for d in self._deferredDefining({name}):
+                self._evaluateDeferred(d)
+
+        if artifacts is not self.indexedArtifacts or len(artifacts) < self.indexedCount:
+            self.indexedArtifacts = artifacts
+            self.indexedCount = 0
+            self.definedArtifacts = {}
+
+        for i in range(self.indexedCount, len(artifacts)):
+            self.definedArtifacts.setdefault(artifacts[i].name, artifacts[i])
+        self.indexedCount = len(artifacts)
+
+        return self.definedArtifacts.get(name, None)
+
     def getBuildItem(self, name: str) -> BuildArtifact:
-        ''' '''
-        for item in self.buildDefs:
-            if item.name == name or name in item.provides:
-                return item
-        return None
+        ''' returns the artifact with that name or providing it '''
+        ret = self.registry.get(name)
+        if ret:
+            self.resolveArtifact(ret)
+        return ret
+
+    def resolveArtifact(self, buildItem: BuildArtifact) -> None:
+        ''' applies the ConditionalDep of the deps and package deps of an artifact, it is done once and only
+            for artifacts that are reached from the targets
+        '''
+        if id(buildItem) in self.resolvedArtifacts:
+            return
+        self.resolvedArtifacts.add(id(buildItem))
+
+        newDeps = []
+        for dep in buildItem.deps:
+            if isinstance(dep, str):
+                newDeps.append(dep)
+            elif isinstance(dep, ConditionalDep):
+                newDeps = dep.apply(self, newDeps)
+            else:
+                logging.error(f'don\'t know how to treat artifact dependency with type {type(dep)}')
+        buildItem.deps = newDeps
+
+        newPkg = {}
+        for k, v in buildItem.pkgs.items():
+            newList = []
+            for dep in v:
+                if isinstance(dep, str):
+                    newList.append(dep)
+                elif isinstance(dep, ConditionalDep):
+                    newList = dep.apply(self, newList)
+                else:
+                    logging.error(f'don\'t know how to treat package dependency with type {type(dep)}')
+
+            newPkg[k] = newList
+        buildItem.pkgs = newPkg
 
     def default_getCrossPlatformFile(self, builder: str, localDistrib: str, targetDistrib : str, arch: str):
         ''' '''
@@ -366,8 +487,12 @@ class AccendinoConfig:
         self.context.update(extraKeys)
 
 
-    def treatPlatformPackages(self, pkgManager, packagesToCheck, buildItems) -> None:
-        ''' '''
+    def treatPlatformPackages(self, pkgManager, packagesToCheck, buildItems, toInstall: T.List[str] = None) -> int:
+        '''
+            checks and installs the platform packages needed by the toolchain and the build items
+            @param toInstall: if given, the missing packages are added to this list instead of being installed
+            @return an exit code, 0 for success
+        '''
         # let's compute platform package requirements
         shortName = f"{self.distribId}"
         longName = f"{self.distribId} {self.distribVersion}"
@@ -394,63 +519,195 @@ class AccendinoConfig:
 
             packagesToCheck += pkgs[:]
 
-        packagesToCheck = list(set(packagesToCheck))
-        toolchainArtifacts = list(set(toolchainArtifacts))
+        toolchainArtifacts = list(dict.fromkeys(toolchainArtifacts))
 
         if pkgManager:
-            if not self.toolchainObj.packagesCheck(pkgManager, toolchainArtifacts, True):
+            # toolchain and artifacts requirements are resolved together and installed in a single transaction
+            toolchainPackages = self.toolchainObj.selectPackages(pkgManager, toolchainArtifacts)
+            if toolchainPackages is None:
                 logging.error(" * package requirements not met")
                 return 5
 
-            toInstall = pkgManager.checkMissing(packagesToCheck)
-            if toInstall is None:
+            missing = pkgManager.checkMissing(list(dict.fromkeys(toolchainPackages + packagesToCheck)))
+            if missing is None:
                 logging.error(" * package requirements not met")
                 return 5
 
-            if toInstall:
-                if not pkgManager.installPackages(toInstall):
+            if self.packagesDryRun:
+                plan = pkgManager.installPlan(missing)
+                if plan is None:
+                    return 5
+
+                if not plan:
+                    logging.info(" * all required packages are installed")
+                for managerName, pkgs in plan.items():
+                    logging.info(f" * would install on {managerName or 'default'} package manager: {' '.join(pkgs)}")
+                return 0
+
+            if toInstall is not None:
+                toInstall += missing
+            elif missing:
+                if not pkgManager.installPackages(missing):
                     logging.error(" * error during package installation")
                     return 4
 
         return 0
 
-    def createBuildPlan(self, itemsToBuild, buildPlan) -> None:
-        ''' '''
-
-        def addBuildItems(items: T.List[str], buildPlan: T.List[str], provided: T.List[str]):
-            for item in items:
-                if item in buildPlan + provided:
-                    continue
+    def createBuildPlan(self, itemsToBuild, buildPlan) -> bool:
+        ''' fills buildPlan with the artifacts needed to build itemsToBuild, each one after its dependencies
+            @return if the operation was successful
+        '''
+        try:
+            buildPlan += self.registry.buildPlan(itemsToBuild)
+        except DependencyCycleError as e:
+            logging.error(f"{e}")
+            return False
+        return True
 
-                itemObj = self.getBuildItem(item)
-                if itemObj:
-                    if itemObj.deps:
-                        addBuildItems(itemObj.deps, buildPlan, provided)
+    def getPocketIndex(self) -> PocketIndex:
+        ''' returns the index of accendino files, artifacts defined by the files depend on the platform,
+            the toolchain and the options so they are part of the signature
+        '''
+        if self.pocketIndex is None:
+            options = {}
+            if self.options is not None:
+                options = {section: dict(self.options[section]) for section in self.options.sections()}
+
+            signature = PocketIndex.computeSignature([
+                accendino.__version__, self.distribId, self.distribVersion, self.targetDistrib,
+                self.libdir, self.targetArch, self.crossCompilation, self.toolchain,
+                self.buildType, options
+            ])
+            self.pocketIndex = PocketIndex(getUserCacheDir('pocket-index.json'), signature)
+        return self.pocketIndex
+
+    def canDefer(self, fpath: str, entry: T.Dict[str, T.Any]) -> bool:
+        ''' returns if the evaluation of an included file can be deferred. This is only the case when the
+            effect of the file is known to be limited to appending artifacts and setting variables that nobody
+            else uses: it only reads the names provided by accendino, and no other file (in particular
+            its includer) reads or assigns the names it assigns. The defines recorded in the index are only
+            valid for the platform and options of its signature, so the names the file reads must also still
+            have the values provided by accendino
+        '''
+        index = self.getPocketIndex()
+        if index.defines(fpath) is None:
+            return False
 
-                    buildPlan.append(itemObj.name)
-                    if itemObj.provides:
-                        if isinstance(itemObj.provides, list):
-                            provided += itemObj.provides
-                        else:
-                            provided.append(itemObj.provides)
+        assigned = set(entry['assigned']) - {'ARTIFACTS'}
+        if assigned & (self.frameworkNames | set(RESERVED_NAMES)):
+            return False
 
-                else:
-                    logging.error(f"unable to find build dependency {item}")
+        # stdBuildFromSourceTest() reads the <key>_forceBuild variables dynamically
+        if any(name.endswith('_forceBuild') for name in assigned):
+            return False
 
-        plan = []
-        provided = []
-        addBuildItems(itemsToBuild, plan, provided)
+        reads = set(entry['read']) - set(entry['assigned'])
+        if reads - self.frameworkNames:
+            return False
 
-        for itemStr in plan:
-            item = self.getBuildItem(itemStr)
-            if item:
-                buildPlan.append(item)
-            else:
-                buildPlan.append(itemStr)
+        # an includer may have redefined a name provided by accendino (libdir, toolchain, ...)
+        if any(self.context.get(name) is not self.frameworkValues[name] for name in reads):
+            return False
 
+        if self.includesStack:
+            includer = index.entry(self.includesStack[-1])
+            if includer is None or assigned & set(includer['read']):
+                return False
+
+        return not (assigned & index.assignedByOthers(fpath))
+
+    def _deferredDefining(self, names: T.Set[str]) -> T.List[DeferredInclude]:
+        ''' returns the pending deferred includes that define one of the given artifact names '''
+        index = self.getPocketIndex()
+        return [d for d in self.deferredIncludes if names & set(index.defines(d.fpath) or [])]
+
+    def _deferredShadowing(self, needed: T.Dict[str, T.Any]) -> T.List[DeferredInclude]:
+        ''' returns the pending deferred includes that define a needed name which currently resolves to an artifact
+            defined after them: with an eager evaluation their artifact would have been found first
+        '''
+        index = self.getPocketIndex()
+        positions = {id(item): i for i, item in enumerate(self.context.get('ARTIFACTS', []))}
+        ret = []
+        for d in self.deferredIncludes:
+            for name in set(index.defines(d.fpath) or []) & needed.keys():
+                item = needed[name]
+                if item is not None and positions.get(id(item), -1) >= d.position:
+                    ret.append(d)
+                    break
+        return ret
+
+    def _evaluateDeferred(self, deferred: DeferredInclude) -> None:
+        ''' evaluates a deferred include, its artifacts are inserted in ARTIFACTS where they would have
+            been if the file had been evaluated when it was included
+        '''
+        if deferred not in self.deferredIncludes:
+            return
+        self.deferredIncludes.remove(deferred)
+        logging.debug(f"evaluating deferred file '{deferred.fpath}'")
+
+        artifacts = self.context['ARTIFACTS']
+        before = len(artifacts)
+        seqBefore = self.deferredSeq
+        code = self.codeCache.load(deferred.fpath, os.path.basename(deferred.fpath))
+        self.evaluateSource(deferred.fpath, code, deferred.context)
+
+        newArtifacts = artifacts[before:]
+        if deferred.context['ARTIFACTS'] is not artifacts:
+            logging.warning(f"'{deferred.fpath}' replaces ARTIFACTS, its artifacts are appended")
+            newArtifacts += [a for a in deferred.context['ARTIFACTS'] if a not in artifacts]
+        else:
+            del artifacts[before:]
+            artifacts[deferred.position:deferred.position] = newArtifacts
+            # artifacts were inserted, the index of findDefinedArtifact() must be rebuilt
+            self.indexedArtifacts = None
+            for other in self.deferredIncludes:
+                if other.seq > seqBefore:
+                    # included while evaluating this file
+                    other.position += deferred.position - before
+                elif other.seq > deferred.seq and other.position >= deferred.position:
+                    other.position += len(newArtifacts)
+
+        # publish the variables set by the file (and its includes), unless they were changed since
+        for k, v in deferred.context.items():
+            if k not in deferred.initialContext or deferred.initialContext[k] is not v:
+                if k not in self.context or self.context[k] is deferred.initialContext.get(k, None):
+                    self.context[k] = v
+
+    def evaluateSource(self, fpath: str, code, context: T.Dict[str, T.Any]) -> None:
+        ''' evaluates an accendino file and records the artifacts it defines in the pocket index '''
+        index = self.getPocketIndex()
+        entry = index.entry(fpath, code)
+
+        # deferred files that were included before must be evaluated first if we read what they assign
+        reads = set(entry['read']) - {'ARTIFACTS'}
+        for d in list(self.deferredIncludes):
+            dEntry = index.entry(d.fpath)
+            if dEntry is None or reads & set(dEntry['assigned']):
+                self._evaluateDeferred(d)
+
+        artifacts = context['ARTIFACTS']
+        start = len(artifacts)
+        self.includesStack.append(fpath)
+        exec(code, {}, context)
+        self.includesStack.pop()
 
-    def readSource(self, fname: str, include_once: bool) -> bool:
-        ''' '''
+        if context['ARTIFACTS'] is not artifacts:
+            return
+
+        defines = []
+        for item in artifacts[start:]:
+            if id(item) not in self.attributedArtifacts:
+                self.attributedArtifacts.add(id(item))
+                defines += [item.name] + providedNames(item)
+        index.setDefines(fpath, code, defines)
+
+    def readSource(self, fname: str, include_once: bool, lazy: bool = False) -> bool:
+        '''
+            reads an accendino file
+            @param fname: name or path of the file
+            @param include_once: if the file should not be evaluated again when it was already included
+            @param lazy: if the evaluation of the file can be deferred until its artifacts are needed
+        '''
         fpath = self.findSourceFile(fname, include_once)
         if isinstance(fpath, bool):
             # already included
@@ -460,48 +717,66 @@ class AccendinoConfig:
             logging.error(f'file {fname} not found')
             sys.exit(-1)
 
-        self.includesStack.append(fpath)
-        with open(fpath, "rt", encoding="utf8") as f:
-            code = compile(f.read(), os.path.basename(fpath), "exec")
-            exec(code, {}, self.context)
-        self.includesStack.pop()
-        return True
-
-    def finalizeConfig(self) -> bool:
-        ''' '''
-        #
-        for buildItem in self.context.get('ARTIFACTS', []):
-            newDeps = []
-            for dep in buildItem.deps:
-                if isinstance(dep, str):
-                    newDeps.append(dep)
-                elif isinstance(dep, ConditionalDep):
-                    newDeps = dep.apply(self, newDeps)
-                else:
-                    logging.error(f'don\'t know how to treat artifact dependency with type {type(dep)}')
-            buildItem.deps = newDeps
+        if self.frameworkNames is None:
+            self.frameworkNames = set(self.context.keys())
+            self.frameworkValues = dict(self.context)
 
-            newPkg = {}
-            for k, v in buildItem.pkgs.items():
-                newList = []
-                for dep in v:
-                    if isinstance(dep, str):
-                        newList.append(dep)
-                    elif isinstance(dep, ConditionalDep):
-                        newList = dep.apply(self, newList)
-                    else:
-                        logging.error(f'don\'t know how to treat package dependency with type {type(dep)}')
+        self.includedFiles.append(fpath)
 
-                newPkg[k] = newList
-            buildItem.pkgs = newPkg
+        # with an up to date index entry, a deferred file is not even loaded
+        entry = self.getPocketIndex().entry(fpath)
+        if lazy and include_once and entry and self.canDefer(fpath, entry):
+            logging.debug(f"deferring evaluation of '{fpath}'")
+            self.deferredSeq += 1
+            self.deferredIncludes.append(DeferredInclude(fpath, dict(self.context),
+                                                len(self.context['ARTIFACTS']), self.deferredSeq))
+            return True
 
-            self.buildDefs.append(buildItem)
+        self.evaluateSource(fpath, self.codeCache.load(fpath, os.path.basename(fpath)), self.context)
+        return True
 
+    def finalizeConfig(self) -> bool:
+        ''' '''
         if not self.targets:
             defaultTargets = self.context.get('DEFAULT_TARGETS', 'ogon')
             if defaultTargets:
                 self.targets = defaultTargets.split(",")
 
+        # evaluate the deferred files that define what the targets need, until nothing is missing and no needed
+        # name would have been resolved to an artifact of a deferred file with an eager evaluation
+        wanted = (self.targets or []) + (self.uninstallTargets or [])
+        while True:
+            self.registry = ArtifactRegistry(self.context.get('ARTIFACTS', []), self.resolveArtifact)
+            if not self.deferredIncludes:
+                break
+
+            needed = self.registry.neededNames(wanted)
+            toEvaluate = self._deferredShadowing(needed)
+
+            missing = {name for name, item in needed.items() if item is None}
+            if missing:
+                defining = self._deferredDefining(missing)
+                if not defining:
+                    # not explained by the index, evaluate everything to get the same result as before
+                    defining = self.deferredIncludes[:]
+                toEvaluate += [d for d in defining if d not in toEvaluate]
+
+            if not toEvaluate:
+                break
+
+            for d in toEvaluate:
+                self._evaluateDeferred(d)
+
+        if self.deferredIncludes:
+            logging.debug(f'{len(self.deferredIncludes)} files were not evaluated: ' +
+                          ', '.join(d.fpath for d in self.deferredIncludes))
+        if self.pocketIndex:
+            self.pocketIndex.save()
+
+        if self.debug:
+            for name, providers in self.registry.duplicateProviders().items():
+                logging.debug(f"{name} is provided by several artifacts: {', '.join(providers)}, using {self.registry.get(name).name}")
+
         if not self.projectName:
             self.projectName = self.context.get('PROJECT', 'work')
 
@@ -567,8 +842,12 @@ def treatArgOrOption(config, option, value, fromCmdLine) -> int:
         config.buildWithPowershell = True
     elif option in ('--no-packages',):
         config.checkPackages = False
+    elif option in ('--packages-dry-run',):
+        config.packagesDryRun = True
     elif option in ('--build-deps',):
         config.doBuild = False
+    elif option in ('--eager-includes',):
+        config.lazyIncludes = False
     elif option in ('--work-dir', ):
         config.workDir = pathlib.PurePath(os.path.abspath(value))
     elif option in ("--resume-from", ):
@@ -600,6 +879,78 @@ def treatArgOrOption(config, option, value, fromCmdLine) -> int:
             config.targetDistrib = value
     elif option in ('--toolchain',):
         config.toolchain = value
+    elif option in ('--jobs',):
+        try:
+            config.maxJobs = int(value)
+        except ValueError:
+            config.maxJobs = 0
+
+        if config.maxJobs < 1:
+            logging.error(f'invalid number of jobs {value}')
+            return _ARGS_ERROR
+    elif option in ('--jobs-artifacts',):
+        try:
+            config.artifactJobs = int(value)
+        except ValueError:
+            config.artifactJobs = 0
+
+        if config.artifactJobs < 1:
+            logging.error(f'invalid number of concurrent artifacts {value}')
+            return _ARGS_ERROR
+    elif option in ('--jobs-checkout',):
+        try:
+            config.checkoutJobs = int(value)
+        except ValueError:
+            config.checkoutJobs = 0
+
+        if config.checkoutJobs < 1:
+            logging.error(f'invalid number of concurrent checkouts {value}')
+            return _ARGS_ERROR
+    elif option in ('--uninstall',):
+        config.uninstallTargets = value.split(',')
+    elif option in ('--binary-cache',):
+        config.binaryCacheLocation = value
+    elif option in ('--compiler-cache',):
+        if value == 'none':
+            config.compilerCacheTool = None
+        elif value in COMPILER_CACHES:
+            config.compilerCacheTool = value
+        else:
+            logging.error(f'unknown compiler cache {value}, expecting one of {", ".join(COMPILER_CACHES)} or none')
+            return _ARGS_ERROR
+    elif option in ('--compiler-cache-dir',):
+        config.compilerCacheDir = os.path.abspath(value)
+    elif option in ('--linker',):
+        if value not in LINKERS:
+            logging.error(f'unknown linker {value}, expecting one of {", ".join(LINKERS)}')
+            return _ARGS_ERROR
+        config.linker = value
+    elif option in ('--split-dwarf',):
+        config.splitDwarf = True
+    elif option in ('--compress-debug-sections',):
+        config.compressDebugSections = True
+    elif option in ('--no-configure-cache',):
+        config.useConfigureCache = False
+    elif option in ('--deps-rebuild',):
+        if value not in DEPS_REBUILD_MODES:
+            logging.error(f'unknown dependencies rebuild mode {value}, expecting one of {", ".join(DEPS_REBUILD_MODES)}')
+            return _ARGS_ERROR
+        config.depsRebuildMode = value
+    elif option in ('--no-early-cutoff',):
+        config.earlyCutoff = False
+    elif option in ('--git-mirror-dir',):
+        config.gitMirrorDir = os.path.abspath(value)
+    elif option in ('--download-cache',):
+        config.downloadCacheDir = os.path.abspath(value)
+    elif option in ('--download-segments',):
+        try:
+            config.downloadSegments = int(value)
+        except ValueError:
+            config.downloadSegments = 0
+
+        if config.downloadSegments < 1:
+            logging.error(f'invalid number of download segments {value}')
+            return _ARGS_ERROR
     elif option in ("--project", ):
         config.projectName = value
     else:
@@ -618,7 +969,9 @@ def run(args: T.List[str]) -> int:
     opts, extraArgs = getopt.getopt(args[1:], "hdv", [
         "prefix=", "help", "debug", "no-packages", "build-deps", "targets=", "build-type=", "options=",
         "work-dir=", "resume-from=", "project=", "targetDistrib=", "targetArch=", "toolchain=",
-        "buildWithPowershell", "version", "refreshSources", "refresh"
+        "buildWithPowershell", "version", "refreshSources", "refresh", "jobs=", "jobs-artifacts=", "jobs-checkout=", "binary-cache=", "uninstall=",
+        "compiler-cache=", "compiler-cache-dir=", "linker=", "split-dwarf", "compress-debug-sections", "no-configure-cache",
+        "deps-rebuild=", "no-early-cutoff", "git-mirror-dir=", "download-cache=", "download-segments=", "eager-includes", "packages-dry-run"
     ])
 
     for option, value in opts:
@@ -681,7 +1034,8 @@ def run(args: T.List[str]) -> int:
             buildList.append(item)
 
     buildPlan = []
-    config.createBuildPlan(config.targets, buildPlan)
+    if not config.createBuildPlan(config.targets, buildPlan):
+        return 2
     if config.debug:
         items = []
         for i in buildPlan:
@@ -689,66 +1043,176 @@ def run(args: T.List[str]) -> int:
 
         logging.debug(f"build plan: [{', '.join(items)}]")
 
-    if config.checkPackages:
+    pkgManager = None
+    toInstall = []
+    if config.checkPackages or config.packagesDryRun:
         packagesToCheck = []
         pkgManager = getPkgManager(config.distribId, packagesToCheck)
 
-        retCode = config.treatPlatformPackages(pkgManager, packagesToCheck, buildPlan)
+        retCode = config.treatPlatformPackages(pkgManager, packagesToCheck, buildPlan, toInstall)
+        if retCode or config.packagesDryRun:
+            return retCode
+
+    def setupPlatform() -> int:
+        ''' installs the missing packages and activates the toolchain '''
+        if toInstall and not pkgManager.installPackages(toInstall):
+            logging.error(" * error during package installation")
+            return 4
+
+        logging.debug(f'==> activating toolchain {config.toolchainObj.description}')
+        if not config.toolchainObj.activate():
+            logging.error('error activating toolchain')
+            return 6
+        return 0
+
+    # packages are installed while sources are checked out, only preparing and building wait for them
+    platformStage = BackgroundStage('platform setup', setupPlatform)
+    try:
+        return runBuildPlan(config, buildPlan, buildList, platformStage, set(toInstall))
+    finally:
+        platformStage.shutdown()
+
+
+def runBuildPlan(config, buildPlan, buildList, platformStage, installing: T.Set[str]) -> int:
+    ''' runs the build plan while the platform setup runs in platformStage
+        @param installing: the packages being installed by platformStage
+        @return the exit code
+    '''
+    config.jobServer = createJobServer(config)
+    config.stateDb = BuildStateDb(config.projectDir / STATE_DB_FILE)
+
+    if config.gitMirrorDir:
+        logging.debug(f'using git mirrors in {config.gitMirrorDir}')
+        config.gitMirrors = GitMirrorCache(config.gitMirrorDir)
+
+    config.downloadCache = DownloadCache(config.downloadCacheDir, config.downloadSegments)
+
+    if config.binaryCacheLocation:
+        logging.debug(f'using binary cache at {config.binaryCacheLocation}')
+        config.binaryCache = BinaryCache(config.binaryCacheLocation)
+
+    if config.useConfigureCache:
+        config.configureCache = ConfigureCache(config)
+
+    if config.compilerCacheTool:
+        config.compilerCache = CompilerCache.create(config.compilerCacheTool, config.compilerCacheDir, str(config.workDir))
+        if config.compilerCache:
+            logging.debug(f'using {config.compilerCacheTool} as compiler cache')
+
+    def sourceNeedsPackages(item) -> bool:
+        ''' tells if the checkout of an item needs packages that are being installed (like git) '''
+        srcObj = getattr(item, 'srcObj', None)
+        if not installing or srcObj is None:
+            return False
+
+        for specs in srcObj.pkgDeps.values():
+            for spec in specs:
+                if isinstance(spec, str) and any(alt.strip() in installing for alt in spec.split('|')):
+                    return True
+        return False
+
+    if config.uninstallTargets or not config.doBuild:
+        retCode = platformStage.wait()
         if retCode:
             return retCode
 
-    logging.debug(f'==> activating toolchain {config.toolchainObj.description}')
-    if not config.toolchainObj.activate():
-        logging.error('error activating toolchain')
-        return 6
+    if config.uninstallTargets:
+        for name in config.uninstallTargets:
+            # artifacts that were dropped from the accendino files can still be uninstalled
+            item = config.getBuildItem(name)
+            if item is None or is_exact_instance(item, DepsBuildArtifact):
+                item = BuildArtifact(name, [], None)
+
+            if not item.init(config) or not item.uninstall(config):
+                return 1
 
+        logging.info("=== finished ===")
+        return 0
 
     def buildModule(buildItem) -> bool:
         ''' '''
-        logging.debug('==> preparing')
+        logging.debug(f'==> preparing {buildItem.name}')
         if not buildItem.prepare(config):
             logging.error(f"prepare error for {buildItem.name}")
             return False
 
-        logging.debug('==> building')
+        logging.debug(f'==> building {buildItem.name}')
         if not buildItem.build(config):
             logging.error(f"build error for {buildItem.name}, check logs in {buildItem.logFile}")
             return False
         return True
 
-    exitCode = 0
-    if config.doBuild:
+    # items before the one given with --resume-from are checked out but not built
+    skipBuild = []
+    if config.resumeFrom:
         for item in buildPlan:
-            isDepsBuildArtifact = is_exact_instance(item, DepsBuildArtifact)
+            if item.name == config.resumeFrom:
+                break
+            skipBuild.append(item.name)
 
-            extra = ' is only deps' if isDepsBuildArtifact else ''
-            logging.info(f' * module {item.name}{extra}')
+    def fetchItem(item) -> bool:
+        ''' '''
+        logging.debug(f'==> init {item.name}')
+        if not item.init(config):
+            logging.error(f"error initializing {item.name}")
+            return False
 
-            if not isDepsBuildArtifact:
-                logging.debug('==> init')
-                if not item.init(config):
-                    logging.error(f"error initializing {item.name}")
-                    return 1
+        if config.refresh and item in buildList:
+            logging.info(f' * forcing rebuild of {item.name}')
+            item.forceRebuild()
 
-                if config.refresh and item in buildList:
-                    logging.info(f' * forcing rebuild of {item.name}')
-                    item.forceRebuild()
+        if sourceNeedsPackages(item) and platformStage.wait():
+            return False
 
-                logging.debug('==> checking out')
-                if not item.checkout(config):
-                    logging.error(f"checkout error for {item.name}")
-                    return 1
+        logging.debug(f'==> checking out {item.name}')
+        if not item.checkout(config):
+            logging.error(f"checkout error for {item.name}")
+            return False
 
-            if config.resumeFrom:
-                if item.name != config.resumeFrom:
-                    continue
+        return True
 
-                # We've found the item to resume the build from
-                config.resumeFrom = None
+    prefetcher = SourcePrefetcher(config.checkoutJobs)
 
-            if not isDepsBuildArtifact:
-                if not buildModule(item):
-                    return 1
+    def processItem(item) -> bool:
+        ''' '''
+        isDepsBuildArtifact = is_exact_instance(item, DepsBuildArtifact)
+
+        extra = ' is only deps' if isDepsBuildArtifact else ''
+        logging.info(f' * module {item.name}{extra}')
+
+        if isDepsBuildArtifact:
+            return True
+
+        if not prefetcher.wait(item):
+            return False
+
+        if item.name in skipBuild:
+            return True
+
+        if platformStage.wait():
+            return False
+
+        if config.jobServer:
+            # this token is the implicit job slot of the commands run for this artifact
+            with config.jobServer.token():
+                return buildModule(item)
+
+        return buildModule(item)
+
+    exitCode = 0
+    if config.doBuild:
+        # checkouts start right now, each build only waits for its own sources
+        prefetcher.start([item for item in buildPlan if not is_exact_instance(item, DepsBuildArtifact)], fetchItem)
+
+        scheduler = BuildScheduler(config, buildPlan, config.artifactJobs)
+        try:
+            if not scheduler.run(processItem):
+                return platformStage.wait() or 1
+        finally:
+            prefetcher.shutdown()
+
+        if config.compilerCache:
+            config.compilerCache.report()
 
     logging.info("=== finished ===")
     return exitCode
@@ -0,0 +1,371 @@
+import os
+import re
+import json
+import stat
+import hashlib
+import tempfile
+import threading
+import time
+import subprocess
+import typing as T
+
+from zenlog import log as logging
+from accendino.utils import getPathIndex
+
+
+MANIFEST_FILE = 'accendino.manifest'
+
+# installed files that other artifacts don't use when they're built
+NON_INTERFACE_DIRS = ('bin/', 'sbin/', 'libexec/', 'share/doc/', 'share/man/', 'share/info/', 'share/locale/')
+
+SHARED_LIBRARY_RE = re.compile(r'\.so(\.[0-9]+)*$')
+STATIC_LIBRARY_RE = re.compile(r'\.a$')
+
+READELF_SONAME_RE = re.compile(r'\(SONAME\)\s+Library soname: \[(?P<soname>.*)\]')
+READELF_SYMBOL_RE = re.compile(r'^\s*[0-9]+:\s+[0-9a-fA-F]+\s+(?P<size>[0-9]+|0x[0-9a-fA-F]+)\s+(?P<type>\S+)\s+(?P<bind>\S+)'
+                               r'\s+(?P<vis>\S+)\s+(?P<ndx>\S+)\s+(?P<name>\S+)')
+
+
+def isConfigInterfaceFile(rel: str) -> bool:
+    ''' tells if an installed file is read by the configure step of the artifacts using it: pkg-config files
+        and CMake package configuration files
+    '''
+    parts = rel.replace(os.sep, '/').split('/')
+    if parts[-1].endswith('.pc') and 'pkgconfig' in parts:
+        return True
+    return parts[-1].endswith('.cmake') and 'cmake' in parts[:-1]
+
+
+def _readelf(fpath: str, magic: bytes, args: T.List[str]) -> str:
+    ''' runs readelf on a file if it starts with the given magic, returns its output or None '''
+    try:
+        with open(fpath, 'rb') as f:
+            if f.read(len(magic)) != magic:
+                return None
+    except OSError:
+        return None
+
+    readelf = getPathIndex().find('readelf')
+    if not readelf:
+        return None
+
+    try:
+        proc = subprocess.run([readelf, '-W'] + args + [fpath], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              encoding='utf8', errors='replace', env={**os.environ, 'LC_ALL': 'C'}, check=False)
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    return proc.stdout
+
+
+def sharedLibraryAbi(fpath: str) -> T.List[str]:
+    '''
+        returns the ABI of an ELF shared library as seen by the programs linked with it: its SONAME and its exported
+        symbols (with their size for data objects, as it matters for copy relocations)
+        @param fpath: path of the library
+        @return the sorted ABI lines, None if it's not an ELF file or readelf is not available
+    '''
+    output = _readelf(fpath, b'\x7fELF', ['-d', '--dyn-syms'])
+    if output is None:
+        return None
+
+    ret = []
+    for l in output.splitlines():
+        m = READELF_SONAME_RE.search(l)
+        if m:
+            ret.append(f'SONAME {m.group("soname")}')
+            continue
+
+        m = READELF_SYMBOL_RE.match(l)
+        if not m or m.group('ndx') == 'UND' or m.group('bind') == 'LOCAL' or m.group('vis') in ('HIDDEN', 'INTERNAL'):
+            continue
+
+        if m.group('type') in ('OBJECT', 'TLS'):
+            ret.append(f'{m.group("name")} {m.group("type")} {m.group("size")}')
+        else:
+            ret.append(f'{m.group("name")} {m.group("type")}')
+    return sorted(set(ret))
+
+
+def staticLibraryAbi(fpath: str) -> T.List[str]:
+    '''
+        returns the interface of a static library of ELF objects: the global symbols defined by its members (with
+        their size for data objects)
+        @param fpath: path of the library
+        @return the sorted ABI lines, None if it's not an archive or readelf is not available
+    '''
+    output = _readelf(fpath, b'!<arch>\n', ['-s'])
+    if output is None:
+        return None
+
+    ret = []
+    for l in output.splitlines():
+        m = READELF_SYMBOL_RE.match(l)
+        if not m or m.group('ndx') == 'UND' or m.group('bind') == 'LOCAL':
+            continue
+
+        if m.group('type') in ('OBJECT', 'TLS'):
+            ret.append(f'{m.group("name")} {m.group("type")} {m.group("size")}')
+        else:
+            ret.append(f'{m.group("name")} {m.group("type")}')
+    return sorted(set(ret))
+
+
+def hashFile(fpath: str) -> str:
+    ''' returns the sha256 of a file '''
+    h = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def snapshotTree(root) -> T.Dict[str, T.Tuple[int, int]]:
+    ''' returns a map of the files under root (relative path -> (size, mtime_ns)) '''
+    ret = {}
+    root = str(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+            fpath = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(fpath)
+            except OSError:
+                continue
+            ret[os.path.relpath(fpath, root)] = (st.st_size, st.st_mtime_ns)
+    return ret
+
+
+def filesystemTime(directory) -> int:
+    ''' returns the current time (in ns) as seen by the file system of directory, its timestamps may be coarser than
+        the system clock
+    '''
+    try:
+        fd, path = tempfile.mkstemp(dir=str(directory), prefix='.accendino-clock-')
+    except OSError:
+        return time.time_ns()
+
+    try:
+        return os.fstat(fd).st_mtime_ns
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
+def filesModifiedSince(root, sinceNs: int) -> T.List[str]:
+    ''' returns the files under root that were added or modified since the given time (see filesystemTime()) '''
+    return sorted(p for p, (_size, mtime) in snapshotTree(root).items() if mtime >= sinceNs)
+
+
+def diffSnapshots(before: T.Dict[str, T.Tuple[int, int]], after: T.Dict[str, T.Tuple[int, int]]) -> T.List[str]:
+    ''' returns the files that were added or modified between 2 snapshots '''
+    return sorted(p for p, v in after.items() if before.get(p, None) != v)
+
+
+class BuildOverlapTracker:
+    ''' tracks builds running at the same time, when builds that install directly in the shared prefix
+        overlap, the files that appeared there can't be attributed to a single artifact
+    '''
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.active = {}
+
+    def begin(self, name: str) -> None:
+        with self.lock:
+            overlapping = len(self.active) > 0
+            for other in self.active:
+                self.active[other] = True
+            self.active[name] = overlapping
+
+    def end(self, name: str) -> bool:
+        ''' @return if another build overlapped with this one '''
+        with self.lock:
+            return self.active.pop(name, True)
+
+
+class InstallManifest:
+    ''' the list of files installed by an artifact in the prefix, with their size, hash and mode '''
+
+    def __init__(self, entries: T.Dict[str, T.Dict[str, T.Any]] = None) -> None:
+        '''
+            @param entries: relative path -> {'size', 'sha256', 'mode'} for files or {'link'} for symlinks
+        '''
+        self.entries = entries or {}
+
+    @staticmethod
+    def _entry(fpath: str) -> T.Dict[str, T.Any]:
+        st = os.lstat(fpath)
+        if stat.S_ISLNK(st.st_mode):
+            return {'link': os.readlink(fpath)}
+
+        return {'size': st.st_size, 'sha256': hashFile(fpath), 'mode': stat.S_IMODE(st.st_mode)}
+
+    @staticmethod
+    def fromTree(root) -> 'InstallManifest':
+        ''' creates a manifest with all the files under root '''
+        root = str(root)
+        return InstallManifest.fromFiles(root, snapshotTree(root).keys())
+
+    @staticmethod
+    def fromFiles(root, files: T.Iterable[str]) -> 'InstallManifest':
+        ''' creates a manifest for the given files relative to root '''
+        entries = {}
+        for f in files:
+            try:
+                entries[f] = InstallManifest._entry(os.path.join(str(root), f))
+            except OSError as e:
+                logging.debug(f'unable to stat {f}: {e}')
+        return InstallManifest(entries)
+
+    @staticmethod
+    def load(path) -> 'InstallManifest':
+        ''' loads a manifest, returns None if it doesn't exist or is invalid '''
+        try:
+            with open(path, 'rt', encoding='utf8') as f:
+                content = json.load(f)
+            return InstallManifest(content['files'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.info(f'invalid install manifest {path}: {e}')
+            return None
+
+    def save(self, path, prefix) -> bool:
+        ''' saves the manifest atomically
+            @return if the operation was successful
+        '''
+        tmpPath = f'{path}.tmp'
+        try:
+            with open(tmpPath, 'wt', encoding='utf8') as f:
+                json.dump({'version': 1, 'prefix': str(prefix), 'files': self.entries}, f, indent=1, sort_keys=True)
+            os.replace(tmpPath, path)
+            return True
+        except OSError as e:
+            logging.error(f'unable to save install manifest {path}: {e}')
+            return False
+
+    def files(self) -> T.List[str]:
+        return sorted(self.entries.keys())
+
+    def configInterface(self) -> str:
+        ''' returns a hash of the configuration interface of the artifact, the content of the files that other
+            artifacts read when they're configured (see isConfigInterfaceFile())
+        '''
+        h = hashlib.sha256()
+        for rel in sorted(self.entries):
+            if isConfigInterfaceFile(rel):
+                h.update(json.dumps([rel, self.entries[rel]], sort_keys=True).encode('utf8'))
+        return h.hexdigest()
+
+    def interface(self, prefix) -> str:
+        '''
+            returns a hash of the interface of the artifact, what the artifacts depending on it use when they're
+            built: headers, pkg-config and CMake files, and the ABI of the shared and static libraries (see
+            sharedLibraryAbi() and staticLibraryAbi()). Programs and documentation are left out.
+            @param prefix: the prefix where the files are installed
+        '''
+        h = hashlib.sha256()
+        for rel in sorted(self.entries):
+            entry = self.entries[rel]
+            relPosix = rel.replace(os.sep, '/')
+            if relPosix.startswith(NON_INTERFACE_DIRS) and not relPosix.lower().endswith('.dll'):
+                continue
+
+            if 'sha256' in entry and SHARED_LIBRARY_RE.search(relPosix):
+                abi = sharedLibraryAbi(os.path.join(str(prefix), rel))
+                if abi is not None:
+                    entry = {'abi': abi}
+            elif 'sha256' in entry and STATIC_LIBRARY_RE.search(relPosix):
+                abi = staticLibraryAbi(os.path.join(str(prefix), rel))
+                if abi is not None:
+                    entry = {'abi': abi}
+
+            h.update(json.dumps([rel, entry], sort_keys=True).encode('utf8'))
+        return h.hexdigest()
+
+    def mergeInto(self, stageRoot, prefix, previous: 'InstallManifest') -> int:
+        '''
+            copies the staged files in the prefix, files that are identical to what the previous manifest
+            recorded (and still present in the prefix) are not copied again
+            @return the number of copied files
+        '''
+        previousEntries = previous.entries if previous else {}
+        copied = 0
+        for rel, entry in self.entries.items():
+            src = os.path.join(str(stageRoot), rel)
+            dst = os.path.join(str(prefix), rel)
+
+            if previousEntries.get(rel) == entry and os.path.lexists(dst):
+                if 'link' in entry or os.path.getsize(dst) == entry['size']:
+                    continue
+
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if os.path.isdir(dst) and not os.path.islink(dst):
+                logging.error(f'{dst} is a directory, unable to install {rel}')
+                continue
+
+            # replace files atomically, a file of the prefix may be in use by a concurrent build
+            tmp = f'{dst}.accendino-tmp'
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+
+            if 'link' in entry:
+                os.symlink(entry['link'], tmp)
+            else:
+                with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+                    for chunk in iter(lambda: fin.read(1024 * 1024), b''):
+                        fout.write(chunk)
+                os.chmod(tmp, entry['mode'])
+                st = os.stat(src)
+                os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp, dst)
+            copied += 1
+
+        return copied
+
+    def removeFromPrefix(self, prefix, files: T.Iterable[str], keep: T.Set[str] = None) -> int:
+        '''
+            removes the given files of this manifest from the prefix, and the directories that became empty
+            @param keep: files that must be kept because they are owned by some other artifact
+            @return the number of removed files
+        '''
+        removed = 0
+        dirs = set()
+        for rel in files:
+            if keep and rel in keep:
+                continue
+
+            fpath = os.path.join(str(prefix), rel)
+            if os.path.lexists(fpath) and (os.path.islink(fpath) or not os.path.isdir(fpath)):
+                os.remove(fpath)
+                removed += 1
+            dirs.add(os.path.dirname(fpath))
+
+        # prune the directories that are now empty, deepest first
+        for d in sorted(dirs, key=len, reverse=True):
+            while d.startswith(str(prefix)) and d != str(prefix):
+                try:
+                    os.rmdir(d)
+                except OSError:
+                    break
+                d = os.path.dirname(d)
+
+        return removed
+
+
+def filesOwnedByOthers(buildDir, name: str) -> T.Set[str]:
+    ''' returns the files recorded in the manifests of the other artifacts of the same build tree '''
+    ret = set()
+    treeDir = os.path.dirname(str(buildDir))
+    if not os.path.isdir(treeDir):
+        return ret
+
+    for other in os.listdir(treeDir):
+        if other == name:
+            continue
+
+        manifest = InstallManifest.load(os.path.join(treeDir, other, MANIFEST_FILE))
+        if manifest:
+            ret.update(manifest.entries.keys())
+    return ret
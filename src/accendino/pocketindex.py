@@ -0,0 +1,154 @@
+import os
+import dis
+import json
+import types
+import builtins
+import hashlib
+import typing as T
+
+from zenlog import log as logging
+
+
+# names of the context that are read by accendino itself after the source files are evaluated
+RESERVED_NAMES = ('DEFAULT_TARGETS', 'PROJECT', 'CROSS_PLATFORM_FILE_CHOOSER',)
+
+
+def analyzeCode(code: types.CodeType) -> T.Tuple[T.Set[str], T.Set[str]]:
+    '''
+        returns the names assigned and the names read at the top level of an accendino file. Nested code
+        (functions, comprehensions) is scanned too, to over-approximate what is read
+        @return a tuple (assigned names, read names)
+    '''
+    assigned = set()
+    read = set()
+    todo = [code]
+    while todo:
+        c = todo.pop()
+        for ins in dis.get_instructions(c):
+            if ins.opname in ('STORE_NAME', 'DELETE_NAME', 'STORE_GLOBAL', 'DELETE_GLOBAL'):
+                assigned.add(ins.argval)
+            elif ins.opname in ('LOAD_NAME', 'LOAD_GLOBAL', 'LOAD_FROM_DICT_OR_GLOBALS'):
+                read.add(ins.argval)
+
+        for const in c.co_consts:
+            if isinstance(const, types.CodeType):
+                todo.append(const)
+
+    read -= set(dir(builtins))
+    return (assigned, read)
+
+
+class PocketIndex:
+    ''' a cache of what accendino files define: the names they assign and read, and the artifacts (names and
+        provides) they append to ARTIFACTS for a given configuration. Entries are validated with the mtime
+        and size of the files.
+    '''
+
+    VERSION = 1
+
+    def __init__(self, path: str, signature: str) -> None:
+        '''
+            @param path: path of the JSON file storing the index
+            @param signature: a signature of the configuration, artifacts defined by a file depend on it
+        '''
+        self.path = path
+        self.signature = signature
+        self.files = {}
+        self.modified = False
+
+        try:
+            with open(path, 'rt', encoding='utf8') as f:
+                content = json.load(f)
+            if content.get('version', None) == self.VERSION:
+                self.files = content['files']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logging.debug(f'ignoring invalid pocket index {path}: {e}')
+
+    @staticmethod
+    def computeSignature(items: T.List[T.Any]) -> str:
+        return hashlib.sha256(json.dumps(items, sort_keys=True).encode('utf8')).hexdigest()[0:16]
+
+    @staticmethod
+    def _stamp(fpath: str) -> T.List[int]:
+        st = os.stat(fpath)
+        return [st.st_mtime_ns, st.st_size]
+
+    def entry(self, fpath: str, code: types.CodeType = None) -> T.Dict[str, T.Any]:
+        '''
+            returns the index entry of a file, it is (re)computed from code if it's missing or outdated
+            @return the entry or None if it's outdated and no code is given
+        '''
+        fpath = os.path.abspath(fpath)
+        stamp = self._stamp(fpath)
+        ret = self.files.get(fpath, None)
+        if ret and ret['stamp'] == stamp:
+            return ret
+
+        if code is None:
+            return None
+
+        (assigned, read) = analyzeCode(code)
+        ret = {'stamp': stamp, 'assigned': sorted(assigned), 'read': sorted(read), 'defines': {}}
+        self.files[fpath] = ret
+        self.modified = True
+        return ret
+
+    def defines(self, fpath: str) -> T.List[str]:
+        ''' returns the artifact names and provides defined by a file with the current configuration, or None
+            if unknown
+        '''
+        entry = self.entry(fpath)
+        if entry is None:
+            return None
+        return entry['defines'].get(self.signature, None)
+
+    def setDefines(self, fpath: str, code: types.CodeType, names: T.List[str]) -> None:
+        entry = self.entry(fpath, code)
+        names = sorted(set(names))
+        if entry['defines'].get(self.signature, None) != names:
+            entry['defines'][self.signature] = names
+            self.modified = True
+
+    def assignedByOthers(self, fpath: str) -> T.Set[str]:
+        ''' returns the names assigned by the other indexed files '''
+        fpath = os.path.abspath(fpath)
+        ret = set()
+        for path, entry in self.files.items():
+            if path != fpath:
+                ret.update(entry['assigned'])
+        return ret
+
+    def save(self) -> None:
+        if not self.modified:
+            return
+
+        tmpPath = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmpPath, 'wt', encoding='utf8') as f:
+                json.dump({'version': self.VERSION, 'files': self.files}, f)
+            os.replace(tmpPath, self.path)
+            self.modified = False
+        except OSError as e:
+            logging.debug(f'unable to save pocket index {self.path}: {e}')
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+
+class DeferredInclude:
+    ''' an included file whose evaluation is delayed until one of its artifacts or variables is needed '''
+
+    def __init__(self, fpath: str, context: T.Dict[str, T.Any], position: int, seq: int) -> None:
+        '''
+            @param fpath: path of the file
+            @param context: a copy of the context at the time of the include, the file is evaluated in it
+            @param position: position in ARTIFACTS where the artifacts of the file must be inserted
+            @param seq: sequence number of the include
+        '''
+        self.fpath = fpath
+        self.context = context
+        self.initialContext = dict(context)
+        self.position = position
+        self.seq = seq
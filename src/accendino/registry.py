@@ -0,0 +1,172 @@
+import typing as T
+
+from zenlog import log as logging
+
+
+class DependencyCycleError(Exception):
+    ''' raised when the dependencies of the build artifacts contain a cycle '''
+
+    def __init__(self, cycle: T.List[str]) -> None:
+        '''
+            @param cycle: the names of the artifacts forming the cycle, the first one is repeated at the end
+        '''
+        Exception.__init__(self, f"dependency cycle: {' -> '.join(cycle)}")
+        self.cycle = cycle
+
+
+def providedNames(item) -> T.List[str]:
+    ''' returns the names provided by an artifact, provides can be given as a list or a single string '''
+    if not item.provides:
+        return []
+    if isinstance(item.provides, str):
+        return [item.provides]
+    return list(item.provides)
+
+
+class ArtifactRegistry:
+    ''' an index of the build artifacts by name and by provided names.
+
+        Lookups keep the semantic of a scan of the artifacts in definition order: the first artifact that has
+        the requested name, or provides it, wins.
+    '''
+
+    def __init__(self, items: T.Iterable[T.Any] = [], resolver: T.Callable[[T.Any], None] = None) -> None:
+        '''
+            @param items: the build artifacts in definition order
+            @param resolver: a function called on an artifact before its dependencies are read
+        '''
+        self.resolver = resolver
+        self.items = []
+        self.byName = {}
+        self.index = {}
+        self.providers = {}
+
+        for item in items:
+            self.add(item)
+
+    def add(self, item) -> None:
+        ''' adds a build artifact to the registry '''
+        self.items.append(item)
+        self.byName.setdefault(item.name, item)
+
+        for key in [item.name] + providedNames(item):
+            self.index.setdefault(key, item)
+
+        for key in providedNames(item):
+            providers = self.providers.setdefault(key, [])
+            if item.name not in providers:
+                providers.append(item.name)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def get(self, name: str):
+        ''' returns the artifact with this name or providing it, None if there's none '''
+        return self.index.get(name, None)
+
+    def getByName(self, name: str):
+        ''' returns the artifact with exactly this name, None if there's none '''
+        return self.byName.get(name, None)
+
+    def duplicateProviders(self) -> T.Dict[str, T.List[str]]:
+        ''' returns the provided names that are provided by more than one artifact, with the names of these artifacts '''
+        ret = {}
+        for key, providers in self.providers.items():
+            candidates = providers[:]
+            if key in self.byName and key not in candidates:
+                candidates.insert(0, key)
+            if len(candidates) > 1:
+                ret[key] = candidates
+        return ret
+
+    def _deps(self, item) -> T.List[str]:
+        if self.resolver:
+            self.resolver(item)
+        return item.deps
+
+    def neededNames(self, targets: T.List[str]) -> T.Dict[str, T.Any]:
+        ''' returns the names that are needed by the targets, directly or through dependencies, with the
+            artifact each one resolves to (None when it's neither defined nor provided by any artifact)
+        '''
+        ret = {}
+        seen = set()
+        todo = list(targets)
+        while todo:
+            name = todo.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+
+            item = self.get(name)
+            ret[name] = item
+            if item is not None and (item.name == name or item.name not in seen):
+                seen.add(item.name)
+                todo.extend(self._deps(item))
+        return ret
+
+    def missingNames(self, targets: T.List[str]) -> T.Set[str]:
+        ''' returns the names that are needed by the targets, directly or through dependencies, but are
+            neither defined nor provided by any artifact
+        '''
+        return {name for name, item in self.neededNames(targets).items() if item is None}
+
+    def buildPlan(self, targets: T.List[str]) -> T.List[T.Any]:
+        '''
+            computes the build plan for the given targets: all the artifacts they need, each one after
+            its dependencies
+            @return the list of artifacts to build
+            @raise DependencyCycleError if the dependencies contain a cycle
+        '''
+        plan = []
+        planned = set()
+        provided = set()
+        endOfDeps = object()
+
+        for target in targets:
+            if target in planned or target in provided:
+                continue
+
+            root = self.get(target)
+            if root is None:
+                logging.error(f"unable to find build dependency {target}")
+                continue
+            if root.name in planned:
+                continue
+
+            # iterative depth first search, path holds the artifacts being visited
+            stack = [(root, iter(self._deps(root)))]
+            path = [root.name]
+            onPath = {root.name}
+            while stack:
+                (item, depsIter) = stack[-1]
+                dep = next(depsIter, endOfDeps)
+                if dep is endOfDeps:
+                    stack.pop()
+                    onPath.discard(path.pop())
+                    plan.append(item)
+                    planned.add(item.name)
+                    provided.update(providedNames(item))
+                    continue
+
+                if dep in planned or dep in provided:
+                    continue
+
+                depItem = self.get(dep)
+                if depItem is None:
+                    logging.error(f"unable to find build dependency {dep}")
+                    continue
+
+                if depItem.name in planned:
+                    continue
+
+                if depItem.name in onPath:
+                    raise DependencyCycleError(path[path.index(depItem.name):] + [depItem.name])
+
+                stack.append((depItem, iter(self._deps(depItem))))
+                path.append(depItem.name)
+                onPath.add(depItem.name)
+
+        return plan
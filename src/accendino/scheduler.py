@@ -0,0 +1,161 @@
+import time
+import concurrent.futures
+import typing as T
+
+from zenlog import log as logging
+
+
+class BuildScheduler:
+    ''' runs the items of a build plan, starting every artifact whose dependencies are done '''
+
+    def __init__(self, config, buildPlan: T.List[T.Any], maxJobs: int = 1) -> None:
+        '''
+            @param config: the accendino configuration
+            @param buildPlan: the build plan as computed by AccendinoConfig.createBuildPlan()
+            @param maxJobs: maximum number of artifacts processed at the same time
+        '''
+        self.buildPlan = buildPlan
+        self.maxJobs = max(1, maxJobs)
+
+        # dependencies of each item restricted to the items of the build plan
+        planNames = [item.name for item in buildPlan]
+        self.planDeps = {}
+        for item in buildPlan:
+            deps = []
+            for dep in item.deps:
+                depItem = config.getBuildItem(dep)
+                if depItem and depItem.name != item.name and depItem.name in planNames and depItem.name not in deps:
+                    deps.append(depItem.name)
+            self.planDeps[item.name] = deps
+
+    def run(self, processFn: T.Callable[[T.Any], bool]) -> bool:
+        '''
+            runs processFn on each item of the build plan, respecting dependencies. When an item fails
+            no new item is started, we just wait for the running ones to finish
+            @param processFn: the function called for each item, it returns if the operation was successful
+            @return if all items were processed successfully
+        '''
+        pending = self.buildPlan[:]
+        done = set()
+        running = {}
+        failed = False
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxJobs) as pool:
+            while pending or running:
+                if not failed:
+                    # items are picked in build plan order, so with maxJobs=1 we get the sequential behaviour
+                    for item in pending[:]:
+                        if len(running) >= self.maxJobs:
+                            break
+
+                        if all(dep in done for dep in self.planDeps[item.name]):
+                            pending.remove(item)
+                            running[pool.submit(processFn, item)] = item
+
+                if not running:
+                    break
+
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    item = running.pop(future)
+                    try:
+                        ok = future.result()
+                    except Exception as e:
+                        logging.error(f"error processing {item.name}: {e}")
+                        ok = False
+
+                    if ok:
+                        done.add(item.name)
+                    else:
+                        failed = True
+
+        return not failed and not pending
+
+
+class BackgroundStage:
+    ''' runs a stage of the pipeline in its own thread, the steps that depend on it wait for its result '''
+
+    def __init__(self, name: str, stageFn: T.Callable[[], int]) -> None:
+        '''
+            @param name: name of the stage, for logs
+            @param stageFn: the function running the stage, it returns an exit code (0 for success)
+        '''
+        self.name = name
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.future = self.pool.submit(self._run, stageFn)
+
+    def _run(self, stageFn: T.Callable[[], int]) -> int:
+        start = time.monotonic()
+        ret = stageFn()
+        if ret == 0:
+            logging.debug(f' * {self.name}: done ({time.monotonic() - start:.1f}s)')
+        return ret
+
+    def wait(self) -> int:
+        '''
+            waits for the end of the stage
+            @return the exit code of the stage
+        '''
+        try:
+            return self.future.result()
+        except Exception as e:
+            logging.error(f"error during {self.name}: {e}")
+            return 1
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=True)
+
+
+class SourcePrefetcher:
+    ''' checks out the sources of the build plan in a thread pool, so that network I/O overlaps with builds '''
+
+    def __init__(self, maxJobs: int = 4) -> None:
+        '''
+            @param maxJobs: maximum number of concurrent checkouts
+        '''
+        self.maxJobs = max(1, maxJobs)
+        self.pool = None
+        self.futures = {}
+
+    def start(self, items: T.List[T.Any], fetchFn: T.Callable[[T.Any], bool]) -> None:
+        '''
+            starts fetching the sources of the given items
+            @param items: the build items to fetch
+            @param fetchFn: the function doing the checkout, it returns if the operation was successful
+        '''
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.maxJobs)
+        for item in items:
+            self.futures[item.name] = self.pool.submit(self._fetch, item, fetchFn)
+
+    @staticmethod
+    def _fetch(item, fetchFn) -> bool:
+        logging.info(f' * {item.name}: fetching sources')
+        start = time.monotonic()
+        ok = fetchFn(item)
+        if ok:
+            logging.info(f' * {item.name}: sources ready ({time.monotonic() - start:.1f}s)')
+        return ok
+
+    def wait(self, item) -> bool:
+        '''
+            waits for the sources of the given item
+            @return if the checkout was successful
+        '''
+        future = self.futures.get(item.name, None)
+        if future is None:
+            return True
+
+        try:
+            return future.result()
+        except Exception as e:
+            logging.error(f"error fetching sources of {item.name}: {e}")
+            return False
+
+    def shutdown(self) -> None:
+        ''' cancels the pending checkouts and waits for the running ones '''
+        for future in self.futures.values():
+            future.cancel()
+
+        if self.pool:
+            self.pool.shutdown(wait=True)
+            self.pool = None
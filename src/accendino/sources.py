@@ -1,9 +1,14 @@
 import os
+import re
 import shutil
+import hashlib
 import subprocess
+import threading
 
 from pathlib import Path
 from zenlog import log as logging
+from accendino.download import DownloadCache
+from accendino.extract import extractTar, extractZip
 
 
 class Source:
@@ -11,10 +16,22 @@ class Source:
 
     def __init__(self, pkgs = {}):
         self.pkgDeps = pkgs
+        # a source object can be shared by multiple artifacts that are built concurrently
+        self.lock = threading.Lock()
         # tells if the last checkout() actually changed the content of the source tree
         # (freshly cloned/copied, or refreshed to a different revision)
         self.refreshed = False
 
+    def init(self, _config) -> None:
+        ''' called with the configuration before the first checkout '''
+        pass
+
+    def revision(self, _target_dir) -> str:
+        ''' returns a string that identifies the content of the checked out sources, or None if this
+            content can't be identified (the sources are then not cacheable)
+        '''
+        return None
+
 
 class LocalSource(Source):
     ''' Code source taken from a local directory that is either copied or symlinked '''
@@ -56,6 +73,76 @@ class LocalSource(Source):
             logging.error(f"error copying tree: {e}")
             return False
 
+class GitMirrorCache:
+    ''' a directory of bare mirrors of git repositories, that can be shared by multiple work dirs and projects.
+        Each mirror is updated at most once per run, clones are then done locally from the mirror.
+    '''
+
+    def __init__(self, rootDir: str) -> None:
+        '''
+            @param rootDir: directory holding the mirrors
+        '''
+        self.rootDir = rootDir
+        self.lock = threading.Lock()
+        self.urlLocks = {}
+        self.updated = {}
+
+        os.makedirs(rootDir, exist_ok=True)
+
+    def mirrorPath(self, url: str) -> str:
+        ''' returns the path of the mirror for the given url '''
+        baseName = re.sub(r'[^A-Za-z0-9._-]', '_', url.rstrip('/').split('/')[-1])
+        if baseName.endswith('.git'):
+            baseName = baseName[:-4]
+        urlHash = hashlib.sha1(url.encode('utf8')).hexdigest()[0:12]
+        return os.path.join(self.rootDir, f'{baseName}-{urlHash}.git')
+
+    def _urlLock(self, url: str) -> threading.Lock:
+        with self.lock:
+            if url not in self.urlLocks:
+                self.urlLocks[url] = threading.Lock()
+            return self.urlLocks[url]
+
+    def update(self, url: str, flog) -> str:
+        '''
+            creates or updates the mirror of url, this is done only once per run
+            @return the path of the mirror or None if it's not usable
+        '''
+        path = self.mirrorPath(url)
+
+        with self._urlLock(url):
+            if url in self.updated:
+                return path if self.updated[url] else None
+
+            if os.path.exists(path):
+                logging.debug(f'==> updating git mirror {path}')
+                cmd = ['git', 'remote', 'update', '--prune']
+                proc = subprocess.run(cmd, cwd=path, stdout=flog, stderr=flog)
+                ok = proc.returncode == 0
+                if not ok:
+                    # a stale mirror is still better than nothing
+                    logging.info(f'unable to update git mirror {path}, using it as is')
+                    ok = True
+            else:
+                logging.debug(f'==> creating git mirror of {url} in {path}')
+                tmpPath = f'{path}.tmp-{os.getpid()}'
+                proc = subprocess.run(['git', 'clone', '--mirror', url, tmpPath], stdout=flog, stderr=flog)
+                ok = proc.returncode == 0
+                if ok:
+                    try:
+                        os.rename(tmpPath, path)
+                    except OSError:
+                        # created concurrently by another accendino process
+                        ok = os.path.exists(path)
+                if os.path.exists(tmpPath):
+                    shutil.rmtree(tmpPath, ignore_errors=True)
+                if not ok:
+                    logging.error(f'unable to create git mirror of {url}')
+
+            self.updated[url] = ok
+            return path if ok else None
+
+
 class GitSource(Source):
     ''' Code source that is checked out from git '''
 
@@ -79,6 +166,10 @@ class GitSource(Source):
         self.depth = depth
         self.shallow_submodules = shallow_submodules
         self.recurse_submodules = recurse_submodules
+        self.mirrors = None
+
+    def init(self, config) -> None:
+        self.mirrors = config.gitMirrors
 
     def _revParseHead(self, target_dir: str) -> str:
         proc = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=target_dir, stdout=subprocess.PIPE,
@@ -87,6 +178,20 @@ class GitSource(Source):
             return None
         return proc.stdout.strip()
 
+    def revision(self, target_dir) -> str:
+        head = self._revParseHead(target_dir)
+        if head is None:
+            return None
+
+        # local changes of the tracked files are part of the revision, a dirty tree must not match HEAD
+        proc = subprocess.run(['git', 'diff', 'HEAD', '--binary', '--no-ext-diff'], cwd=target_dir, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL)
+        if proc.returncode != 0:
+            return None
+        if proc.stdout:
+            return f'{head}-dirty-{hashlib.sha256(proc.stdout).hexdigest()[0:16]}'
+        return head
+
     def checkout(self, target_dir: str, flog, refresh: bool = False) -> bool:
         ''' '''
         self.refreshed = False
@@ -98,7 +203,11 @@ class GitSource(Source):
             logging.debug(f"==> updating git dir {target_dir} from {self.url}")
             before = self._revParseHead(target_dir)
 
-            cmd = ['git', 'fetch', 'origin', self.branch]
+            mirror = self.mirrors.update(self.url, flog) if self.mirrors else None
+            remote = f'file://{mirror}' if mirror else 'origin'
+            resetTo = 'FETCH_HEAD' if mirror else f'origin/{self.branch}'
+
+            cmd = ['git', 'fetch', remote, self.branch]
             if self.depth:
                 cmd += ['--depth', str(self.depth)]
             proc = subprocess.run(cmd, cwd=target_dir, stdout=flog, stderr=flog)
@@ -106,7 +215,7 @@ class GitSource(Source):
                 logging.error(f"error fetching {self.url} in {target_dir}")
                 return False
 
-            proc = subprocess.run(['git', 'reset', '--hard', f'origin/{self.branch}'], cwd=target_dir,
+            proc = subprocess.run(['git', 'reset', '--hard', resetTo], cwd=target_dir,
                                    stdout=flog, stderr=flog)
             if proc.returncode != 0:
                 logging.error(f"error resetting {target_dir} to origin/{self.branch}")
@@ -127,6 +236,10 @@ class GitSource(Source):
                 logging.info(f"{target_dir} updated: {before} -> {after}")
             return True
 
+        mirror = self.mirrors.update(self.url, flog) if self.mirrors else None
+        if mirror:
+            return self._checkoutFromMirror(mirror, target_dir, flog)
+
         logging.debug(f"==> checking out repo in {target_dir}")
         cmd = ['git', 'clone', self.url, '-b', self.branch, target_dir]
         if self.depth:
@@ -140,19 +253,50 @@ class GitSource(Source):
         self.refreshed = proc.returncode == 0
         return proc.returncode == 0
 
+    def _checkoutFromMirror(self, mirror: str, target_dir, flog) -> bool:
+        ''' clones from the local mirror, origin is then set back to the upstream url '''
+        logging.debug(f"==> checking out repo in {target_dir} from mirror {mirror}")
+
+        # without depth git hardlinks the objects of the mirror, with a depth we need the file:// form
+        cmd = ['git', 'clone', f'file://{mirror}' if self.depth else mirror, '-b', self.branch, str(target_dir)]
+        if self.depth:
+            cmd += ['--depth', str(self.depth)]
+        proc = subprocess.run(cmd, stdout=flog, stderr=flog)
+        if proc.returncode != 0:
+            logging.error(f"error cloning {mirror} in {target_dir}")
+            return False
+
+        proc = subprocess.run(['git', 'remote', 'set-url', 'origin', self.url], cwd=target_dir, stdout=flog, stderr=flog)
+        if proc.returncode != 0:
+            logging.error(f"error setting origin of {target_dir} to {self.url}")
+            return False
+
+        # submodules are resolved now that origin points to upstream, so that relative urls work
+        if self.recurse_submodules:
+            cmd = ['git', 'submodule', 'update', '--init', '--recursive']
+            if self.shallow_submodules:
+                cmd.append('--depth=1')
+            proc = subprocess.run(cmd, cwd=target_dir, stdout=flog, stderr=flog)
+            if proc.returncode != 0:
+                logging.error(f"error updating submodules in {target_dir}")
+                return False
+
+        self.refreshed = True
+        return True
+
 
 class RemoteArchiveSource(Source):
     ''' Code source that is checked out from a remote location '''
 
+    EXTRACTED_STAMP = '.accendino-extracted'
+
     def __init__(self, url: str, saveAs: str = None, compression_method: str = 'guess', strip_depth: int = 0,
-                 checked_file: str = 'aclocal.m4') -> None:
+                 checked_file: str = 'aclocal.m4', sha256: str = None) -> None:
         '''
             @param url: URL of the archive repo
+            @param sha256: expected sha256 of the archive
         '''
-        Source.__init__(self, {
-            'Ubuntu|Debian|Fedora|Redhat': ['curl'],
-            'Windows': ['choco/curl|path/curl'],
-        })
+        Source.__init__(self, {})
 
         if saveAs is None:
             pos = url.rfind("/")
@@ -163,37 +307,29 @@ class RemoteArchiveSource(Source):
         else:
             self.saveAs = saveAs
 
+        # tar and zip archives are extracted in-process, 7z still needs the external tool
         knownCompressions = {
-            'tar.gz': (['tar', f'--strip-components={strip_depth}', '-xzf'],
-                {
-                    'Ubuntu|Debian|Fedora|Redhat': ['tar', 'gzip'],
-                    'Windows': ['choco/7z|path/7z']
-                },
-
-            ),
-            'tar': (['tar', f'--strip-components={strip_depth}', '-xf'],
+            'tar.gz': ('tar', {}),
+            'tgz': ('tar', {}),
+            'tar.bz2': ('tar', {}),
+            'tar.xz': ('tar', {}),
+            'tar': ('tar', {}),
+            'zip': ('zip', {}),
+            '7z': ('7z',
                 {
-                    'Ubuntu|Debian|Fedora|Redhat': ['tar'],
+                    'Ubuntu|Debian': ['p7zip-full'],
+                    'Fedora|Redhat': ['p7zip-plugins'],
                     'Windows': ['choco/7zip|path/7z']
                 },
             ),
-            'zip': (['unzip', '-o'],
-                {
-                    'Ubuntu|Debian|Fedora|Redhat': ['unzip'],
-                    'Windows': ['choco/7z|path/7z']
-                },
-            ),
-            '7z': (['7z', 'x'],
-                {
-                    'Ubuntu|Debian|Fedora|Redhat': ['unzip'],
-                    'Windows': ['choco/7z|path/7z']
-                },
-            ),
         }
 
         self.url = url
+        self.sha256 = sha256
         self.compression = compression_method
+        self.strip_depth = strip_depth
         self.checked_file = checked_file
+        self.downloads = None
 
         compProps = None
         if compression_method == 'guess':
@@ -213,26 +349,36 @@ class RemoteArchiveSource(Source):
             logging.error(f'unknown compression method {compression_method}')
             raise NotImplementedError()
 
-        self.decompressCmd = None
+        self.archiveKind = None
         if compProps:
             # update native package deps
             for k, v in compProps[1].items():
                 if k in self.pkgDeps:
                     self.pkgDeps[k] += v
                 else:
-                    self.pkgDeps[k] = [ v ]
+                    self.pkgDeps[k] = v[:]
 
-            self.decompressCmd = compProps[0]
-        else:
-            if compression_method:
-                logging.error(f'unknown compression method {compression_method}')
-                raise NotImplementedError()
+            self.archiveKind = compProps[0]
 
-    def decompress(self, target_dir, sourcePath, flog):
-        if self.decompressCmd is None:
+    def init(self, config) -> None:
+        self.downloads = config.downloadCache
+
+    def revision(self, _target_dir) -> str:
+        return self.sha256 or self.url
+
+    def decompress(self, target_dir, sourcePath, flog) -> bool:
+        ''' extracts the downloaded archive in target_dir '''
+        if self.archiveKind is None:
             return True
 
-        extractCmd = self.decompressCmd + [ str(sourcePath) ]
+        if self.archiveKind == 'tar':
+            with open(sourcePath, 'rb') as f:
+                return extractTar(f, str(target_dir), self.strip_depth)
+
+        if self.archiveKind == 'zip':
+            return extractZip(str(sourcePath), str(target_dir), self.strip_depth)
+
+        extractCmd = ['7z', 'x', str(sourcePath)]
         logging.debug(f'running {" ".join(extractCmd)} in {target_dir}')
         proc = subprocess.run(extractCmd, cwd=target_dir, stdout=flog, stderr=flog)
         if proc.returncode != 0:
@@ -240,29 +386,58 @@ class RemoteArchiveSource(Source):
             return False
         return True
 
+    def _extractedDigest(self, target_dir) -> str:
+        ''' returns the sha256 of the archive that was extracted in target_dir, if known '''
+        try:
+            with open(target_dir / self.EXTRACTED_STAMP, 'rt', encoding='utf8') as f:
+                return f.read().strip()
+        except OSError:
+            return None
 
     def checkout(self, target_dir, flog, _refresh: bool = False) -> bool:
         self.refreshed = False
+        target_dir = Path(target_dir)
+        extracted = self._extractedDigest(target_dir)
+        if extracted and (self.sha256 is None or extracted == self.sha256.lower()):
+            logging.debug(f'archive {self.saveAs} is already extracted in {target_dir}')
+            return True
+
         checked_path = target_dir / self.checked_file
-        if os.path.exists(checked_path) and os.path.isfile(checked_path):
+        if extracted is None and os.path.exists(checked_path) and os.path.isfile(checked_path):
             logging.debug(f'{self.checked_file} already exists meaning archive {self.saveAs} is already downloaded')
             return True
 
-        archiveDir = target_dir / '..' / '..' / 'archives'
-        if not os.path.exists(archiveDir):
-            os.makedirs(archiveDir, exist_ok=True)
+        downloads = self.downloads or DownloadCache(str(target_dir / '..' / '..' / 'archives'))
 
-        saveAsPath = Path(archiveDir / self.saveAs).resolve()
-        retrieveCmd = ['curl', '-s', '-L', self.url, '-o', str(saveAsPath)]
+        # extract in a temporary directory that replaces the source tree only once the archive is verified
+        extractDir = Path(f'{target_dir}.accendino-extract')
+        if os.path.exists(extractDir):
+            shutil.rmtree(extractDir)
+        os.makedirs(extractDir)
 
-        if os.path.exists(saveAsPath):
-            retrieveCmd += ['-z', str(saveAsPath)]
+        try:
+            # tar archives are extracted while they're downloaded
+            consumer = None
+            if self.archiveKind == 'tar':
+                consumer = lambda stream: extractTar(stream, str(extractDir), self.strip_depth)
 
-        logging.debug(f'running {" ".join(retrieveCmd)}')
-        proc = subprocess.run(retrieveCmd, stdout=flog, stderr=flog)
-        if proc.returncode != 0:
-            logging.error(f'error retrieving {self.url}')
-            return False
+            archivePath = downloads.fetch(self.url, self.saveAs, self.sha256, consumer)
+            if archivePath is None:
+                return False
+
+            if consumer is None and not self.decompress(extractDir, archivePath, flog):
+                return False
+
+            with open(extractDir / self.EXTRACTED_STAMP, 'wt', encoding='utf8') as f:
+                f.write(downloads.digest(archivePath))
+
+            if os.path.islink(target_dir):
+                os.remove(target_dir)
+            elif os.path.exists(target_dir):
+                shutil.rmtree(target_dir)
+            os.rename(extractDir, target_dir)
+        finally:
+            shutil.rmtree(extractDir, ignore_errors=True)
 
         self.refreshed = True
-        return self.decompress(target_dir, saveAsPath, flog)
+        return True
@@ -0,0 +1,190 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import typing as T
+
+from zenlog import log as logging
+
+
+STATE_DB_FILE = 'accendino-state.sqlite'
+
+
+class BuildStateDb:
+    ''' persisted build state of the artifacts of a project
+
+        For each build tree (distrib-toolchain-arch-buildType) and artifact we store a fingerprint that
+        changes each time the artifact is built with a different interface, and the fingerprints of its
+        dependencies at that time.
+        An artifact is outdated when the current fingerprints of its dependencies differ from the recorded
+        ones, or when one of its dependencies is itself outdated.
+
+        Some metadata are also stored with each build, like the hash of the configuration interface of the
+        artifact and the ones of its dependencies at that time.
+    '''
+
+    def __init__(self, path) -> None:
+        '''
+            @param path: path of the SQLite database
+        '''
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS artifacts ('
+                          'tree TEXT NOT NULL, name TEXT NOT NULL, fingerprint TEXT NOT NULL, inputs TEXT NOT NULL, '
+                          'builtAt REAL NOT NULL, PRIMARY KEY (tree, name))')
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(artifacts)')]
+        if 'meta' not in columns:
+            # databases created by older versions
+            self.conn.execute("ALTER TABLE artifacts ADD COLUMN meta TEXT NOT NULL DEFAULT '{}'")
+        self.conn.commit()
+        self.trees = {}
+
+    def _rows(self, tree: str) -> T.Dict[str, T.Tuple[str, T.Dict[str, str], T.Dict[str, T.Any]]]:
+        ''' returns the records of a build tree, they are loaded with a single query the first time '''
+        rows = self.trees.get(tree, None)
+        if rows is None:
+            rows = {}
+            for name, fingerprint, inputs, meta in self.conn.execute(
+                    'SELECT name, fingerprint, inputs, meta FROM artifacts WHERE tree = ?', (tree,)):
+                rows[name] = (fingerprint, json.loads(inputs), json.loads(meta))
+            self.trees[tree] = rows
+        return rows
+
+    def fingerprint(self, tree: str, name: str) -> str:
+        with self.lock:
+            row = self._rows(tree).get(name, None)
+        return row[0] if row else None
+
+    def recordedInputs(self, tree: str, name: str) -> T.Dict[str, str]:
+        with self.lock:
+            row = self._rows(tree).get(name, None)
+        return row[1] if row else None
+
+    def meta(self, tree: str, name: str) -> T.Dict[str, T.Any]:
+        ''' returns the metadata recorded with the last build of an artifact, None if it was never built '''
+        with self.lock:
+            row = self._rows(tree).get(name, None)
+        return row[2] if row else None
+
+    def record(self, tree: str, name: str, inputs: T.Dict[str, str], fingerprint: str = None,
+               meta: T.Dict[str, T.Any] = None) -> str:
+        '''
+            records a build of an artifact
+            @param inputs: the fingerprints of the dependencies
+            @param fingerprint: the fingerprint of this build, by default a new unique one
+            @param meta: metadata of this build
+            @return the recorded fingerprint
+        '''
+        meta = meta or {}
+        now = time.time()
+        if fingerprint is None:
+            content = json.dumps([tree, name, inputs, time.time_ns()], sort_keys=True)
+            fingerprint = hashlib.sha256(content.encode('utf8')).hexdigest()
+
+        with self.lock:
+            self._rows(tree)[name] = (fingerprint, inputs, meta)
+            self.conn.execute('INSERT OR REPLACE INTO artifacts (tree, name, fingerprint, inputs, builtAt, meta) '
+                              'VALUES (?, ?, ?, ?, ?, ?)',
+                              (tree, name, fingerprint, json.dumps(inputs, sort_keys=True), now,
+                               json.dumps(meta, sort_keys=True)))
+            self.conn.commit()
+        return fingerprint
+
+    def forget(self, tree: str, name: str) -> None:
+        with self.lock:
+            self._rows(tree).pop(name, None)
+            self.conn.execute('DELETE FROM artifacts WHERE tree = ? AND name = ?', (tree, name))
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+def artifactFingerprint(config, artifact, memo: T.Dict[str, str] = None) -> str:
+    ''' returns the current fingerprint of an artifact, artifacts that are only deps have a fingerprint
+        computed from the ones of their dependencies
+    '''
+    if memo is None:
+        memo = {}
+
+    if artifact.name in memo:
+        return memo[artifact.name]
+
+    if artifact.buildTree:
+        ret = config.stateDb.fingerprint(artifact.buildTree, artifact.name)
+    else:
+        inputs = depsFingerprints(config, artifact, memo)
+        ret = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf8')).hexdigest()
+
+    memo[artifact.name] = ret
+    return ret
+
+
+def depsFingerprints(config, artifact, memo: T.Dict[str, str] = None) -> T.Dict[str, str]:
+    ''' returns the current fingerprints of the dependencies of an artifact '''
+    ret = {}
+    for dep in artifact.deps:
+        depArtifact = config.getBuildItem(dep)
+        if depArtifact:
+            ret[depArtifact.name] = artifactFingerprint(config, depArtifact, memo)
+    return ret
+
+
+def artifactConfigInterface(config, artifact, memo: T.Dict[str, str] = None) -> str:
+    ''' returns the hash of the configuration interface of an artifact as recorded with its last build (see
+        InstallManifest.configInterface()), artifacts that are only deps combine the ones of their dependencies
+    '''
+    if memo is None:
+        memo = {}
+
+    if artifact.name in memo:
+        return memo[artifact.name]
+
+    if artifact.buildTree:
+        meta = config.stateDb.meta(artifact.buildTree, artifact.name)
+        ret = meta.get('configInterface', None) if meta else None
+    else:
+        inputs = depsConfigInterfaces(config, artifact, memo)
+        ret = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf8')).hexdigest()
+
+    memo[artifact.name] = ret
+    return ret
+
+
+def depsConfigInterfaces(config, artifact, memo: T.Dict[str, str] = None) -> T.Dict[str, str]:
+    ''' returns the current configuration interfaces of the dependencies of an artifact '''
+    ret = {}
+    for dep in artifact.deps:
+        depArtifact = config.getBuildItem(dep)
+        if depArtifact:
+            ret[depArtifact.name] = artifactConfigInterface(config, depArtifact, memo)
+    return ret
+
+
+def isOutdated(config, artifact, memo: T.Dict[str, bool] = None) -> bool:
+    ''' tells if an artifact must be rebuilt because some of its (direct or transitive) dependencies changed '''
+    if memo is None:
+        memo = {}
+
+    if artifact.name in memo:
+        return memo[artifact.name]
+
+    memo[artifact.name] = False
+    ret = False
+    if artifact.buildTree:
+        recorded = config.stateDb.recordedInputs(artifact.buildTree, artifact.name)
+        if recorded is None or recorded != depsFingerprints(config, artifact):
+            ret = True
+
+    if not ret:
+        for dep in artifact.deps:
+            depArtifact = config.getBuildItem(dep)
+            if depArtifact and isOutdated(config, depArtifact, memo):
+                logging.debug(f'{artifact.name} is outdated because {depArtifact.name} is')
+                ret = True
+                break
+
+    memo[artifact.name] = ret
+    return ret
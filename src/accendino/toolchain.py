@@ -1,12 +1,15 @@
 import os
+import shlex
+import hashlib
 import pathlib
 import subprocess
+import threading
 import json
 import tempfile
 import typing as T
 from zenlog import log as logging
 from accendino.localdeps import PackageManager
-from accendino.utils import treatPackageDeps
+from accendino.utils import treatPackageDeps, getPathIndex
 
 
 class IToolChain:
@@ -18,13 +21,11 @@ class IToolChain:
         self.artifactRequires = {}
         self.config = config
 
-    def packagesCheck(self, packageManager: PackageManager, artifacts: T.List[str], doInstall: bool) -> bool:
+    def requiredPackages(self, artifacts: T.List[str]) -> T.List[str]:
         '''
-            checks that the toolchain have the necessary packages for the given toolchain artifacts
-            @param packageManager: the manager for local package
+            returns the packages needed by the given toolchain artifacts on the current platform
             @param artifacts: a list of toolchain artifacts
-            @param doInstall: tell if we should install missing packages
-            @return if the operation was successful
+            @return the list of packages
         '''
         config = self.config
         shortName = f"{config.distribId}"
@@ -45,7 +46,34 @@ class IToolChain:
                     toCheck += v
 
         logging.debug(f"packages to check from toolchain artifacts: {', '.join(toCheck)}")
+        return toCheck
+
+    def selectPackages(self, _packageManager: PackageManager, artifacts: T.List[str]) -> T.List[str]:
+        '''
+            returns the packages that the toolchain needs for the given toolchain artifacts, so that they're
+            checked and installed with the packages of the build artifacts
+            @param _packageManager: the manager for local package
+            @param artifacts: a list of toolchain artifacts
+            @return the list of packages, None if the requirements can't be met
+        '''
+        return self.requiredPackages(artifacts)
+
+    def packagesCheck(self, packageManager: PackageManager, artifacts: T.List[str], doInstall: bool) -> bool:
+        '''
+            checks that the toolchain have the necessary packages for the given toolchain artifacts
+            @param packageManager: the manager for local package
+            @param artifacts: a list of toolchain artifacts
+            @param doInstall: tell if we should install missing packages
+            @return if the operation was successful
+        '''
+        toCheck = self.selectPackages(packageManager, artifacts)
+        if toCheck is None:
+            return False
+
         toInstall = packageManager.checkMissing(toCheck)
+        if toInstall is None:
+            return False
+
         if len(toInstall) and doInstall:
             return packageManager.installPackages(toInstall)
 
@@ -71,6 +99,180 @@ class IToolChain:
         '''
         return {}
 
+    def codegenFlags(self, _artifacts) -> T.Tuple[T.List[str], T.List[str]]:
+        ''' returns the flags implementing the linker and debug info settings (`--linker`, `--split-dwarf` and
+            `--compress-debug-sections`) for the given artifacts. The builders pass them with their own arguments
+            (cmake variables, meson options, configure variables)
+            @param _artifacts: list of artifacts
+            @return a tuple (compile flags, link flags)
+        '''
+        return ([], [])
+
+    def fingerprint(self, artifacts) -> str:
+        ''' returns a hash identifying the compilers used for the given artifacts and their settings, it changes
+            when the toolchain, the compilers or the codegen settings change
+            @param artifacts: list of artifacts
+            @return the fingerprint
+        '''
+        env = self.extraEnv(artifacts)
+        h = hashlib.sha256()
+        h.update(json.dumps({
+            'toolchain': self.description,
+            'env': env,
+            'codegen': self.codegenFlags(artifacts),
+        }, sort_keys=True, default=str).encode('utf8'))
+
+        for var in ('CC', 'CXX'):
+            if var in env:
+                h.update(compilerIdentity(env[var]).encode('utf8'))
+        return h.hexdigest()
+
+
+COMPILER_CACHES = ('ccache', 'sccache')
+
+# compiler variables set by the toolchains, and the corresponding cmake launcher variables
+COMPILER_VARS = {
+    'c': ('CC', 'CMAKE_C_COMPILER_LAUNCHER'),
+    'c++': ('CXX', 'CMAKE_CXX_COMPILER_LAUNCHER'),
+}
+
+CCACHE_HIT_COUNTERS = ('direct_cache_hit', 'preprocessed_cache_hit')
+CCACHE_MISS_COUNTERS = ('cache_miss',)
+
+
+def parseCcacheStatsLog(path: str) -> T.Tuple[int, int]:
+    '''
+        parses a ccache stats log (see `stats_log` in the ccache documentation), it contains a `# <input file>`
+        line for each compilation followed by the counters it incremented
+        @return a tuple (hits, misses), None if the log doesn't exist
+    '''
+    hits = 0
+    misses = 0
+    try:
+        with open(path, 'rt', encoding='utf8', errors='replace') as f:
+            for l in f:
+                l = l.strip()
+                if l in CCACHE_HIT_COUNTERS:
+                    hits += 1
+                elif l in CCACHE_MISS_COUNTERS:
+                    misses += 1
+    except FileNotFoundError:
+        return None
+
+    return (hits, misses)
+
+
+class CompilerCache:
+    ''' a compiler cache (ccache or sccache) put in front of the compilers of the toolchain. CMake artifacts use
+        it through the CMAKE_<LANG>_COMPILER_LAUNCHER variables, the other builders through CC and CXX
+    '''
+
+    def __init__(self, tool: str, path: str, cacheDir: str = None, baseDir: str = None) -> None:
+        '''
+            @param tool: ccache or sccache
+            @param path: path of the tool
+            @param cacheDir: the cache directory, None for the default of the tool
+            @param baseDir: base directory for ccache, paths below it are rewritten relative so that the cache
+                    is shared between work directories
+        '''
+        self.tool = tool
+        self.path = path
+        self.cacheDir = cacheDir
+        self.baseDir = baseDir
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def create(tool: str, cacheDir: str = None, baseDir: str = None):
+        '''
+            creates the compiler cache for the given tool
+            @return the CompilerCache, None if the tool is not installed
+        '''
+        path = getPathIndex().find(tool)
+        if path is None:
+            logging.warning(f'{tool} not found in PATH, compiling without compiler cache')
+            return None
+        return CompilerCache(tool, path, cacheDir, baseDir)
+
+    def wrapEnv(self, toolchainEnv: T.Dict[str, str], artifacts: T.List[str], useLaunchers: bool) -> T.Dict[str, str]:
+        '''
+            returns the toolchain env modified to use the compiler cache
+            @param toolchainEnv: the env returned by the toolchain's extraEnv()
+            @param artifacts: the toolchain artifacts of the build artifact
+            @param useLaunchers: if the cmake launcher variables should be used instead of wrapping CC/CXX
+        '''
+        ret = dict(toolchainEnv or {})
+        for artifact, (compilerVar, launcherVar) in COMPILER_VARS.items():
+            if useLaunchers:
+                # cmake projects often enable languages that are not in their toolchain artifacts
+                ret[launcherVar] = self.tool
+            elif artifact in artifacts and compilerVar in ret and not ret[compilerVar].startswith(f'{self.tool} '):
+                ret[compilerVar] = f'{self.tool} {ret[compilerVar]}'
+        return ret
+
+    def runEnv(self, statsLog: pathlib.PurePath) -> T.Dict[str, str]:
+        '''
+            returns the env variables configuring the cache when running the commands of an artifact, they
+            don't change the build outputs
+            @param statsLog: where ccache should log the statistics of the artifact
+        '''
+        ret = {}
+        if self.tool == 'ccache':
+            ret['CCACHE_STATSLOG'] = str(statsLog)
+            if self.cacheDir:
+                ret['CCACHE_DIR'] = self.cacheDir
+            if self.baseDir:
+                ret['CCACHE_BASEDIR'] = self.baseDir
+        elif self.cacheDir:
+            ret['SCCACHE_DIR'] = self.cacheDir
+        return ret
+
+    def recordBuild(self, name: str, statsLog: pathlib.PurePath) -> None:
+        ''' records the statistics of an artifact that was just built '''
+        if self.tool != 'ccache':
+            return
+
+        stats = parseCcacheStatsLog(statsLog)
+        if stats is not None:
+            with self.lock:
+                self.stats[name] = stats
+
+    def report(self) -> None:
+        ''' logs the hits and misses of the artifacts built during this run '''
+        if self.tool != 'ccache':
+            logging.info(f' * compiler cache: per artifact statistics are not available with {self.tool}, see `{self.tool} --show-stats`')
+            return
+
+        totalHits = totalMisses = 0
+        for name, (hits, misses) in self.stats.items():
+            if hits + misses == 0:
+                continue
+
+            totalHits += hits
+            totalMisses += misses
+            logging.info(f' * {self.tool} {name}: {hits} hits, {misses} misses ({100 * hits // (hits + misses)}%)')
+
+        if totalHits + totalMisses:
+            logging.info(f' * {self.tool} total: {totalHits} hits, {totalMisses} misses '
+                         f'({100 * totalHits // (totalHits + totalMisses)}%)')
+
+
+_compilerIdentities = {}
+
+def compilerIdentity(compiler: str) -> str:
+    ''' returns the `--version` output of a compiler, results are cached
+        @param compiler: the compiler command (like `gcc` or `ccache gcc`)
+    '''
+    if compiler not in _compilerIdentities:
+        try:
+            proc = subprocess.run(shlex.split(compiler) + ['--version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                  encoding='utf8', errors='replace', check=False)
+            _compilerIdentities[compiler] = proc.stdout if proc.returncode == 0 else ''
+        except OSError:
+            _compilerIdentities[compiler] = ''
+    return _compilerIdentities[compiler]
+
+
 def computeEnvDiff(inputIter):
     '''
         computes the new env variables set after a call to VsDevCmd.bat, it parses content that
@@ -213,11 +415,102 @@ class VsToolChain(IToolChain):
         return self.extraEnvMap
 
 
-class GccToolChain(IToolChain):
+LINKERS = ('default', 'lld', 'mold', 'gold')
+
+# packages of the linkers, as toolchain artifacts
+LINKER_REQUIRES = {
+    'linker-lld': treatPackageDeps({
+        'Debian|Ubuntu|Fedora|Redhat|Arch': ['lld'],
+    }),
+    'linker-mold': treatPackageDeps({
+        'Debian|Ubuntu|Fedora|Redhat|Arch|FreeBSD': ['mold'],
+    }),
+    'linker-gold': treatPackageDeps({
+        'Debian|Ubuntu': ['binutils'],
+        'Fedora|Redhat': ['binutils-gold'],
+    }),
+}
+
+PROBE_SOURCE = 'int main(void) { return 0; }\n'
+
+
+class GccLikeToolChain(IToolChain):
+    ''' Toolchain with a gcc compatible compiler driver, the linker and the debug info layout can be selected '''
+
+    def __init__(self, name, config):
+        IToolChain.__init__(self, name, config)
+        self.probedFlags = {}
+        self.probeLock = threading.Lock()
+
+    def requiredPackages(self, artifacts: T.List[str]) -> T.List[str]:
+        config = self.config
+        if config.linker != 'default' and not config.crossCompilation and any(a in COMPILER_VARS for a in artifacts):
+            artifacts = list(artifacts) + [f'linker-{config.linker}']
+        return IToolChain.requiredPackages(self, artifacts)
+
+    def _probe(self, flags: T.List[str], link: bool) -> bool:
+        compiler = self.extraEnv(['c']).get('CC', None)
+        if not compiler:
+            return False
+
+        with tempfile.TemporaryDirectory(prefix='accendino-probe-') as tmpDir:
+            with open(os.path.join(tmpDir, 'probe.c'), 'wt', encoding='utf8') as f:
+                f.write(PROBE_SOURCE)
+
+            cmd = [compiler, '-Werror'] + flags
+            cmd += ['probe.c', '-o', 'probe'] if link else ['-c', 'probe.c', '-o', 'probe.o']
+            try:
+                return subprocess.run(cmd, cwd=tmpDir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                      check=False).returncode == 0
+            except OSError:
+                return False
+
+    def checkFlags(self, flags: T.List[str], link: bool, what: str) -> bool:
+        '''
+            checks once that the compiler accepts the given flags
+            @param flags: the flags to test
+            @param link: if the test program should also be linked
+            @param what: description of the setting, for the warning when it's not available
+            @return if the flags can be used
+        '''
+        key = (tuple(flags), link)
+        with self.probeLock:
+            if key not in self.probedFlags:
+                ok = self._probe(flags, link)
+                if not ok:
+                    logging.warning(f'{what} is not available with the {self.name} toolchain, ignoring it')
+                self.probedFlags[key] = ok
+            return self.probedFlags[key]
+
+    def codegenFlags(self, artifacts) -> T.Tuple[T.List[str], T.List[str]]:
+        config = self.config
+        compileFlags = []
+        linkFlags = []
+        if config.crossCompilation or not any(a in COMPILER_VARS for a in artifacts):
+            return (compileFlags, linkFlags)
+
+        if config.linker != 'default':
+            flag = f'-fuse-ld={config.linker}'
+            if self.checkFlags([flag], True, f'linker {config.linker}'):
+                linkFlags.append(flag)
+
+        # these only change the debug info, that is only generated for debug builds
+        if config.buildType == 'debug':
+            if config.splitDwarf and self.checkFlags(['-g', '-gsplit-dwarf'], False, 'split dwarf'):
+                compileFlags.append('-gsplit-dwarf')
+
+            if config.compressDebugSections and self.checkFlags(['-g', '-gz'], True, 'debug sections compression'):
+                compileFlags.append('-gz')
+                linkFlags.append('-gz')
+
+        return (compileFlags, linkFlags)
+
+
+class GccToolChain(GccLikeToolChain):
     ''' Toolchain with GCC '''
 
     def __init__(self, config):
-        IToolChain.__init__(self, 'Gcc', config)
+        GccLikeToolChain.__init__(self, 'Gcc', config)
         self.artifactRequires = {
             'c': treatPackageDeps({
                 'Debian|Ubuntu|Fedora|Redhat': ['gcc'],
@@ -229,7 +522,8 @@ class GccToolChain(IToolChain):
             'c++': treatPackageDeps({
                 'Debian|Ubuntu': ['g++'],
                 'Fedora|Redhat': ['gcc-c++'],
-            })
+            }),
+            **LINKER_REQUIRES
         }
 
     def extraEnv(self, artifacts) -> T.Dict[str, str]:
@@ -244,11 +538,11 @@ class GccToolChain(IToolChain):
         return ret
 
 
-class ClangToolChain(IToolChain):
+class ClangToolChain(GccLikeToolChain):
     ''' Toolchain with clang '''
 
     def __init__(self, config):
-        IToolChain.__init__(self, 'Clang', config)
+        GccLikeToolChain.__init__(self, 'Clang', config)
         self.artifactRequires = {
             'c': treatPackageDeps({
                 'Debian|Ubuntu|Fedora|Redhat': ['clang'],
@@ -257,7 +551,8 @@ class ClangToolChain(IToolChain):
             'c++': treatPackageDeps({
                 'Debian|Ubuntu|Fedora|Redhat': ['clang'],
                 'Darwin': ['path/clang++'],
-            })
+            }),
+            **LINKER_REQUIRES
         }
 
     def extraEnv(self, artifacts) -> T.Dict[str, str]:
@@ -335,16 +630,18 @@ class DefaultToolChain(IToolChain):
             self.testObjs.append(GccToolChain(config))
             self.testObjs.append(ClangToolChain(config))
 
-    def packagesCheck(self, packageManager: PackageManager, artifacts: T.List[str], doInstall: bool) -> bool:
+    def selectPackages(self, packageManager: PackageManager, artifacts: T.List[str]) -> T.List[str]:
         logging.debug(' * autodetecting with default toolchain manager')
         for o in self.testObjs:
             logging.debug(f' * testing artifacts=[{", ".join(artifacts)}] against toolchain {o.name}')
-            if o.packagesCheck(packageManager, artifacts, doInstall):
+            # the first toolchain whose packages are installed or installable wins
+            ret = o.selectPackages(packageManager, artifacts)
+            if ret is not None and packageManager.checkMissing(ret) is not None:
                 logging.debug(f' * using {o.name} toolchain')
                 self.selectedObj = o
                 self.description = o.name
-                return True
-        return False
+                return ret
+        return None
 
     def activate(self) -> bool:
         return self.selectedObj.activate()
@@ -355,6 +652,9 @@ class DefaultToolChain(IToolChain):
     def extraEnv(self, artifacts) -> T.Dict[str, str]:
         return self.selectedObj.extraEnv(artifacts)
 
+    def codegenFlags(self, artifacts) -> T.Tuple[T.List[str], T.List[str]]:
+        return self.selectedObj.codegenFlags(artifacts)
+
 
 
 TOOLCHAINS = {
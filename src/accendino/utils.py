@@ -1,5 +1,7 @@
 import os
+import re
 import pathlib
+import subprocess
 import typing as T
 from packaging.version import Version
 
@@ -212,6 +214,85 @@ def findInPATH(name: str) -> str:
             return fpath
     return None
 
+class PathIndex:
+    ''' an index of the file names in the directories of a PATH, built with one listing of each directory '''
+
+    def __init__(self, path: str) -> None:
+        '''
+            @param path: value of the PATH variable
+        '''
+        self.path = path
+        self.entries = {}
+        for p in path.split(os.pathsep):
+            try:
+                with os.scandir(p or '.') as it:
+                    for entry in it:
+                        dirs = self.entries.setdefault(self._key(entry.name), [])
+                        if p not in dirs:
+                            dirs.append(p)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _key(name: str) -> str:
+        # file names are case insensitive on windows
+        return name.lower() if accendinoPlatform.isWindows else name
+
+    def find(self, name: str) -> str:
+        ''' returns the path of the first executable file with that name, like findInPATH() '''
+        if accendinoPlatform.isWindows:
+            if not name.endswith(".exe"):
+                name += ".exe"
+
+        for p in self.entries.get(self._key(name), []):
+            fpath = os.path.join(p, name)
+            if os.path.isfile(fpath) and os.access(fpath, os.X_OK):
+                return fpath
+        return None
+
+_pathIndex = None
+
+def getPathIndex() -> PathIndex:
+    ''' returns the index of the current PATH, it's rebuilt when PATH changes '''
+    global _pathIndex
+    path = os.environ.get('PATH', '')
+    if _pathIndex is None or _pathIndex.path != path:
+        _pathIndex = PathIndex(path)
+    return _pathIndex
+
+def resetPathIndex() -> None:
+    ''' drops the index of the PATH, for instance after some packages were installed '''
+    global _pathIndex
+    _pathIndex = None
+
+def getUserCacheDir(subDir: str) -> str:
+    ''' returns a directory in the user cache directory (XDG_CACHE_HOME or ~/.cache) '''
+    cacheHome = os.environ.get('XDG_CACHE_HOME', None) or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cacheHome, 'accendino', subDir)
+
+_toolVersions = {}
+
+def getToolVersion(name: str) -> Version:
+    ''' returns the version of a tool by parsing the first line of `<name> --version`, results are cached
+        @param name: name of the tool
+        @return the version or None if the tool is not available
+    '''
+    if name in _toolVersions:
+        return _toolVersions[name]
+
+    ret = None
+    try:
+        proc = subprocess.run([name, '--version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf8')
+        if proc.returncode == 0:
+            m = re.search(r'(\d+\.\d+(\.\d+)?)', proc.stdout.split('\n', 1)[0])
+            if m:
+                ret = Version(m.group(1))
+    except OSError:
+        pass
+
+    _toolVersions[name] = ret
+    return ret
+
 def escapeForPowershell(s):
     ret = ''
     haveSpace = False
@@ -0,0 +1,46 @@
+'''
+    benchmark of the artifact registry with synthetic artifacts, run it with:
+        PYTHONPATH=src python tests/benchRegistry.py
+'''
+import random
+import time
+
+from accendino.builditems import DepsBuildArtifact
+from accendino.registry import ArtifactRegistry
+
+
+def syntheticArtifacts(count: int, maxDeps: int = 5, seed: int = 42):
+    ''' generates artifacts depending on random previous ones, half of the deps go through a provided name '''
+    rnd = random.Random(seed)
+    ret = []
+    for i in range(count):
+        deps = []
+        if i:
+            for d in rnd.sample(range(i), min(i, rnd.randint(0, maxDeps))):
+                deps.append(f'a{d}-artifact' if d % 2 else f'a{d}')
+        ret.append(DepsBuildArtifact(f'a{i}', deps, provides=[f'a{i}-artifact']))
+    return ret
+
+
+def bench(count: int) -> None:
+    artifacts = syntheticArtifacts(count)
+
+    start = time.perf_counter()
+    registry = ArtifactRegistry(artifacts)
+    indexed = time.perf_counter()
+    plan = registry.buildPlan([f'a{i}' for i in range(count - 10, count)])
+    planned = time.perf_counter()
+    for item in artifacts:
+        for dep in item.deps:
+            registry.get(dep)
+    looked = time.perf_counter()
+
+    edges = sum(len(item.deps) for item in artifacts)
+    print(f'{count:6d} artifacts {edges:6d} deps: index {(indexed - start) * 1000:7.2f}ms, '
+          f'plan of {len(plan):5d} items {(planned - indexed) * 1000:7.2f}ms, '
+          f'lookup of all deps {(looked - planned) * 1000:7.2f}ms')
+
+
+if __name__ == "__main__":
+    for n in (100, 1000, 5000, 10000):
+        bench(n)
@@ -0,0 +1,141 @@
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from accendino.bincache import BinaryCache, CACHE_METADATA_FILE, computeKey
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+        self.cache = BinaryCache(os.path.join(self.tmpDir, 'cache'))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def writeFile(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+
+    def writeEntry(self, key, members, prefix='/opt/other'):
+        ''' writes a cache entry by hand, members are (TarInfo, content) '''
+        path = os.path.join(self.cache.location, self.cache._entryName(key))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tarfile.open(path, 'w:gz') as tar:
+            meta = json.dumps({'key': key, 'prefix': prefix, 'files': [m.name for m, _ in members],
+                               'relocatable': True}).encode('utf8')
+            info = tarfile.TarInfo(CACHE_METADATA_FILE)
+            info.size = len(meta)
+            tar.addfile(info, io.BytesIO(meta))
+
+            for info, content in members:
+                if content is not None:
+                    info.size = len(content)
+                tar.addfile(info, io.BytesIO(content) if content is not None else None)
+
+
+    def testComputeKey(self):
+        reference = computeKey({'name': 'zlib', 'deps': {'a': '1', 'b': '2'}})
+        self.assertEqual(computeKey({'deps': {'b': '2', 'a': '1'}, 'name': 'zlib'}), reference)
+        self.assertNotEqual(computeKey({'name': 'zlib', 'deps': {'a': '1', 'b': '3'}}), reference)
+        self.assertEqual(len(reference), 64)
+
+
+    def testRoundTrip(self):
+        prefix1 = os.path.join(self.tmpDir, 'prefix1')
+        prefix2 = os.path.join(self.tmpDir, 'prefix2')
+        self.writeFile(os.path.join(prefix1, 'lib', 'pkgconfig', 'foo.pc'), f'prefix={prefix1}\n'.encode('utf8'))
+        self.writeFile(os.path.join(prefix1, 'lib', 'libfoo.so.1'), b'\x7fELF\0binary')
+        os.symlink('libfoo.so.1', os.path.join(prefix1, 'lib', 'libfoo.so'))
+        files = ['lib/pkgconfig/foo.pc', 'lib/libfoo.so.1', 'lib/libfoo.so']
+
+        self.assertIsNone(self.cache.restore('a' * 64, prefix2))
+        self.assertTrue(self.cache.store('a' * 64, prefix1, files, {'name': 'foo'}))
+
+        self.assertEqual(self.cache.restore('a' * 64, prefix2), files)
+        with open(os.path.join(prefix2, 'lib', 'pkgconfig', 'foo.pc'), 'rt', encoding='utf8') as f:
+            self.assertEqual(f.read(), f'prefix={prefix2}\n')
+        self.assertEqual(os.readlink(os.path.join(prefix2, 'lib', 'libfoo.so')), 'libfoo.so.1')
+
+        # binaries referencing their prefix (like an RPATH) can't be relocated
+        self.writeFile(os.path.join(prefix1, 'bin', 'foo'), b'\x7fELF\0' + os.path.join(prefix1, 'lib').encode('utf8'))
+        self.assertTrue(self.cache.store('b' * 64, prefix1, files + ['bin/foo'], {'name': 'foo'}))
+        self.assertIsNone(self.cache.restore('b' * 64, os.path.join(self.tmpDir, 'prefix3')))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpDir, 'prefix3')))
+
+        shutil.rmtree(prefix1)
+        self.assertEqual(self.cache.restore('b' * 64, prefix1), files + ['bin/foo'])
+        self.assertTrue(os.path.exists(os.path.join(prefix1, 'bin', 'foo')))
+
+
+    def testRejectEscapes(self):
+        prefix = os.path.join(self.tmpDir, 'prefix')
+        outside = os.path.join(self.tmpDir, 'outside')
+        os.makedirs(prefix)
+        os.makedirs(outside)
+
+        def sym(name, target):
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            return (info, None)
+
+        def reg(name):
+            return (tarfile.TarInfo(name), b'owned\n')
+
+        def hard(name, target):
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.LNKTYPE
+            info.linkname = target
+            return (info, None)
+
+        entries = {
+            'dotdot': [reg('../outside/file')],
+            'absolute': [reg(os.path.join(outside, 'file'))],
+            'symlink': [sym('lib/escape', outside)],
+            'relativeSymlink': [sym('lib/escape', '../../outside')],
+            'chained': [sym('lib/a', '.'), sym('lib/b', 'a/a/a/../../outside'), reg('lib/b/file')],
+            'throughSymlink': [sym('link', '.'), sym('link/escape', '../outside'), reg('link/escape/file')],
+            'hardlink': [hard('lib/passwd', '../outside/file')],
+        }
+        for i, (name, members) in enumerate(entries.items()):
+            with self.subTest(name):
+                key = f'{i:02d}' * 32
+                self.writeEntry(key, members)
+                self.assertIsNone(self.cache.restore(key, prefix))
+                self.assertEqual(os.listdir(outside), [])
+                # nothing is written in the prefix, even the members before the invalid one
+                self.assertEqual(os.listdir(prefix), [])
+        self.assertEqual(sorted(os.listdir(self.tmpDir)), ['cache', 'outside', 'prefix'])
+
+
+    def testTruncatedEntry(self):
+        prefix = os.path.join(self.tmpDir, 'prefix')
+        self.writeFile(os.path.join(prefix, 'include', 'foo.h'), b'int foo(void);\n')
+
+        key = 'c' * 64
+        self.writeEntry(key, [(tarfile.TarInfo('include/foo.h'), b'int foo(int);\n'),
+                              (tarfile.TarInfo('lib/libfoo.a'), b'!<arch>\n' * 4096)])
+        path = os.path.join(self.cache.location, self.cache._entryName(key))
+        with open(path, 'rb') as f:
+            content = f.read()
+        with open(path, 'wb') as f:
+            f.write(content[:len(content) - 64])
+
+        self.assertIsNone(self.cache.restore(key, prefix))
+        with open(os.path.join(prefix, 'include', 'foo.h'), 'rb') as f:
+            self.assertEqual(f.read(), b'int foo(void);\n')
+        self.assertFalse(os.path.exists(os.path.join(prefix, 'lib')))
+
+
+if __name__ == "__main__":
+    unittest.main()
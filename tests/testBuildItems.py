@@ -0,0 +1,321 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import types
+import unittest
+
+from accendino.bincache import BinaryCache
+from accendino.builditems import AutogenBuildArtifact, BuildArtifact, BuildStepDump, CMakeBuildArtifact, \
+    MesonBuildArtifact, ResolvedCommand, autotoolsFingerprint
+from accendino.manifest import InstallManifest
+from accendino.sources import Source
+from accendino.utils import NativePath, RunInShell
+
+
+class FakeJobServer:
+    def __init__(self, tools):
+        self.tools = tools
+
+    def handles(self, tool):
+        return tool in self.tools
+
+
+class FixedSource(Source):
+    def revision(self, _target_dir):
+        return 'r1'
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def testCMakeJobs(self):
+        config = types.SimpleNamespace(maxJobs=8, artifactJobs=1, jobServer=None, distribId='Debian')
+        item = CMakeBuildArtifact('item', [], None)
+        self.assertEqual(item._jobsArgs(config, 'Ninja'), ['--parallel', '8'])
+
+        config.jobServer = FakeJobServer(['make'])
+        self.assertEqual(item._jobsArgs(config, 'Unix Makefiles'), [])
+        self.assertEqual(item._jobsArgs(config, 'Ninja'), ['--parallel', '8'])
+
+        # ninja can't join the jobserver, the jobs are split between the concurrent artifacts
+        config.artifactJobs = 3
+        self.assertEqual(item._jobsArgs(config, 'Ninja'), ['--parallel', '2'])
+
+        item = CMakeBuildArtifact('item', [], None, parallelJobs=False)
+        self.assertEqual(item._jobsArgs(config, 'Unix Makefiles'), ['--parallel', '1'])
+
+        self.assertEqual(CMakeBuildArtifact('item', [], None, generator='Ninja').selectGenerator(config), 'Ninja')
+        self.assertIsNone(CMakeBuildArtifact('item', [], None, cmakeOpts=['-G', 'Ninja']).selectGenerator(config))
+        config.distribId = 'Windows'
+        self.assertIsNone(CMakeBuildArtifact('item', [], None).selectGenerator(config))
+
+
+    def testCMakeGeneratorMigration(self):
+        item = CMakeBuildArtifact('item', [], None)
+        item.buildDir = pathlib.Path(self.tmpDir)
+        os.makedirs(item.buildDir / 'CMakeFiles')
+        for f in ('CMakeCache.txt', 'Makefile', 'hello'):
+            with open(item.buildDir / f, 'wt', encoding='utf8') as fout:
+                fout.write('CMAKE_GENERATOR:INTERNAL=Unix Makefiles\n')
+
+        item.migrateGenerator('Unix Makefiles')
+        item.migrateGenerator(None)
+        self.assertEqual(sorted(os.listdir(item.buildDir)), ['CMakeCache.txt', 'CMakeFiles', 'Makefile', 'hello'])
+
+        item.migrateGenerator('Ninja')
+        self.assertEqual(os.listdir(item.buildDir), ['hello'])
+
+
+    def testAutotoolsFingerprint(self):
+        def write(name, content):
+            path = os.path.join(self.tmpDir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wt', encoding='utf8') as f:
+                f.write(content)
+
+        write('configure.ac', 'AC_INIT([test], [1.0])\n')
+        write('src/Makefile.am', 'bin_PROGRAMS = test\n')
+        write('m4/custom.m4', 'AC_DEFUN([CUSTOM], [])\n')
+        reference = autotoolsFingerprint(self.tmpDir, ['autogen.sh'])
+
+        # generated files are not inputs
+        write('aclocal.m4', 'generated\n')
+        write('src/Makefile.in', 'generated\n')
+        write('.git/config.m4', 'not a source\n')
+        self.assertEqual(autotoolsFingerprint(self.tmpDir, ['autogen.sh']), reference)
+        self.assertNotEqual(autotoolsFingerprint(self.tmpDir, ['autogen.sh', '--with-x']), reference)
+
+        write('src/Makefile.am', 'bin_PROGRAMS = test2\n')
+        self.assertNotEqual(autotoolsFingerprint(self.tmpDir, ['autogen.sh']), reference)
+        write('src/Makefile.am', 'bin_PROGRAMS = test\n')
+        self.assertEqual(autotoolsFingerprint(self.tmpDir, ['autogen.sh']), reference)
+
+        # included automake fragments
+        write('src/sources.am', 'test_SOURCES = test.c\n')
+        self.assertNotEqual(autotoolsFingerprint(self.tmpDir, ['autogen.sh']), reference)
+        reference = autotoolsFingerprint(self.tmpDir, ['autogen.sh'])
+        write('build/flags.mk', 'AM_CFLAGS = -Wall\n')
+        self.assertNotEqual(autotoolsFingerprint(self.tmpDir, ['autogen.sh']), reference)
+        reference = autotoolsFingerprint(self.tmpDir, ['autogen.sh'])
+
+        # the script that is run, given as an absolute path too
+        write('autogen.sh', '#!/bin/sh\nautoreconf -fi\n')
+        withScript = autotoolsFingerprint(self.tmpDir, ['autogen.sh'])
+        self.assertNotEqual(withScript, reference)
+        write('autogen.sh', '#!/bin/sh\nautopoint --force\nautoreconf -fi\n')
+        self.assertNotEqual(autotoolsFingerprint(self.tmpDir, ['autogen.sh']), withScript)
+        scriptPath = os.path.join(self.tmpDir, 'autogen.sh')
+        withScript = autotoolsFingerprint(self.tmpDir, [scriptPath])
+        write('autogen.sh', '#!/bin/sh\nlibtoolize --copy\nautoreconf -fi\n')
+        self.assertNotEqual(autotoolsFingerprint(self.tmpDir, [scriptPath]), withScript)
+
+
+    def testBuildStepDump(self):
+        item = BuildArtifact('item', [], None)
+        item.fingerprintEnvVars = ['MY_OPTION']
+        cmds = (ResolvedCommand(('./configure', '--prefix=/usr'), '/build', 'configuring'),)
+
+        def dump(**extra):
+            env = {'PATH': '/usr/bin', 'TERM': 'xterm', 'SSH_AUTH_SOCK': '/tmp/ssh-1', 'CC': 'gcc', 'OTHER': '1'}
+            env.update(extra)
+            return BuildStepDump(env, item.fingerprintEnvKeys(env, ['OTHER']), cmds)
+
+        reference = dump()
+        self.assertEqual(dump(TERM='dumb', SSH_AUTH_SOCK='/tmp/ssh-2', CI_JOB_ID='42'), reference)
+        self.assertNotEqual(dump(CFLAGS='-O3'), reference)
+        self.assertNotEqual(dump(PKG_CONFIG_SYSROOT_DIR='/sysroot'), reference)
+        self.assertNotEqual(dump(MY_OPTION='1'), reference)
+        self.assertEqual(dump(OTHER='2').changedVars(reference), ['OTHER'])
+
+        path = os.path.join(self.tmpDir, 'accendino.prepared')
+        reference.save(path)
+        self.assertEqual(BuildStepDump.load(path), reference)
+
+        # dumps of the previous versions were pickled
+        with open(path, 'wb') as f:
+            f.write(b'\x80\x04\x95')
+        self.assertIsNone(BuildStepDump.load(path))
+        self.assertIsNone(BuildStepDump.load(os.path.join(self.tmpDir, 'missing')))
+
+
+    def testResolveCommands(self):
+        config = types.SimpleNamespace(libdir='lib', prefix=pathlib.PurePosixPath('/opt/prefix'))
+        item = BuildArtifact('item', [], None)
+        item.sourceDir = pathlib.PurePosixPath('/work/sources/item')
+        item.buildDir = pathlib.PurePosixPath('/work/build/item')
+        item.updateExpansions(config)
+
+        commands = item.resolveCommands([
+            (['{srcdir}/configure', '--prefix={prefix}', NativePath('{prefix}', '{libdir}', prefix='--libdir=')],
+             '{builddir}', 'configuring'),
+            (RunInShell(['make', '-C', '{builddir_posix}']), '{builddir_posix}', 'building'),
+        ], config)
+
+        self.assertEqual(commands, (
+            ResolvedCommand(('/work/sources/item/configure', '--prefix=/opt/prefix', '--libdir=/opt/prefix/lib'),
+                            str(pathlib.Path('/work/build/item')), 'configuring'),
+            ResolvedCommand(tuple(RunInShell(['make', '-C', '/work/build/item']).expand()),
+                            str(pathlib.Path('/work/build/item')), 'building'),
+        ))
+        self.assertEqual(len({commands, item.resolveCommands([], config) + commands}), 1)
+
+        item.buildDir = pathlib.PurePosixPath('/work/build2/item')
+        item.updateExpansions(config)
+        self.assertEqual(item.resolveCommands([(['make'], '{builddir}', 'building')], config)[0].cwd,
+                         str(pathlib.Path('/work/build2/item')))
+
+
+    def buildConfig(self, **kwargs):
+        ''' returns a configuration to prepare and build artifacts in the temporary directory '''
+        config = types.SimpleNamespace(
+            sourcesDir=pathlib.Path(self.tmpDir, 'sources'), buildsDir=pathlib.Path(self.tmpDir, 'build'),
+            prefix=pathlib.Path(self.tmpDir, 'prefix'), libdir='lib', targetDistrib='Debian', targetArch='x86_64',
+            distribId='Debian', distribVersion='12', buildType='release', crossCompilation=False,
+            toolchainObj=types.SimpleNamespace(description='gcc'), compilerCache=None, jobServer=None, stateDb=None,
+            binaryCache=None, depsRebuildMode='incremental', earlyCutoff=True, debug=False, buildWithPowershell=False)
+        for k, v in kwargs.items():
+            setattr(config, k, v)
+        return config
+
+
+    def testInstallManifest(self):
+        config = self.buildConfig()
+        os.makedirs(config.prefix / 'share')
+        with open(config.prefix / 'share' / 'other', 'wt', encoding='utf8') as f:
+            f.write('installed by something else')
+
+        def build(name, files, useDestdir=True):
+            root = '$DESTDIR{prefix}' if useDestdir else '{prefix}'
+            install = ' && '.join(f'echo {f} > {root}/share/{f}' for f in files)
+            item = BuildArtifact(name, [], None, skipToolchainEnv=True,
+                                 build_cmds=[(['sh', '-c', f'mkdir -p {root}/share && {install}'], '{builddir}', 'installing')])
+            self.assertTrue(item.init(config))
+            self.assertTrue(item.build(config))
+            return item
+
+        item = build('staged', ['a', 'b'])
+        self.assertEqual(InstallManifest.load(item.manifestFile).files(), ['share/a', 'share/b'])
+        self.assertFalse(os.path.exists(item.stageDir))
+
+        # b is not installed anymore
+        os.remove(item.builtFile)
+        item = build('staged', ['a'])
+        self.assertEqual(InstallManifest.load(item.manifestFile).files(), ['share/a'])
+        self.assertFalse(os.path.exists(config.prefix / 'share' / 'b'))
+
+        # DESTDIR ignored, the files are found in the prefix
+        other = build('nodestdir', ['a', 'c'], useDestdir=False)
+        self.assertEqual(InstallManifest.load(other.manifestFile).files(), ['share/a', 'share/c'])
+
+        # files of other artifacts are kept
+        self.assertTrue(other.uninstall(config))
+        self.assertEqual(sorted(os.listdir(config.prefix / 'share')), ['a', 'other'])
+        self.assertTrue(item.uninstall(config))
+        self.assertEqual(os.listdir(config.prefix / 'share'), ['other'])
+
+
+    def testRestoredArtifactIsPrepared(self):
+        counter = os.path.join(self.tmpDir, 'counter')
+        config = self.buildConfig(binaryCache=BinaryCache(os.path.join(self.tmpDir, 'cache')))
+
+        def run():
+            item = BuildArtifact('item', [], FixedSource(), skipToolchainEnv=True,
+                                 prepare_cmds=[(['sh', '-c', f'echo prepare >> {counter}'], '{builddir}', 'preparing')],
+                                 build_cmds=[(['sh', '-c', f'echo build >> {counter} && mkdir -p $DESTDIR{{prefix}}/share && '
+                                               'echo 1 > $DESTDIR{prefix}/share/item'], '{builddir}', 'building')])
+            self.assertTrue(item.init(config))
+            self.assertTrue(item.prepare(config))
+            self.assertTrue(item.build(config))
+
+        run()
+        shutil.rmtree(config.buildsDir)
+        shutil.rmtree(config.prefix)
+
+        # restored from the cache, then nothing to do
+        run()
+        self.assertTrue(os.path.exists(config.prefix / 'share' / 'item'))
+        run()
+        with open(counter, 'rt', encoding='utf8') as f:
+            self.assertEqual(f.read(), 'prepare\nbuild\n')
+
+        # the build directory of a restored artifact is configured when it has to be rebuilt
+        os.remove(config.buildsDir / 'Debian-gcc-x86_64-release' / 'item' / 'accendino.built')
+        config.binaryCache = None
+        run()
+        with open(counter, 'rt', encoding='utf8') as f:
+            self.assertEqual(f.read(), 'prepare\nbuild\nprepare\nbuild\n')
+
+
+    def testAutogen(self):
+        config = self.buildConfig(maxJobs=2, artifactJobs=1, configureCache=None)
+        counter = os.path.join(self.tmpDir, 'counter')
+        sourceDir = config.sourcesDir / 'item'
+        os.makedirs(sourceDir)
+        with open(sourceDir / 'configure.ac', 'wt', encoding='utf8') as f:
+            f.write('AC_INIT([item], [1.0])\n')
+        with open(sourceDir / 'autogen.sh', 'wt', encoding='utf8') as f:
+            f.write(f'#!/bin/sh\necho autogen >> {counter}\nprintf \'#!/bin/sh\\necho configure >> {counter}\\n\' > configure\n'
+                    'chmod +x configure\n')
+        os.chmod(sourceDir / 'autogen.sh', 0o755)
+
+        def prepare():
+            item = AutogenBuildArtifact('item', [], None)
+            item.skipToolchainEnv = True
+            self.assertTrue(item.init(config))
+            self.assertTrue(item.prepare(config))
+            with open(counter, 'rt', encoding='utf8') as f:
+                steps = f.read().split()
+            os.remove(counter)
+            return (item, steps)
+
+        (item, steps) = prepare()
+        self.assertEqual(steps, ['autogen', 'configure'])
+        self.assertTrue(os.path.exists(f'{sourceDir}.accendino-autogen'))
+        with open(item.buildDir / 'prepare.sh', 'rt', encoding='utf8') as f:
+            self.assertIn('autogen.sh', f.read())
+
+        # another build tree shares the sources, it only runs configure
+        config.buildType = 'debug'
+        self.assertEqual(prepare()[1], ['configure'])
+
+        with open(sourceDir / 'configure.ac', 'at', encoding='utf8') as f:
+            f.write('AC_OUTPUT\n')
+        self.assertEqual(prepare()[1], ['autogen', 'configure'])
+
+
+    def testCodegenFlags(self):
+        flags = {'compile': ['-gsplit-dwarf'], 'link': ['-fuse-ld=mold']}
+        toolchain = types.SimpleNamespace(description='gcc',
+                                          extraEnv=lambda _artifacts: {'CFLAGS': '-O2 -pipe', 'LDFLAGS': '-Wl,--as-needed'},
+                                          codegenFlags=lambda _artifacts: (flags['compile'], flags['link']))
+        config = self.buildConfig(toolchainObj=toolchain)
+
+        item = MesonBuildArtifact('item', [], None)
+        item.sourceDir = config.sourcesDir / 'item'
+        item.buildDir = config.buildsDir / 'item'
+        item.updateExpansions(config)
+        os.makedirs(item.buildDir)
+
+        # the flags of the toolchain environment are kept
+        options = item._codegenOptions(config, False)
+        self.assertEqual(options, {'c_args': '-O2 -pipe -gsplit-dwarf', 'c_link_args': '-Wl,--as-needed -fuse-ld=mold'})
+        item._saveCodegenOptions(options)
+
+        # unchanged options are not given again, the user may have changed them with meson configure
+        self.assertEqual(item._codegenOptions(config, True), {})
+
+        flags['link'] = []
+        self.assertEqual(item._codegenOptions(config, True), {'c_link_args': '-Wl,--as-needed'})
+        self.assertEqual(item._codegenOptions(config, False), {'c_args': '-O2 -pipe -gsplit-dwarf'})
+
+
+if __name__ == "__main__":
+    unittest.main()
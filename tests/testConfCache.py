@@ -0,0 +1,101 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+
+from accendino.confcache import ConfigureCache, readAutoconfCache, autoconfShareable, autoconfFlagsKey, readCMakeCache
+
+
+CONFIG_CACHE = '''# This file is a shell script that caches the results of configure
+ac_cv_env_CC_set=
+ac_cv_env_CFLAGS_value=${ac_cv_env_CFLAGS_value='-O2'}
+ac_cv_header_stdint_h=${ac_cv_header_stdint_h=yes}
+ac_cv_header_nonexistent_zz_h=${ac_cv_header_nonexistent_zz_h=no}
+ac_cv_path_install=${ac_cv_path_install='/usr/bin/install -c'}
+ac_cv_sizeof_long=${ac_cv_sizeof_long=8}
+ac_cv_prog_cc_c11=${ac_cv_prog_cc_c11=''}
+my_cv_custom_check=${my_cv_custom_check=yes}
+'''
+
+CMAKE_CACHE = '''# This is the CMakeCache file.
+CMAKE_GENERATOR:INTERNAL=Ninja
+HAVE_STDINT_H:INTERNAL=1
+HAVE_NONEXISTENT_ZZ_H:INTERNAL=
+HAVE_SIZEOF_LONG:INTERNAL=TRUE
+SIZEOF_LONG:INTERNAL=8
+HAVE_SIZEOF_SSIZE_T:INTERNAL=TRUE
+HAVE_OPENSSL:BOOL=ON
+'''
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpDir, name)
+        with open(path, 'wt', encoding='utf8') as f:
+            f.write(content)
+        return path
+
+
+    def testAutoconf(self):
+        entries = readAutoconfCache(self.write('config.cache', CONFIG_CACHE))
+        self.assertNotIn('ac_cv_env_CC_set', entries)
+
+        shared = sorted(k for k, v in entries.items() if autoconfShareable(k, v))
+        self.assertEqual(shared, ['ac_cv_header_stdint_h', 'ac_cv_path_install', 'ac_cv_sizeof_long'])
+        self.assertEqual(readAutoconfCache(os.path.join(self.tmpDir, 'missing')), {})
+
+
+    def testCMake(self):
+        # SIZEOF_SSIZE_T is missing so HAVE_SIZEOF_SSIZE_T can't be seeded
+        self.assertEqual(readCMakeCache(self.write('CMakeCache.txt', CMAKE_CACHE)), {
+            'HAVE_STDINT_H': '1',
+            'HAVE_SIZEOF_LONG': 'TRUE',
+            'SIZEOF_LONG': '8',
+        })
+
+
+    def testAutoconfFlagsKey(self):
+        reference = autoconfFlagsKey({'CFLAGS': '-O2', 'PATH': '/usr/bin'}, ['--prefix=/usr'])
+        self.assertEqual(autoconfFlagsKey({'CFLAGS': '-O2', 'PATH': '/bin'}, ['--prefix=/opt', '--enable-foo']), reference)
+        self.assertEqual(autoconfFlagsKey({}, ['CFLAGS=-O2']), reference)
+        self.assertNotEqual(autoconfFlagsKey({'CFLAGS': '-O2'}, ['LIBS=-lm']), reference)
+        self.assertNotEqual(autoconfFlagsKey({'CFLAGS': '-O2', 'LDFLAGS': '-L/opt/lib'}, []), reference)
+
+
+    def testSharing(self):
+        cache = ConfigureCache(None)
+        cache.cacheDirs['tree'] = pathlib.Path(self.tmpDir, 'cache')
+
+        cache.collectAutoconf('tree', 'key1', self.write('config.cache', CONFIG_CACHE))
+        seeded = os.path.join(self.tmpDir, 'seeded.cache')
+        cache.seedAutoconf('tree', 'key1', seeded)
+        self.assertIn('ac_cv_header_stdint_h', readAutoconfCache(seeded))
+
+        # configured with other flags
+        os.remove(seeded)
+        cache.seedAutoconf('tree', 'key2', seeded)
+        self.assertEqual(readAutoconfCache(seeded), {})
+
+        cache.collectCMake('tree', 'zlib', self.write('CMakeCache.txt', CMAKE_CACHE))
+        seedFile = os.path.join(self.tmpDir, 'seed.cmake')
+        cache.seedCMake('tree', 'zlib', seedFile)
+        with open(seedFile, 'rt', encoding='utf8') as f:
+            self.assertIn('set(HAVE_STDINT_H "1" CACHE INTERNAL "")', f.read())
+
+        cache.seedCMake('tree', 'freerdp', seedFile)
+        with open(seedFile, 'rt', encoding='utf8') as f:
+            self.assertNotIn('HAVE_', f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
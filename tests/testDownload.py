@@ -0,0 +1,142 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import http.server
+
+from accendino.download import DownloadCache
+
+
+CONTENT = bytes(range(256)) * 4096
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    ''' serves CONTENT on any path, with support of single ranges '''
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self):
+        start, end = 0, len(CONTENT) - 1
+        rangeHeader = self.headers.get('Range', None)
+        if rangeHeader:
+            start, end = [int(v) for v in rangeHeader[len('bytes='):].split('-')]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(CONTENT)}')
+        else:
+            self.send_response(200)
+
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        return start, end
+
+    def _redirect(self) -> bool:
+        if not self.path.startswith('/redirect/'):
+            return False
+        self.send_response(302)
+        self.send_header('Location', self.path[len('/redirect'):])
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return True
+
+    def do_HEAD(self):
+        Handler.requests.append(('HEAD', self.path, None))
+        if self.path.startswith('/nohead/'):
+            self.send_error(405)
+            return
+        if not self._redirect():
+            self._headers()
+
+    def do_GET(self):
+        Handler.requests.append(('GET', self.path, self.headers.get('Range', None)))
+        if self._redirect():
+            return
+        start, end = self._headers()
+        self.wfile.write(CONTENT[start:end + 1])
+
+
+class Test(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.baseUrl = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+        Handler.requests = []
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def testFetchAndCache(self):
+        cache = DownloadCache(self.tmpDir, segments=1)
+        url = f'{self.baseUrl}/archive.tar.gz'
+        sha256 = hashlib.sha256(CONTENT).hexdigest()
+
+        path = cache.fetch(url, 'archive.tar.gz', sha256)
+        self.assertIsNotNone(path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(len(Handler.requests), 1)
+
+        # second fetch is served by the cache
+        self.assertEqual(cache.fetch(url, 'archive.tar.gz', sha256), path)
+        self.assertEqual(len(Handler.requests), 1)
+
+
+    def testChecksumMismatch(self):
+        cache = DownloadCache(self.tmpDir, segments=1)
+        url = f'{self.baseUrl}/bad.tar.gz'
+
+        self.assertIsNone(cache.fetch(url, 'bad.tar.gz', '0' * 64))
+        self.assertFalse(os.path.exists(cache.entryPath(url, 'bad.tar.gz')))
+        self.assertEqual([f for f in os.listdir(os.path.dirname(cache.entryPath(url, 'bad.tar.gz')))], [])
+
+
+    def testRangedDownload(self):
+        cache = DownloadCache(self.tmpDir, segments=3, rangedMinSize=1024)
+        url = f'{self.baseUrl}/big.tar.gz'
+
+        path = cache.fetch(url, 'big.tar.gz', hashlib.sha256(CONTENT).hexdigest())
+        self.assertIsNotNone(path)
+        ranges = [r for (method, _path, r) in Handler.requests if method == 'GET']
+        self.assertEqual(len(ranges), 3)
+        self.assertTrue(all(ranges))
+
+
+    def testHeadRejected(self):
+        cache = DownloadCache(self.tmpDir, segments=3, rangedMinSize=1024)
+        url = f'{self.baseUrl}/nohead/big.tar.gz'
+
+        # falls back to a single request
+        path = cache.fetch(url, 'big.tar.gz', hashlib.sha256(CONTENT).hexdigest())
+        self.assertIsNotNone(path)
+        self.assertEqual(Handler.requests, [('HEAD', '/nohead/big.tar.gz', None), ('GET', '/nohead/big.tar.gz', None)])
+
+
+    def testRedirectedHead(self):
+        cache = DownloadCache(self.tmpDir, segments=3, rangedMinSize=1024)
+        url = f'{self.baseUrl}/redirect/big.tar.gz'
+
+        self.assertIsNotNone(cache.fetch(url, 'big.tar.gz', hashlib.sha256(CONTENT).hexdigest()))
+        self.assertEqual(Handler.requests[0:2], [('HEAD', '/redirect/big.tar.gz', None), ('HEAD', '/big.tar.gz', None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from accendino.extract import extractTar, extractZip
+
+
+def makeTar(members, mode='w:gz'):
+    ''' builds a tar archive in memory from (name, content or None for a dir, symlink target) tuples '''
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar:
+        for name, content, link in members:
+            info = tarfile.TarInfo(name)
+            if link is not None:
+                info.type = tarfile.SYMTYPE
+                info.linkname = link
+                tar.addfile(info)
+            elif content is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            else:
+                info.size = len(content)
+                info.mode = 0o755
+                tar.addfile(info, io.BytesIO(content))
+    buf.seek(0)
+    return buf
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def testTarStripDepth(self):
+        for mode in ('w:gz', 'w:xz', 'w'):
+            target = os.path.join(self.tmpDir, mode.replace(':', '_'))
+            archive = makeTar([
+                ('pkg-1.0', None, None),
+                ('pkg-1.0/configure', b'#!/bin/sh\n', None),
+                ('pkg-1.0/src/main.c', b'int main() {}\n', None),
+                ('pkg-1.0/link.c', None, 'src/main.c'),
+            ], mode)
+
+            self.assertTrue(extractTar(archive, target, 1))
+            self.assertTrue(os.path.isfile(os.path.join(target, 'src', 'main.c')))
+            self.assertTrue(os.access(os.path.join(target, 'configure'), os.X_OK))
+            self.assertEqual(os.readlink(os.path.join(target, 'link.c')), 'src/main.c')
+
+
+    def testTarTraversal(self):
+        target = os.path.join(self.tmpDir, 'target')
+        for members in (
+                [('pkg/../../evil', b'x', None)],
+                [('/tmp/evil', b'x', None)],
+                [('pkg/evil', None, '../../../etc/passwd')],
+                [('pkg/evil', None, '/etc/passwd')],
+            ):
+            self.assertFalse(extractTar(makeTar(members), target, 1))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpDir, 'evil')))
+
+
+    def testZip(self):
+        path = os.path.join(self.tmpDir, 'pkg.zip')
+        with zipfile.ZipFile(path, 'w') as z:
+            info = zipfile.ZipInfo('pkg-1.0/configure')
+            info.external_attr = 0o100755 << 16
+            z.writestr(info, '#!/bin/sh\n')
+            z.writestr('pkg-1.0/src/main.c', 'int main() {}\n')
+
+        target = os.path.join(self.tmpDir, 'target')
+        self.assertTrue(extractZip(path, target, 1))
+        self.assertTrue(os.path.isfile(os.path.join(target, 'src', 'main.c')))
+        self.assertTrue(os.access(os.path.join(target, 'configure'), os.X_OK))
+
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('../evil', 'x')
+        self.assertFalse(extractZip(path, target, 0))
+
+
+    def addZipSymlink(self, z, name, target):
+        info = zipfile.ZipInfo(name)
+        info.external_attr = 0o120777 << 16
+        z.writestr(info, target)
+
+
+    def testChainedSymlinks(self):
+        # each link is inside the target when checked alone, but x/y/z resolves to the parent of the target
+        path = os.path.join(self.tmpDir, 'chain.zip')
+        with zipfile.ZipFile(path, 'w') as z:
+            self.addZipSymlink(z, 'x/y', '..')
+            self.addZipSymlink(z, 'x/y/z', '..')
+            z.writestr('x/y/z/evil.txt', 'x')
+
+        target = os.path.join(self.tmpDir, 'out')
+        self.assertFalse(extractZip(path, target, 0))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpDir, 'evil.txt')))
+
+        target = os.path.join(self.tmpDir, 'outtar')
+        self.assertFalse(extractTar(makeTar([('x/y', None, '..'), ('x/y/z', None, '..'), ('x/y/z/evil.txt', b'x', None)]),
+                                    target, 0))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpDir, 'evil.txt')))
+
+
+    def testWriteThroughSymlink(self):
+        outside = os.path.join(self.tmpDir, 'outside')
+        os.makedirs(outside)
+        target = os.path.join(self.tmpDir, 'target')
+        os.makedirs(target)
+        os.symlink(os.path.join(outside, 'victim'), os.path.join(target, 'file'))
+
+        # an existing symlink is replaced, not written through
+        self.assertTrue(extractTar(makeTar([('file', b'x', None)]), target, 0))
+        self.assertFalse(os.path.exists(os.path.join(outside, 'victim')))
+        self.assertFalse(os.path.islink(os.path.join(target, 'file')))
+
+
+if __name__ == "__main__":
+    unittest.main()
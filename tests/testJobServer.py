@@ -0,0 +1,79 @@
+import os
+import threading
+import types
+import unittest
+import unittest.mock
+
+from packaging.version import Version
+
+from accendino.jobserver import JobServer, jobsPerArtifact
+
+
+def toolVersions(**versions):
+    ''' replaces the detection of the versions of the tools '''
+    def getToolVersion(name):
+        v = versions.get(name, None)
+        return Version(v) if v else None
+    return unittest.mock.patch('accendino.jobserver.getToolVersion', getToolVersion)
+
+
+class Test(unittest.TestCase):
+
+    def testTokens(self):
+        for makeVersion in ('4.3', '4.4'):
+            with toolVersions(make=makeVersion):
+                server = JobServer(2)
+            self.addCleanup(server.close)
+            self.assertEqual(server.useFifo, makeVersion == '4.4')
+
+            env = server.clientEnv({'PATH': '/usr/bin'})
+            self.assertTrue(env['MAKEFLAGS'].startswith(' -j2 '))
+            self.assertIn('--jobserver-auth=', env['MAKEFLAGS'])
+            self.assertEqual(len(server.passFds()), 0 if server.useFifo else 2)
+
+            server.acquire()
+            with server.token():
+                # all tokens are taken, a third client waits
+                waiter = threading.Thread(target=server.acquire)
+                waiter.start()
+                waiter.join(0.2)
+                self.assertTrue(waiter.is_alive())
+
+            # released when leaving the context
+            waiter.join(5)
+            self.assertFalse(waiter.is_alive())
+
+            # the tokens of the first acquire() and of the waiter
+            server.release()
+            server.release()
+
+            with self.assertRaises(RuntimeError):
+                with server.token():
+                    raise RuntimeError('build error')
+            self.assertEqual(os.read(server.readFd, 10), b'++')
+
+
+    def testHandles(self):
+        cases = [
+            ({'make': '4.4', 'ninja': '1.13.0'}, {'make': True, 'ninja': True, 'meson': True, 'nmake': False}),
+            ({'make': '4.4', 'ninja': '1.12.1'}, {'make': True, 'ninja': False, 'meson': False}),
+            # ninja only understands the fifo form
+            ({'make': '4.3', 'ninja': '1.13.0'}, {'make': True, 'ninja': False, 'meson': False}),
+            ({'make': '4.4'}, {'ninja': False}),
+        ]
+        for versions, expected in cases:
+            with toolVersions(**versions):
+                server = JobServer(1)
+                self.addCleanup(server.close)
+                for tool, handled in expected.items():
+                    self.assertEqual(server.handles(tool), handled, f'{tool} with {versions}')
+
+
+    def testJobsPerArtifact(self):
+        self.assertEqual(jobsPerArtifact(types.SimpleNamespace(maxJobs=8, artifactJobs=1)), 8)
+        self.assertEqual(jobsPerArtifact(types.SimpleNamespace(maxJobs=8, artifactJobs=3)), 2)
+        self.assertEqual(jobsPerArtifact(types.SimpleNamespace(maxJobs=2, artifactJobs=4)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
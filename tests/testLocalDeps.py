@@ -0,0 +1,177 @@
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+from accendino.localdeps import readDpkgStatus, readPacmanLocalDb, PackageDbCache, DpkgManager, PackageManager, \
+    PackageManagerBase
+from accendino.utils import PathIndex
+
+
+DPKG_STATUS = '''Package: zlib1g
+Status: install ok installed
+Priority: required
+Architecture: amd64
+Multi-Arch: same
+Version: 1:1.2.13.dfsg-1
+Description: compression library - runtime
+ zlib is a library implementing the deflate compression method found
+ in gzip and PKZIP.
+
+Package: libssl-dev
+Status: deinstall ok config-files
+Architecture: amd64
+Version: 3.0.11-1~deb12u2
+
+Package: cmake
+Status: hold ok installed
+Architecture: amd64
+Version: 3.25.1-1
+
+Package: git
+Status: install ok installed
+Architecture: amd64
+Version: 1:2.39.2-1.1
+'''
+
+
+class FakeManager(PackageManagerBase):
+    ''' a sub package manager that takes some time to list its packages '''
+    created = []
+    loading = 0
+    maxLoading = 0
+    lock = threading.Lock()
+
+    def __init__(self, name, packages, canInstall=True):
+        PackageManagerBase.__init__(self, name)
+        self.canInstall = canInstall
+        self.installed = []
+
+        with FakeManager.lock:
+            FakeManager.created.append(name)
+            FakeManager.loading += 1
+            FakeManager.maxLoading = max(FakeManager.maxLoading, FakeManager.loading)
+        time.sleep(0.2)
+        with FakeManager.lock:
+            FakeManager.loading -= 1
+
+        self.allPackages = {p: '1.0' for p in packages}
+
+    def installPackages(self, packages):
+        self.installed += packages
+        return True
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+        self.statusPath = os.path.join(self.tmpDir, 'status')
+        with open(self.statusPath, 'wt', encoding='utf8') as f:
+            f.write(DPKG_STATUS)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def testDpkgStatus(self):
+        # like dpkg -l, only wanted and installed packages are kept
+        self.assertEqual(readDpkgStatus(self.statusPath), {
+            'zlib1g': '1:1.2.13.dfsg-1',
+            'git': '1:2.39.2-1.1',
+        })
+
+
+    def testPacmanLocalDb(self):
+        localDb = os.path.join(self.tmpDir, 'local')
+        for d in ('zlib-1:1.3.1-2', 'python-pip-24.0-2', 'git-2.45.2-1'):
+            os.makedirs(os.path.join(localDb, d))
+        with open(os.path.join(localDb, 'ALPM_DB_VERSION'), 'wt', encoding='utf8') as f:
+            f.write('9\n')
+
+        self.assertEqual(readPacmanLocalDb(localDb), {
+            'zlib': '1:1.3.1-2',
+            'python-pip': '24.0-2',
+            'git': '2.45.2-1',
+        })
+
+
+    def testCache(self):
+        cache = PackageDbCache(os.path.join(self.tmpDir, 'cache'))
+        reads = []
+        def reader():
+            reads.append(1)
+            return readDpkgStatus(self.statusPath)
+
+        first = cache.load('dpkg', self.statusPath, reader)
+        self.assertEqual(cache.load('dpkg', self.statusPath, reader), first)
+        self.assertEqual(len(reads), 1)
+
+        # the database changed
+        with open(self.statusPath, 'at', encoding='utf8') as f:
+            f.write('\nPackage: make\nStatus: install ok installed\nVersion: 4.3-4.1\n')
+        st = os.stat(self.statusPath)
+        os.utime(self.statusPath, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+        manager = DpkgManager(self.statusPath, cache)
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(manager.allPackages['make'], '4.3-4.1')
+        self.assertEqual(manager.checkMissing(['git', 'make', 'libssl-dev']), ['libssl-dev'])
+
+        self.assertIsNone(cache.load('dpkg', os.path.join(self.tmpDir, 'missing'), reader))
+
+
+    def testPathIndex(self):
+        dirs = [os.path.join(self.tmpDir, d) for d in ('bin1', 'bin2')]
+        for d in dirs:
+            os.makedirs(d)
+
+        def touch(path, executable):
+            with open(path, 'wt', encoding='utf8') as f:
+                f.write('#!/bin/sh\n')
+            if executable:
+                os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+        touch(os.path.join(dirs[0], 'tool'), False)
+        touch(os.path.join(dirs[1], 'tool'), True)
+        touch(os.path.join(dirs[0], 'other'), True)
+
+        index = PathIndex(os.pathsep.join(dirs + [os.path.join(self.tmpDir, 'missing')]))
+        self.assertEqual(index.find('tool'), os.path.join(dirs[1], 'tool'))
+        self.assertEqual(index.find('other'), os.path.join(dirs[0], 'other'))
+        self.assertIsNone(index.find('nothing'))
+
+
+    def testLazyManagers(self):
+        FakeManager.created = []
+        FakeManager.maxLoading = 0
+        manager = PackageManager('test', {
+            '': lambda: FakeManager('default', ['gcc']),
+            'choco': lambda: FakeManager('choco', ['nasm']),
+            'msys2': lambda: FakeManager('msys2', ['make']),
+            'other': lambda: FakeManager('other', []),
+        })
+        self.assertEqual(FakeManager.created, [])
+
+        # msys2 is only queried because the first alternative is missing
+        missing = manager.checkMissing(['gcc', 'g++', 'choco/nasm', 'choco/yasm|msys2/yasm'])
+        self.assertEqual(missing, ['choco/yasm', 'g++'])
+        self.assertEqual(sorted(FakeManager.created), ['choco', 'default', 'msys2'])
+        # default and choco were loaded at the same time
+        self.assertEqual(FakeManager.maxLoading, 2)
+
+        self.assertEqual(manager.installPlan(['g++', 'choco/yasm', 'gdb', 'choco/yasm']),
+                         {'': ['g++', 'gdb'], 'choco': ['yasm']})
+        self.assertIsNone(manager.installPlan(['unknown/pkg']))
+
+        self.assertTrue(manager.installPackages(['g++']))
+        self.assertEqual(manager.getManager('').installed, ['g++'])
+        self.assertEqual(FakeManager.created.count('default'), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from accendino.manifest import InstallManifest, MANIFEST_FILE, filesOwnedByOthers, filesystemTime, filesModifiedSince
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+        self.stage = os.path.join(self.tmpDir, 'stage')
+        self.prefix = os.path.join(self.tmpDir, 'prefix')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def write(self, root, rel, content):
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wt', encoding='utf8') as f:
+            f.write(content)
+
+
+    def testMergeInto(self):
+        self.write(self.stage, 'include/foo.h', 'int foo(void);\n')
+        self.write(self.stage, 'lib/libfoo.so.1', 'v1')
+        os.symlink('libfoo.so.1', os.path.join(self.stage, 'lib', 'libfoo.so'))
+        os.chmod(os.path.join(self.stage, 'lib', 'libfoo.so.1'), 0o755)
+
+        manifest = InstallManifest.fromTree(self.stage)
+        self.assertEqual(manifest.files(), ['include/foo.h', 'lib/libfoo.so', 'lib/libfoo.so.1'])
+        self.assertEqual(manifest.mergeInto(self.stage, self.prefix, None), 3)
+        self.assertEqual(os.readlink(os.path.join(self.prefix, 'lib', 'libfoo.so')), 'libfoo.so.1')
+        self.assertEqual(os.stat(os.path.join(self.prefix, 'lib', 'libfoo.so.1')).st_mode & 0o777, 0o755)
+
+        # only the changed files are copied again, and the ones missing in the prefix
+        self.write(self.stage, 'lib/libfoo.so.1', 'v2')
+        os.remove(os.path.join(self.prefix, 'include', 'foo.h'))
+        previous = manifest
+        manifest = InstallManifest.fromTree(self.stage)
+        self.assertEqual(manifest.mergeInto(self.stage, self.prefix, previous), 2)
+        with open(os.path.join(self.prefix, 'lib', 'libfoo.so.1'), 'rt', encoding='utf8') as f:
+            self.assertEqual(f.read(), 'v2')
+        self.assertEqual(manifest.mergeInto(self.stage, self.prefix, manifest), 0)
+
+        # a directory in the prefix is not replaced
+        os.makedirs(os.path.join(self.prefix, 'share', 'foo'))
+        self.write(self.stage, 'share/foo', 'file')
+        self.assertEqual(InstallManifest.fromTree(self.stage).mergeInto(self.stage, self.prefix, manifest), 0)
+        self.assertTrue(os.path.isdir(os.path.join(self.prefix, 'share', 'foo')))
+
+
+    def testRemoveFromPrefix(self):
+        for rel in ('include/foo/foo.h', 'include/shared.h', 'lib/libfoo.a', 'lib/other.a'):
+            self.write(self.prefix, rel, rel)
+        manifest = InstallManifest.fromFiles(self.prefix, ['include/foo/foo.h', 'include/shared.h', 'lib/libfoo.a'])
+
+        removed = manifest.removeFromPrefix(self.prefix, manifest.files(), {'include/shared.h'})
+        self.assertEqual(removed, 2)
+        self.assertFalse(os.path.exists(os.path.join(self.prefix, 'include', 'foo')))
+        self.assertTrue(os.path.exists(os.path.join(self.prefix, 'include', 'shared.h')))
+        self.assertTrue(os.path.exists(os.path.join(self.prefix, 'lib', 'other.a')))
+
+        # files already removed are not counted, the prefix itself is kept
+        self.assertEqual(manifest.removeFromPrefix(self.prefix, manifest.files()), 1)
+        os.remove(os.path.join(self.prefix, 'lib', 'other.a'))
+        manifest.removeFromPrefix(self.prefix, ['lib/other.a'])
+        self.assertEqual(os.listdir(self.prefix), [])
+
+
+    def testFilesOwnedByOthers(self):
+        treeDir = os.path.join(self.tmpDir, 'build', 'tree')
+        for name, files in (('zlib', ['include/zlib.h', 'lib/libz.a']), ('freerdp', ['include/freerdp.h'])):
+            for rel in files:
+                self.write(self.prefix, rel, rel)
+            os.makedirs(os.path.join(treeDir, name))
+            self.assertTrue(InstallManifest.fromFiles(self.prefix, files).save(os.path.join(treeDir, name, MANIFEST_FILE),
+                                                                             self.prefix))
+        os.makedirs(os.path.join(treeDir, 'notbuilt'))
+
+        self.assertEqual(filesOwnedByOthers(os.path.join(treeDir, 'freerdp'), 'freerdp'), {'include/zlib.h', 'lib/libz.a'})
+        self.assertEqual(filesOwnedByOthers(os.path.join(treeDir, 'zlib'), 'zlib'), {'include/freerdp.h'})
+        self.assertEqual(filesOwnedByOthers(os.path.join(self.tmpDir, 'missing', 'zlib'), 'zlib'), set())
+
+
+    def testFilesModifiedSince(self):
+        self.write(self.prefix, 'include/old.h', 'old\n')
+        self.write(self.prefix, 'include/rewritten.h', 'old\n')
+        for f in ('old.h', 'rewritten.h'):
+            os.utime(os.path.join(self.prefix, 'include', f), (1000, 1000))
+
+        start = filesystemTime(self.prefix)
+        self.write(self.prefix, 'include/rewritten.h', 'new\n')
+        self.write(self.prefix, 'lib/libfoo.a', 'new\n')
+        os.symlink('libfoo.a', os.path.join(self.prefix, 'lib', 'libbar.a'))
+
+        self.assertEqual(filesModifiedSince(self.prefix, start), ['include/rewritten.h', 'lib/libbar.a', 'lib/libfoo.a'])
+        # the file used to read the clock is removed
+        self.assertEqual(sorted(os.listdir(self.prefix)), ['include', 'lib'])
+
+
+if __name__ == "__main__":
+    unittest.main()
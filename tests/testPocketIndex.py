@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from accendino.main import AccendinoConfig
+from accendino.pocketindex import analyzeCode
+
+
+FILES = {
+    'main.accendino': '''
+include('liba')
+include('libb')
+include('shared')
+ARTIFACTS.append(DepsBuildArtifact('top', ['liba', 'shared']))
+''',
+    'liba.accendino': '''
+liba_deps = ['libb-artifact']
+ARTIFACTS.append(DepsBuildArtifact('liba', liba_deps))
+''',
+    'libb.accendino': '''
+ARTIFACTS.append(DepsBuildArtifact('libb', [], provides=['libb-artifact']))
+''',
+    # the includer reads sharedValue so this file can't be deferred
+    'shared.accendino': '''
+sharedValue = 1
+ARTIFACTS.append(DepsBuildArtifact('shared', []))
+''',
+}
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+        for name, content in FILES.items():
+            with open(os.path.join(self.tmpDir, name), 'wt', encoding='utf8') as f:
+                f.write(content)
+
+        with open(os.path.join(self.tmpDir, 'main.accendino'), 'at', encoding='utf8') as f:
+            f.write('PROJECT = f"p{sharedValue}"\n')
+
+        self.oldCacheHome = os.environ.get('XDG_CACHE_HOME', None)
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmpDir, 'cache')
+
+
+    def tearDown(self):
+        if self.oldCacheHome is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.oldCacheHome
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def evaluate(self, targets, lazy=True):
+        config = AccendinoConfig()
+        config.lazyIncludes = lazy
+        config.targets = targets
+        config.targetArch = config.localArch
+        config.setPlatform('Ubuntu', '22.04')
+        config.readSource(os.path.join(self.tmpDir, 'main.accendino'), True)
+        config.finalizeConfig()
+
+        plan = []
+        self.assertTrue(config.createBuildPlan(config.targets, plan))
+        return (config, [item.name for item in plan])
+
+
+    def testAnalyzeCode(self):
+        code = compile("x = 1\nARTIFACTS += [y]\ndef f():\n    return z + len(w)\n", 'test', 'exec')
+        (assigned, read) = analyzeCode(code)
+        self.assertEqual(assigned, {'x', 'ARTIFACTS', 'f'})
+        self.assertEqual(read, {'ARTIFACTS', 'y', 'z', 'w'})
+
+
+    def testLazyEvaluation(self):
+        (_config, eagerPlan) = self.evaluate(['top'], False)
+        self.assertEqual(eagerPlan, ['libb', 'liba', 'shared', 'top'])
+
+        # the first run fills the index, the second can defer liba and libb
+        self.evaluate(['shared'])
+        (config, plan) = self.evaluate(['shared'])
+        self.assertEqual(plan, ['shared'])
+        self.assertEqual(sorted(os.path.basename(d.fpath) for d in config.deferredIncludes),
+                         ['liba.accendino', 'libb.accendino'])
+        self.assertEqual(config.projectName, 'p1')
+
+        # deferred files are evaluated on demand, artifacts are kept in definition order
+        (config, plan) = self.evaluate(['top'])
+        self.assertEqual(plan, eagerPlan)
+        self.assertEqual(config.deferredIncludes, [])
+        self.assertEqual([item.name for item in config.context['ARTIFACTS']], ['liba', 'libb', 'shared', 'top'])
+        self.assertEqual(config.context['liba_deps'], ['libb-artifact'])
+
+
+    def testSeveralProviders(self):
+        # zlib-a wins with an eager evaluation, the file defining it must be evaluated even if zlib is not missing
+        files = {
+            'main.accendino': "include('zlib-a')\ninclude('zlib-b')\n"
+                              "ARTIFACTS.append(DepsBuildArtifact('app', ['zlib']))\nPROJECT = f'p{zlibValue}'\n",
+            'zlib-a.accendino': "ARTIFACTS.append(DepsBuildArtifact('zlib-a', [], provides=['zlib']))\n",
+            'zlib-b.accendino': "zlibValue = 2\nARTIFACTS.append(DepsBuildArtifact('zlib-b', [], provides=['zlib']))\n",
+        }
+        for name, content in files.items():
+            with open(os.path.join(self.tmpDir, name), 'wt', encoding='utf8') as f:
+                f.write(content)
+
+        (_config, eagerPlan) = self.evaluate(['app'], False)
+        self.assertEqual(eagerPlan, ['zlib-a', 'app'])
+
+        (config, plan) = self.evaluate(['app'])
+        self.assertEqual(plan, eagerPlan)
+        self.assertEqual(config.deferredIncludes, [])
+        self.assertEqual([item.name for item in config.context['ARTIFACTS']], ['zlib-a', 'zlib-b', 'app'])
+
+
+    def testIncludeOnce(self):
+        # the same file included with another name
+        os.symlink(self.tmpDir, os.path.join(self.tmpDir, 'alias'))
+        with open(os.path.join(self.tmpDir, 'main.accendino'), 'at', encoding='utf8') as f:
+            f.write(f"include('{os.path.join(self.tmpDir, 'alias', 'libb')}')\n")
+            f.write("include('liba', False)\n")
+
+        (config, _plan) = self.evaluate(['top'], False)
+        self.assertEqual([item.name for item in config.context['ARTIFACTS']], ['liba', 'libb', 'shared', 'top', 'liba'])
+        self.assertEqual(config.includedFiles, [os.path.realpath(os.path.join(self.tmpDir, name)) for name in
+                         ('main.accendino', 'liba.accendino', 'libb.accendino', 'shared.accendino', 'liba.accendino')])
+
+
+    def testRedefinedFrameworkName(self):
+        with open(os.path.join(self.tmpDir, 'libb.accendino'), 'wt', encoding='utf8') as f:
+            f.write("ARTIFACTS.append(DepsBuildArtifact('libb', [], provides=[f'libb-{libdir}']))\n")
+        with open(os.path.join(self.tmpDir, 'liba.accendino'), 'wt', encoding='utf8') as f:
+            f.write("ARTIFACTS.append(DepsBuildArtifact('liba', ['libb-lib32']))\n")
+
+        self.evaluate(['shared'])
+        (config, _plan) = self.evaluate(['shared'])
+        self.assertIn('libb.accendino', [os.path.basename(d.fpath) for d in config.deferredIncludes])
+
+        # the includer changes libdir, the defines recorded in the index don't apply to libb anymore
+        with open(os.path.join(self.tmpDir, 'main.accendino'), 'rt', encoding='utf8') as f:
+            content = f.read()
+        with open(os.path.join(self.tmpDir, 'main.accendino'), 'wt', encoding='utf8') as f:
+            f.write("libdir = 'lib32'\n" + content)
+
+        (config, _plan) = self.evaluate(['shared'])
+        self.assertEqual([os.path.basename(d.fpath) for d in config.deferredIncludes], ['liba.accendino'])
+        self.assertIn('libb-lib32', config.context['ARTIFACTS'][0].provides)
+
+        (config, plan) = self.evaluate(['liba'])
+        self.assertEqual(plan, ['libb', 'liba'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from accendino.builditems import DepsBuildArtifact
+from accendino.registry import ArtifactRegistry, DependencyCycleError
+
+
+class Test(unittest.TestCase):
+
+    def testLookup(self):
+        registry = ArtifactRegistry([
+            DepsBuildArtifact('libyuv', [], provides=['libyuv-artifact']),
+            DepsBuildArtifact('libyuv-static', [], provides=['libyuv-artifact']),
+            DepsBuildArtifact('libressl', [], provides='openssl'),
+            DepsBuildArtifact('openssl', []),
+        ])
+
+        self.assertEqual(registry.get('libyuv-artifact').name, 'libyuv')
+        self.assertEqual(registry.get('libyuv-static').name, 'libyuv-static')
+        # first artifact in definition order wins, and a string provides is not a substring match
+        self.assertEqual(registry.get('openssl').name, 'libressl')
+        self.assertEqual(registry.getByName('openssl').name, 'openssl')
+        self.assertIsNone(registry.get('ssl'))
+
+        self.assertEqual(registry.duplicateProviders(), {
+            'libyuv-artifact': ['libyuv', 'libyuv-static'],
+            'openssl': ['openssl', 'libressl'],
+        })
+
+
+    def testBuildPlan(self):
+        registry = ArtifactRegistry([
+            DepsBuildArtifact('zlib', [], provides=['zlib-artifact']),
+            DepsBuildArtifact('openssl', ['zlib-artifact']),
+            DepsBuildArtifact('ffmpeg', ['zlib', 'openssl']),
+            DepsBuildArtifact('freerdp', ['ffmpeg', 'openssl', 'zlib-artifact']),
+            DepsBuildArtifact('unused', ['zlib']),
+        ])
+
+        plan = [item.name for item in registry.buildPlan(['freerdp', 'zlib'])]
+        self.assertEqual(plan, ['zlib', 'openssl', 'ffmpeg', 'freerdp'])
+
+
+    def testCycle(self):
+        registry = ArtifactRegistry([
+            DepsBuildArtifact('a', ['b']),
+            DepsBuildArtifact('b', ['c-artifact']),
+            DepsBuildArtifact('c', ['a'], provides=['c-artifact']),
+        ])
+
+        with self.assertRaises(DependencyCycleError) as ctx:
+            registry.buildPlan(['a'])
+        self.assertEqual(ctx.exception.cycle, ['a', 'b', 'c', 'a'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,258 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+from accendino.builditems import DepsBuildArtifact
+from accendino.main import AccendinoConfig, runBuildPlan
+from accendino.scheduler import BuildScheduler, BackgroundStage, SourcePrefetcher
+
+
+class StubArtifact(DepsBuildArtifact):
+    ''' an artifact recording the steps that were run in events '''
+
+    def __init__(self, name, deps, events, fail=None, delay=0.0, pkgDeps=None):
+        DepsBuildArtifact.__init__(self, name, deps)
+        self.events = events
+        self.fail = fail
+        self.delay = delay
+        self.srcObj = types.SimpleNamespace(pkgDeps=pkgDeps) if pkgDeps else None
+        self.logFile = None
+
+    def step(self, what) -> bool:
+        self.events.append((what, self.name))
+        time.sleep(self.delay)
+        return what != self.fail
+
+    def init(self, _config) -> bool:
+        return True
+
+    def checkout(self, _config) -> bool:
+        return self.step('checkout')
+
+    def prepare(self, _config) -> bool:
+        return self.step('prepare')
+
+    def build(self, _config) -> bool:
+        return self.step('build')
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+        self.events = []
+        self.lock = threading.Lock()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def createPlan(self, spec):
+        ''' creates stub artifacts from a list of (name, deps) in build plan order '''
+        items = [StubArtifact(name, deps, self.events) for name, deps in spec]
+        byName = {item.name: item for item in items}
+        config = types.SimpleNamespace(getBuildItem=byName.get)
+        return (config, items)
+
+
+    def runScheduler(self, spec, maxJobs, failing=(), raising=()):
+        ''' runs a scheduler on the plan, returns its result, the order of the processed items and the maximum
+            number of items processed at the same time
+        '''
+        (config, plan) = self.createPlan(spec)
+        state = {'running': 0, 'max': 0}
+        order = []
+
+        def process(item) -> bool:
+            with self.lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+                order.append(item.name)
+
+            time.sleep(0.02)
+            with self.lock:
+                for dep in item.deps:
+                    # dependencies are finished before an item starts
+                    self.assertIn(('end', dep), self.events)
+                self.events.append(('end', item.name))
+                state['running'] -= 1
+
+            if item.name in raising:
+                raise RuntimeError('boom')
+            return item.name not in failing
+
+        ret = BuildScheduler(config, plan, maxJobs).run(process)
+        return (ret, order, state['max'])
+
+
+    def testOrdering(self):
+        spec = [('a', []), ('b', []), ('c', ['a']), ('d', ['b', 'c']), ('e', [])]
+        (ret, order, maxRunning) = self.runScheduler(spec, 3)
+        self.assertTrue(ret)
+        self.assertEqual(sorted(order), ['a', 'b', 'c', 'd', 'e'])
+        self.assertGreater(maxRunning, 1)
+        self.assertLessEqual(maxRunning, 3)
+
+
+    def testSequential(self):
+        # --jobs-artifacts=1 keeps the build plan order
+        spec = [('e', []), ('a', []), ('c', ['a']), ('b', []), ('d', ['b', 'c'])]
+        (ret, order, maxRunning) = self.runScheduler(spec, 1)
+        self.assertTrue(ret)
+        self.assertEqual(order, ['e', 'a', 'c', 'b', 'd'])
+        self.assertEqual(maxRunning, 1)
+
+
+    def testFailure(self):
+        spec = [('a', []), ('b', ['a']), ('c', ['b'])]
+        (ret, order, _) = self.runScheduler(spec, 2, failing=('a',))
+        self.assertFalse(ret)
+        self.assertEqual(order, ['a'])
+
+        # the running items are finished but no new item is started
+        spec = [('a', []), ('slow', []), ('b', ['a']), ('c', ['slow'])]
+        (ret, order, _) = self.runScheduler(spec, 2, raising=('a',))
+        self.assertFalse(ret)
+        self.assertEqual(sorted(order), ['a', 'slow'])
+
+        (ret, order, _) = self.runScheduler(spec, 1, failing=('slow',))
+        self.assertFalse(ret)
+        self.assertEqual(order, ['a', 'slow'])
+
+
+    def testPrefetcher(self):
+        (_, items) = self.createPlan([('a', []), ('b', []), ('c', []), ('d', [])])
+        release = threading.Event()
+        state = {'running': 0, 'max': 0}
+
+        def fetch(item) -> bool:
+            with self.lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            release.wait(5)
+            with self.lock:
+                state['running'] -= 1
+
+            if item.name == 'c':
+                raise OSError('network error')
+            return item.name != 'b'
+
+        prefetcher = SourcePrefetcher(2)
+        prefetcher.start(items[0:3], fetch)
+        try:
+            time.sleep(0.1)
+            self.assertEqual(state['running'], 2)
+            release.set()
+
+            self.assertTrue(prefetcher.wait(items[0]))
+            self.assertFalse(prefetcher.wait(items[1]))
+            self.assertFalse(prefetcher.wait(items[2]))
+            # not prefetched
+            self.assertTrue(prefetcher.wait(items[3]))
+        finally:
+            prefetcher.shutdown()
+        self.assertEqual(state['max'], 2)
+
+
+    def testPrefetcherShutdown(self):
+        (_, items) = self.createPlan([('a', []), ('b', []), ('c', [])])
+        started = threading.Event()
+        fetched = []
+
+        def fetch(item) -> bool:
+            started.set()
+            time.sleep(0.1)
+            fetched.append(item.name)
+            return True
+
+        # the running checkout is finished, the pending ones are cancelled
+        prefetcher = SourcePrefetcher(1)
+        prefetcher.start(items, fetch)
+        started.wait(5)
+        prefetcher.shutdown()
+        self.assertEqual(fetched, ['a'])
+
+
+    def runBuildPlan(self, spec, targets, platformFn=lambda: 0, installing=(), **kwargs):
+        ''' runs the build plan of stub artifacts like the main entry point does '''
+        config = AccendinoConfig()
+        config.distribId = 'Debian'
+        config.projectDir = pathlib.Path(self.tmpDir)
+        config.gitMirrorDir = None
+        config.downloadCacheDir = os.path.join(self.tmpDir, 'downloads')
+        config.useConfigureCache = False
+        config.maxJobs = 2
+        for k, v in kwargs.items():
+            setattr(config, k, v)
+
+        for name, deps, extra in spec:
+            config.registry.add(StubArtifact(name, deps, self.events, **extra))
+
+        buildPlan = []
+        self.assertTrue(config.createBuildPlan(targets, buildPlan))
+        buildList = [config.getBuildItem(t) for t in targets]
+
+        platformStage = BackgroundStage('platform setup', platformFn)
+        try:
+            return runBuildPlan(config, buildPlan, buildList, platformStage, set(installing))
+        finally:
+            platformStage.shutdown()
+            if config.stateDb:
+                config.stateDb.close()
+            if config.jobServer:
+                config.jobServer.close()
+
+
+    def testResumeFrom(self):
+        spec = [('a', [], {}), ('b', ['a'], {}), ('c', ['b'], {})]
+        self.assertEqual(self.runBuildPlan(spec, ['c'], resumeFrom='b'), 0)
+
+        # items before the resumed one are checked out but not built
+        self.assertEqual(sorted(self.events), [
+            ('build', 'b'), ('build', 'c'),
+            ('checkout', 'a'), ('checkout', 'b'), ('checkout', 'c'),
+            ('prepare', 'b'), ('prepare', 'c'),
+        ])
+
+
+    def testBuildFailure(self):
+        spec = [('a', [], {'fail': 'build'}), ('b', ['a'], {}), ('other', [], {'delay': 0.1})]
+        self.assertNotEqual(self.runBuildPlan(spec, ['b', 'other'], artifactJobs=2), 0)
+        self.assertNotIn(('prepare', 'b'), self.events)
+        self.assertIn(('build', 'other'), self.events)
+
+
+    def testPlatformStage(self):
+        def setupPlatform() -> int:
+            time.sleep(0.2)
+            self.events.append(('platform', 'done'))
+            return 0
+
+        # the checkout of a needs git that is being installed, b can be checked out right away
+        spec = [('a', [], {'pkgDeps': {'Debian': ['git|git-core']}}), ('b', [], {})]
+        self.assertEqual(self.runBuildPlan(spec, ['a', 'b'], setupPlatform, ['git']), 0)
+
+        self.assertLess(self.events.index(('checkout', 'b')), self.events.index(('platform', 'done')))
+        self.assertGreater(self.events.index(('checkout', 'a')), self.events.index(('platform', 'done')))
+        self.assertGreater(self.events.index(('prepare', 'b')), self.events.index(('platform', 'done')))
+
+
+    def testPlatformStageFailure(self):
+        def setupPlatform() -> int:
+            time.sleep(0.1)
+            return 4
+
+        spec = [('a', [], {'pkgDeps': {'Debian': ['git']}}), ('b', [], {})]
+        self.assertEqual(self.runBuildPlan(spec, ['a', 'b'], setupPlatform, ['git']), 4)
+        self.assertNotIn(('checkout', 'a'), self.events)
+        self.assertEqual([e for e in self.events if e[0] in ('prepare', 'build')], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from accendino.sources import GitSource, GitMirrorCache
+
+
+def git(*args, cwd=None):
+    subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args), cwd=cwd,
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class Config:
+    def __init__(self, mirrorDir):
+        self.gitMirrors = GitMirrorCache(mirrorDir)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+
+        work = os.path.join(self.tmpDir, 'work')
+        os.makedirs(work)
+        git('init', '-q', '-b', 'main', cwd=work)
+        with open(os.path.join(work, 'README'), 'wt', encoding='utf8') as f:
+            f.write('v1')
+        git('add', 'README', cwd=work)
+        git('commit', '-q', '-m', 'v1', cwd=work)
+
+        self.upstream = os.path.join(self.tmpDir, 'upstream.git')
+        git('clone', '-q', '--bare', work, self.upstream)
+        self.work = work
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def testCloneFromMirror(self):
+        config = Config(os.path.join(self.tmpDir, 'mirrors'))
+        src = GitSource(f'file://{self.upstream}', 'main', recurse_submodules=False)
+        src.init(config)
+
+        target1 = os.path.join(self.tmpDir, 'src1')
+        self.assertTrue(src.checkout(target1, subprocess.DEVNULL))
+        self.assertTrue(os.path.exists(os.path.join(target1, 'README')))
+        self.assertTrue(os.path.isdir(config.gitMirrors.mirrorPath(src.url)))
+
+        proc = subprocess.run(['git', 'remote', 'get-url', 'origin'], cwd=target1, stdout=subprocess.PIPE, encoding='utf8')
+        self.assertEqual(proc.stdout.strip(), src.url)
+
+        # the mirror is updated once per run, later clones don't need the upstream
+        os.rename(self.upstream, self.upstream + '.moved')
+        target2 = os.path.join(self.tmpDir, 'src2')
+        self.assertTrue(src.checkout(target2, subprocess.DEVNULL))
+        self.assertEqual(src.revision(target1), src.revision(target2))
+
+
+    def testRefreshThroughMirror(self):
+        src = GitSource(f'file://{self.upstream}', 'main', recurse_submodules=False)
+        src.init(Config(os.path.join(self.tmpDir, 'mirrors')))
+
+        target = os.path.join(self.tmpDir, 'src')
+        self.assertTrue(src.checkout(target, subprocess.DEVNULL))
+        before = src.revision(target)
+
+        with open(os.path.join(self.work, 'README'), 'wt', encoding='utf8') as f:
+            f.write('v2')
+        git('commit', '-q', '-a', '-m', 'v2', cwd=self.work)
+        git('push', '-q', self.upstream, 'main', cwd=self.work)
+
+        # a new run gets a new mirror cache and updates the mirror
+        src.init(Config(os.path.join(self.tmpDir, 'mirrors')))
+        self.assertTrue(src.checkout(target, subprocess.DEVNULL, True))
+        self.assertTrue(src.refreshed)
+        self.assertNotEqual(before, src.revision(target))
+        with open(os.path.join(target, 'README'), 'rt', encoding='utf8') as f:
+            self.assertEqual(f.read(), 'v2')
+
+
+    def testDirtyRevision(self):
+        src = GitSource(f'file://{self.upstream}', 'main', recurse_submodules=False)
+        clean = src.revision(self.work)
+
+        with open(os.path.join(self.work, 'README'), 'wt', encoding='utf8') as f:
+            f.write('local change')
+        dirty = src.revision(self.work)
+        self.assertTrue(dirty.startswith(f'{clean}-dirty-'))
+
+        with open(os.path.join(self.work, 'README'), 'wt', encoding='utf8') as f:
+            f.write('another local change')
+        self.assertNotEqual(src.revision(self.work), dirty)
+
+        git('checkout', '-q', 'README', cwd=self.work)
+        self.assertEqual(src.revision(self.work), clean)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import types
+import unittest
+
+from accendino.builditems import BuildArtifact
+from accendino.statedb import BuildStateDb, depsFingerprints, isOutdated
+from accendino.manifest import InstallManifest, isConfigInterfaceFile
+from accendino.utils import getPathIndex
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def testMetaMigration(self):
+        path = os.path.join(self.tmpDir, 'state.sqlite')
+
+        # database written by a version without the meta column
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE artifacts (tree TEXT NOT NULL, name TEXT NOT NULL, fingerprint TEXT NOT NULL, '
+                     'inputs TEXT NOT NULL, builtAt REAL NOT NULL, PRIMARY KEY (tree, name))')
+        conn.execute("INSERT INTO artifacts VALUES ('tree', 'zlib', 'abcd', '{}', 0)")
+        conn.commit()
+        conn.close()
+
+        db = BuildStateDb(path)
+        self.assertEqual(db.fingerprint('tree', 'zlib'), 'abcd')
+        self.assertEqual(db.meta('tree', 'zlib'), {})
+        self.assertIsNone(db.meta('tree', 'other'))
+
+        db.record('tree', 'freerdp', {'zlib': 'abcd'}, meta={'configInterface': '1234'})
+        db.close()
+
+        db = BuildStateDb(path)
+        self.assertEqual(db.meta('tree', 'freerdp'), {'configInterface': '1234'})
+        self.assertEqual(db.recordedInputs('tree', 'freerdp'), {'zlib': 'abcd'})
+        db.close()
+
+
+    def testConfigInterface(self):
+        self.assertTrue(isConfigInterfaceFile('lib/pkgconfig/zlib.pc'))
+        self.assertTrue(isConfigInterfaceFile('lib/x86_64-linux-gnu/cmake/ZLIB/ZLIBConfig.cmake'))
+        self.assertFalse(isConfigInterfaceFile('include/zlib.h'))
+        self.assertFalse(isConfigInterfaceFile('share/doc/zlib/zlib.pc'))
+
+        manifest = InstallManifest({
+            'include/zlib.h': {'size': 10, 'sha256': 'aa', 'mode': 0o644},
+            'lib/pkgconfig/zlib.pc': {'size': 10, 'sha256': 'bb', 'mode': 0o644},
+        })
+        reference = manifest.configInterface()
+
+        manifest.entries['include/zlib.h']['sha256'] = 'cc'
+        manifest.entries['lib/libz.so'] = {'link': 'libz.so.1'}
+        self.assertEqual(manifest.configInterface(), reference)
+
+        manifest.entries['lib/pkgconfig/zlib.pc']['sha256'] = 'dd'
+        self.assertNotEqual(manifest.configInterface(), reference)
+
+
+    @unittest.skipIf(any(getPathIndex().find(p) is None for p in ('gcc', 'ar', 'readelf')),
+                     'gcc, ar or readelf is not installed')
+    def testInterface(self):
+        files = ['include/foo.h', 'bin/foo', 'lib/libfoo.so.1', 'lib/libfoo.a']
+
+        def install(code, header='int foo(void);\n', program='1'):
+            os.makedirs(os.path.join(self.tmpDir, 'include'), exist_ok=True)
+            os.makedirs(os.path.join(self.tmpDir, 'bin'), exist_ok=True)
+            os.makedirs(os.path.join(self.tmpDir, 'lib'), exist_ok=True)
+            with open(os.path.join(self.tmpDir, 'include', 'foo.h'), 'wt', encoding='utf8') as f:
+                f.write(header)
+            with open(os.path.join(self.tmpDir, 'bin', 'foo'), 'wt', encoding='utf8') as f:
+                f.write(program)
+            with open(os.path.join(self.tmpDir, 'foo.c'), 'wt', encoding='utf8') as f:
+                f.write(code)
+            subprocess.run(['gcc', '-shared', '-fPIC', '-Wl,-soname,libfoo.so.1', '-o', os.path.join(self.tmpDir, 'lib', 'libfoo.so.1'),
+                            os.path.join(self.tmpDir, 'foo.c')], check=True)
+            subprocess.run(['gcc', '-c', '-o', os.path.join(self.tmpDir, 'foo.o'), os.path.join(self.tmpDir, 'foo.c')], check=True)
+            libPath = os.path.join(self.tmpDir, 'lib', 'libfoo.a')
+            if os.path.exists(libPath):
+                os.remove(libPath)
+            subprocess.run(['ar', 'rc', libPath, os.path.join(self.tmpDir, 'foo.o')], check=True)
+            return InstallManifest.fromFiles(self.tmpDir, files).interface(self.tmpDir)
+
+        reference = install('int foo(void) { return 1; }\n')
+
+        # implementation changes of the shared and static libraries don't change the interface
+        self.assertEqual(install('int foo(void) { return 2 * 21; }\n', program='2'), reference)
+        self.assertEqual(install('static int twice(int v) { return 2 * v; }\nint foo(void) { return twice(21); }\n'),
+                         reference)
+
+        self.assertNotEqual(install('int foo(void) { return 1; }\nint bar(void) { return 2; }\n'), reference)
+        self.assertNotEqual(install('int foo(void) { return 1; }\n', header='int foo(void);\n#define FOO 1\n'), reference)
+
+
+    def createArtifacts(self):
+        ''' zlib <- openssl <- crypto (only deps) <- freerdp '''
+        artifacts = {}
+        for name, deps, tree in (('zlib', [], 'tree'), ('openssl', ['zlib'], 'tree'), ('crypto', ['openssl'], None),
+                                 ('freerdp', ['crypto'], 'tree')):
+            artifacts[name] = types.SimpleNamespace(name=name, deps=deps, buildTree=tree)
+
+        db = BuildStateDb(os.path.join(self.tmpDir, 'state.sqlite'))
+        self.addCleanup(db.close)
+        config = types.SimpleNamespace(stateDb=db, getBuildItem=artifacts.get, earlyCutoff=True)
+        return (config, artifacts)
+
+
+    def testOutdated(self):
+        (config, artifacts) = self.createArtifacts()
+
+        def build(name):
+            config.stateDb.record('tree', name, depsFingerprints(config, artifacts[name]))
+
+        def outdated():
+            return sorted(name for name, a in artifacts.items() if a.buildTree and isOutdated(config, a))
+
+        # never built
+        self.assertEqual(outdated(), ['freerdp', 'openssl', 'zlib'])
+
+        for name in ('zlib', 'openssl', 'freerdp'):
+            build(name)
+        self.assertEqual(outdated(), [])
+
+        # freerdp is outdated through openssl, whose fingerprint didn't change yet
+        build('zlib')
+        self.assertEqual(outdated(), ['freerdp', 'openssl'])
+
+        build('openssl')
+        self.assertEqual(outdated(), ['freerdp'])
+        build('freerdp')
+        self.assertEqual(outdated(), [])
+
+        config.stateDb.forget('tree', 'openssl')
+        self.assertEqual(outdated(), ['freerdp', 'openssl'])
+
+
+    def testNoRecord(self):
+        (config, artifacts) = self.createArtifacts()
+        config.stateDb.record('tree', 'zlib', {})
+
+        item = BuildArtifact('openssl', ['zlib'], None)
+        item.buildTree = 'tree'
+        item.builtFile = os.path.join(self.tmpDir, 'accendino.built')
+        artifacts['openssl'] = item
+
+        # not built yet
+        self.assertFalse(item.needsRebuildFromDepsUpdates(config))
+        self.assertIsNone(config.stateDb.recordedInputs('tree', 'openssl'))
+
+        # built by a version without the state database, the current state is taken as reference
+        with open(item.builtFile, 'wt', encoding='utf8') as f:
+            f.write('built')
+        self.assertFalse(item.needsRebuildFromDepsUpdates(config))
+        self.assertEqual(config.stateDb.recordedInputs('tree', 'openssl'), depsFingerprints(config, item))
+        self.assertFalse(isOutdated(config, item))
+
+        config.stateDb.record('tree', 'zlib', {})
+        self.assertTrue(item.needsRebuildFromDepsUpdates(config))
+
+
+if __name__ == "__main__":
+    unittest.main()
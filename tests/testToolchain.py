@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from accendino.toolchain import CompilerCache, parseCcacheStatsLog, GccToolChain
+from accendino.utils import getPathIndex
+
+
+STATS_LOG = '''# /work/sources/zlib/adler32.c
+direct_cache_hit
+# /work/sources/zlib/crc32.c
+cache_miss
+# /work/sources/zlib/deflate.c
+preprocessed_cache_hit
+# /work/sources/zlib/gzlib.c
+cache_miss
+# /work/sources/zlib/test/example.c
+direct_cache_hit
+'''
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='accendino-test-')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+
+    def testWrapEnv(self):
+        cache = CompilerCache('ccache', '/usr/bin/ccache', '/cache', '/work')
+        toolchainEnv = {'CC': 'gcc', 'CXX': 'g++'}
+
+        self.assertEqual(cache.wrapEnv(toolchainEnv, ['c'], False), {'CC': 'ccache gcc', 'CXX': 'g++'})
+        self.assertEqual(cache.wrapEnv({'CC': 'ccache gcc'}, ['c'], False), {'CC': 'ccache gcc'})
+        self.assertEqual(cache.wrapEnv(toolchainEnv, ['c'], True), {
+            'CC': 'gcc', 'CXX': 'g++',
+            'CMAKE_C_COMPILER_LAUNCHER': 'ccache', 'CMAKE_CXX_COMPILER_LAUNCHER': 'ccache',
+        })
+        self.assertEqual(toolchainEnv, {'CC': 'gcc', 'CXX': 'g++'})
+
+        self.assertEqual(cache.runEnv('/build/stats'), {
+            'CCACHE_STATSLOG': '/build/stats', 'CCACHE_DIR': '/cache', 'CCACHE_BASEDIR': '/work'
+        })
+        self.assertEqual(CompilerCache('sccache', '/usr/bin/sccache').runEnv('/build/stats'), {})
+
+
+    def testStats(self):
+        statsLog = os.path.join(self.tmpDir, 'stats')
+        with open(statsLog, 'wt', encoding='utf8') as f:
+            f.write(STATS_LOG)
+
+        self.assertEqual(parseCcacheStatsLog(statsLog), (3, 2))
+        self.assertIsNone(parseCcacheStatsLog(os.path.join(self.tmpDir, 'missing')))
+
+        cache = CompilerCache('ccache', '/usr/bin/ccache')
+        cache.recordBuild('zlib', statsLog)
+        cache.recordBuild('other', os.path.join(self.tmpDir, 'missing'))
+        self.assertEqual(cache.stats, {'zlib': (3, 2)})
+
+
+    @unittest.skipIf(getPathIndex().find('gcc') is None, 'gcc is not installed')
+    def testCodegenFlags(self):
+        config = types.SimpleNamespace(linker='default', splitDwarf=True, compressDebugSections=False, buildType='release',
+                                       crossCompilation=False, distribId='Debian', distribVersion='12',
+                                       targetDistrib='Debian', targetArch='x86_64')
+        toolchain = GccToolChain(config)
+        self.assertEqual(toolchain.codegenFlags(['c']), ([], []))
+
+        config.buildType = 'debug'
+        self.assertEqual(toolchain.codegenFlags(['c']), (['-gsplit-dwarf'], []))
+        self.assertEqual(toolchain.codegenFlags(['python']), ([], []))
+
+        # missing linkers are ignored
+        config.linker = 'nonexistent'
+        self.assertEqual(toolchain.codegenFlags(['c']), (['-gsplit-dwarf'], []))
+        self.assertEqual(toolchain.probedFlags[(('-fuse-ld=nonexistent',), True)], False)
+
+        config.linker = 'mold'
+        self.assertIn('mold', toolchain.requiredPackages(['c']))
+        self.assertNotIn('mold', toolchain.requiredPackages(['python']))
+
+
+if __name__ == "__main__":
+    unittest.main()